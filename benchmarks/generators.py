@@ -0,0 +1,192 @@
+import os
+import random
+import struct
+from typing import Callable, Dict, Tuple
+
+
+# Each generator writes a synthetic project into the given directory and returns the main .asm file.
+# The scale parameter multiplies the size of the workload, 1.0 is a medium sized game.
+
+
+INSTRUCTIONS = [
+    "nop", "ld a, b", "ld b, a", "ld c, $12", "ld hl, {label}", "ld de, {label}", "ld a, [hl+]", "ld [hl], a",
+    "ld a, [{label}]", "ld [{label}], a", "ldh a, [$FF44]", "add a, c", "sub a, $10", "and a, $0F", "or a, d",
+    "xor a, a", "cp a, $90", "inc hl", "dec bc", "inc a", "push bc", "pop de", "jr nz, {label}", "jp z, {label}",
+    "call {label}", "ret", "ret nc", "bit 3, a", "res 1, b", "set 7, [hl]", "swap a", "rlca", "srl b",
+]
+
+
+def _header(entry: str = "entry") -> str:
+    return f'#INCLUDE "gbz80/all.asm"\nGB_HEADER "BENCH", GB_MCB_ROM_ONLY, {entry}\n'
+
+
+def generate_instructions(directory: str, scale: float) -> str:
+    """Plain instruction stream against gbz80/all.asm, spread over ROMX sections."""
+    rnd = random.Random(1)
+    count = int(20000 * scale)
+    lines = [_header(), '#SECTION "Entry", ROM0 {\nentry:\n    jp label0\n}']
+    per_section = 2000
+    for section_nr in range((count + per_section - 1) // per_section):
+        lines.append(f'#SECTION "Code{section_nr}", ROMX {{')
+        for n in range(section_nr * per_section, min(count, (section_nr + 1) * per_section)):
+            if n % 16 == 0:
+                lines.append(f"label{n // 16}:")
+            target = f"label{max(0, n // 16 - rnd.randint(0, 1))}"
+            lines.append("    " + rnd.choice(INSTRUCTIONS).format(label=target))
+        lines.append("}")
+    return _write(directory, "instructions.asm", lines)
+
+
+def generate_macro_nesting(directory: str, scale: float) -> str:
+    """Macros calling macros calling macros, using the block macros from gbz80/extra."""
+    depth = 12
+    count = int(1500 * scale)
+    lines = [_header(), '#INCLUDE "gbz80/extra/if.asm"\n#INCLUDE "gbz80/extra/loop.asm"\n#INCLUDE "gbz80/extra/ld16.asm"']
+    lines.append("#MACRO level0 _reg, _value {\n    ld16 _reg, [_value]\n    ld a, LOW(_value)\n}")
+    for n in range(1, depth):
+        lines.append(f"#MACRO level{n} _reg, _value {{\n    level{n - 1} _reg, _value + 1\n    if nz {{\n        inc a\n    }}\n}}")
+    lines.append('#SECTION "Entry", ROM0 {\nentry:\n    jp code0\n}')
+    per_section = 40
+    for section_nr in range((count + per_section - 1) // per_section):
+        lines.append(f'#SECTION "Code{section_nr}", ROMX {{\ncode{section_nr}:')
+        for n in range(section_nr * per_section, min(count, (section_nr + 1) * per_section)):
+            lines.append(f"    loop c, {n % 200 + 1} {{\n        level{n % depth} hl, ${0xC000 + n % 0x1000:04x}\n    }}")
+        lines.append("}")
+    return _write(directory, "macro_nesting.asm", lines)
+
+
+def generate_db_tables(directory: str, scale: float) -> str:
+    """Huge generated data tables, the way conversion scripts output them."""
+    rnd = random.Random(2)
+    rows = int(40000 * scale)
+    lines = [_header(), '#SECTION "Entry", ROM0 {\nentry:\n    jr entry\n}']
+    per_section = 1000
+    for section_nr in range((rows + per_section - 1) // per_section):
+        lines.append(f'#SECTION "Table{section_nr}", ROMX {{\ntable{section_nr}:')
+        for n in range(section_nr * per_section, min(rows, (section_nr + 1) * per_section)):
+            if n % 4 == 0:
+                lines.append("    dw " + ", ".join(f"table{section_nr} + {rnd.randint(0, 255)}" for _ in range(8)))
+            else:
+                lines.append("    db " + ", ".join(f"${rnd.randint(0, 255):02x}" for _ in range(16)))
+        lines.append("}")
+    return _write(directory, "db_tables.asm", lines)
+
+
+def generate_sections(directory: str, scale: float) -> str:
+    """Many small floating sections, filling hundreds of ROMX banks."""
+    rnd = random.Random(3)
+    count = int(3000 * scale)
+    lines = [_header(), '#SECTION "Entry", ROM0 {\nentry:\n    jr entry\n}']
+    for n in range(count):
+        lines.append(f'#SECTION "Small{n}", ROMX {{\nsmall{n}:\n    ds {rnd.randint(16, 2000)}\n    dw small{rnd.randint(0, count - 1)}\n}}')
+    for n in range(int(200 * scale)):
+        lines.append(f'#SECTION "Ram{n}", WRAM0 {{\nram{n}:\n    ds {rnd.randint(1, 16)}\n}}')
+    return _write(directory, "sections.asm", lines)
+
+
+def generate_graphics(directory: str, scale: float) -> str:
+    """Large tilesheets imported with #INCGFX."""
+    import PIL.Image
+    rnd = random.Random(4)
+    count = max(1, int(8 * scale))
+    colors = [(255, 255, 255), (170, 170, 170), (85, 85, 85), (0, 0, 0)]
+    lines = [_header(), '#SECTION "Entry", ROM0 {\nentry:\n    jr entry\n}']
+    for n in range(count):
+        img = PIL.Image.new("RGB", (128, 256))
+        # Random 8x8 blocks of a few shared tiles, so UNIQUE has work to do.
+        tiles = [[rnd.choice(colors) for _ in range(64)] for _ in range(32)]
+        for ty in range(32):
+            for tx in range(16):
+                tile = rnd.choice(tiles)
+                for y in range(8):
+                    for x in range(8):
+                        img.putpixel((tx * 8 + x, ty * 8 + y), tile[y * 8 + x])
+        img.save(os.path.join(directory, f"sheet{n}.png"))
+        lines.append(f'#SECTION "Gfx{n}", ROMX {{\n    #INCGFX "sheet{n}.png", COLORMAP[$FFFFFF, $AAAAAA, $555555, $000000]\n}}')
+        lines.append(f'#SECTION "Unique{n}", ROMX {{\n    #INCGFX "sheet{n}.png", UNIQUE\n    #INCGFX "sheet{n}.png", TILEMAP\n}}')
+    return _write(directory, "graphics.asm", lines)
+
+
+def _rgbds_string(s: str) -> bytes:
+    return s.encode() + b'\x00'
+
+
+def _rgbds_object(rnd: random.Random, nr: int, section_count: int) -> bytes:
+    """RGB9 revision 13 object, with code sections that reference each other through patches."""
+    symbols = [(f"obj{nr}_sym{n}", n, 0) for n in range(section_count)]
+    result = b'RGB9' + struct.pack("<IIII", 13, len(symbols), section_count, 1)
+    result += struct.pack("<iIB", -1, 0, 2) + _rgbds_string(f"obj{nr}.asm")
+    for name, section_id, value in symbols:
+        result += _rgbds_string(name) + bytes([2]) + struct.pack("<iiii", 0, 1, section_id, value)
+    for idx in range(section_count):
+        size = rnd.randint(64, 1024)
+        data = bytes(rnd.randint(0, 255) for _ in range(size))
+        result += _rgbds_string(f"obj{nr}_section{idx}") + struct.pack("<iiiBiiBi", 0, 1, size, 2, -1, -1, 0, 0)
+        result += data
+        patches = []
+        for offset in range(0, size - 2, 8):
+            target = rnd.randint(0, section_count - 1)
+            # symbol + constant, and a BANK() of the symbol.
+            rpn = bytes([0x81]) + struct.pack("<I", target) + bytes([0x80]) + struct.pack("<i", offset) + bytes([0x00])
+            patches.append((offset, 1, rpn))
+            patches.append((offset + 2, 0, bytes([0x50]) + struct.pack("<I", target)))
+        result += struct.pack("<I", len(patches))
+        for offset, patch_type, rpn in patches:
+            result += struct.pack("<iiiiiBi", 0, 1, offset, idx, offset, patch_type, len(rpn)) + rpn
+    result += struct.pack("<I", 0)
+    return result
+
+
+def _sdcc_object(rnd: random.Random, nr: int, symbol_count: int) -> Tuple[str, str]:
+    """SDCC .rel/.lst pair, one banked code area with calls between its own functions."""
+    stride = 16
+    size = symbol_count * stride
+    rel = ["XL4", f"H 1 areas {symbol_count} global symbols", f"M sdcc{nr}", "O -mgbz80 -msm83",
+           f"A _CODE_{nr + 1} size {size:X} flags 0 addr 0"]
+    lst = []
+    for n in range(symbol_count):
+        rel.append(f"S _sdcc{nr}_f{n} Def{n * stride:04X}")
+        lst.append(" " * 40 + f"_sdcc{nr}_f{n}::")
+        lst.append(" " * 40 + f";sdcc{nr}.c:{n * 3 + 1}")
+        lst.append(f"    {n * stride:08X}" + " " * 28 + "call")
+    for n in range(symbol_count):
+        offset = n * stride
+        target = rnd.randint(0, symbol_count - 1) * stride
+        body = [0xCD, target & 0xFF, target >> 8] + [rnd.randint(0, 255) for _ in range(stride - 3)]
+        rel.append(f"T {offset & 0xFF:02X} {offset >> 8:02X} 00 00 " + " ".join(f"{b:02X}" for b in body))
+        # Area relative 16 bit reference at the call target, offsets count the 4 address bytes of the T line.
+        rel.append("R 00 00 00 00 00 05 00 00")
+    return "\n".join(rel) + "\n", "\n".join(lst) + "\n"
+
+
+def generate_objects(directory: str, scale: float) -> str:
+    """Synthetic RGBDS and SDCC objects, imported with wildcards."""
+    rnd = random.Random(5)
+    count = max(1, int(8 * scale))
+    for n in range(count):
+        with open(os.path.join(directory, f"obj{n}.o"), "wb") as f:
+            f.write(_rgbds_object(rnd, n, 20))
+        rel, lst = _sdcc_object(rnd, n, 200)
+        with open(os.path.join(directory, f"sdcc{n}.rel"), "wt") as f:
+            f.write(rel)
+        with open(os.path.join(directory, f"sdcc{n}.lst"), "wt") as f:
+            f.write(lst)
+    lines = [_header(), '#SECTION "Entry", ROM0 {\nentry:\n    jr entry\n}', '#INCRGBDS "obj*.o"', '#INCSDCC "sdcc*.rel"']
+    return _write(directory, "objects.asm", lines)
+
+
+def _write(directory: str, filename: str, lines) -> str:
+    filename = os.path.join(directory, filename)
+    with open(filename, "wt") as f:
+        f.write("\n".join(lines) + "\n")
+    return filename
+
+
+WORKLOADS: Dict[str, Callable[[str, float], str]] = {
+    "instructions": generate_instructions,
+    "macro_nesting": generate_macro_nesting,
+    "db_tables": generate_db_tables,
+    "sections": generate_sections,
+    "graphics": generate_graphics,
+    "objects": generate_objects,
+}
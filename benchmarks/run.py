@@ -0,0 +1,147 @@
+"""Benchmark runner for synthetic workloads.
+
+Usage:
+    python benchmarks/run.py                      Run all workloads and compare against benchmarks/baseline.json
+    python benchmarks/run.py --update-baseline    Run all workloads and store the results as new baseline
+    python benchmarks/run.py --scale 4 instructions sections
+
+Timings are the best of --repeat runs. Peak memory is measured in a separate run with tracemalloc,
+as tracing slows down the assembler too much to time it at the same time.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Assembler
+from generators import WORKLOADS
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TIME_KEYS = ["tokenize", "process", "link", "build", "total"]
+# Differences smaller than this (in seconds) are timer noise, not regressions.
+MIN_TIME_DIFFERENCE = 0.005
+
+
+def _build(filename: str) -> Dict[str, Any]:
+    a = Assembler(profile=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        a.process_file(filename)
+        processed = time.perf_counter()
+        a.link()
+        linked = time.perf_counter()
+        rom = a.build_rom()
+        built = time.perf_counter()
+    tokenize = sum(entry["total"] for entry in a.profiler.to_json().get("tokenize", {}).values())
+    return {
+        "tokenize": tokenize,
+        "process": processed - start - tokenize,
+        "link": linked - processed,
+        "build": built - linked,
+        "total": built - start,
+        "rom_size": len(rom),
+    }
+
+
+def run_workload(name: str, scale: float, repeat: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        filename = WORKLOADS[name](directory, scale)
+        with open(filename, "rt") as f:
+            lines = sum(1 for _ in f)
+        result = None
+        for _ in range(repeat):
+            run = _build(filename)
+            if result is None:
+                result = run
+            else:
+                for key in TIME_KEYS:
+                    result[key] = min(result[key], run[key])
+        tracemalloc.start()
+        try:
+            _build(filename)
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    result["lines"] = lines
+    result["lines_per_second"] = lines / result["total"]
+    return result
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> int:
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name}: no baseline")
+            continue
+        base = baseline[name]
+        if base.get("scale") != result["scale"]:
+            print(f"{name}: baseline was made with scale {base.get('scale')}, skipping comparison")
+            continue
+        for key in TIME_KEYS + ["peak_memory"]:
+            if not base.get(key):
+                continue
+            if key in TIME_KEYS and abs(result[key] - base[key]) < MIN_TIME_DIFFERENCE:
+                continue
+            ratio = result[key] / base[key]
+            if ratio > 1.0 + threshold:
+                print(f"{name}: REGRESSION {key} {base[key]:.4g} -> {result[key]:.4g} ({(ratio - 1.0) * 100:+.0f}%)")
+                regressions += 1
+            elif ratio < 1.0 - threshold:
+                print(f"{name}: improved {key} {base[key]:.4g} -> {result[key]:.4g} ({(ratio - 1.0) * 100:+.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workloads", nargs="*", help=f"Workloads to run: {', '.join(WORKLOADS.keys())}")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative change that is reported as regression")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    names = args.workloads or list(WORKLOADS.keys())
+    for name in names:
+        if name not in WORKLOADS:
+            parser.error(f"Unknown workload: {name}")
+
+    results = {}
+    print(f"{'workload':16} {'lines':>8} {'tokenize':>9} {'process':>9} {'link':>9} {'build':>9} {'total':>9} {'lines/s':>9} {'peak MB':>8}")
+    for name in names:
+        result = run_workload(name, args.scale, args.repeat)
+        result["scale"] = args.scale
+        results[name] = result
+        print(f"{name:16} {result['lines']:8} {result['tokenize']:9.3f} {result['process']:9.3f} {result['link']:9.3f} {result['build']:9.3f} {result['total']:9.3f} {result['lines_per_second']:9.0f} {result['peak_memory'] / 1024 / 1024:8.1f}")
+
+    if args.json:
+        with open(args.json, "wt") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "rt") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "wt") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "rt") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
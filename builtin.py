@@ -43,6 +43,8 @@ def bank(assembler, param: AstNode) -> AstNode:
     label_token = param.left.token
     if label_token.kind == "CURADDR":
         section = assembler.linking_section
+    elif label_token.kind == "ALABEL":
+        section, _ = assembler.get_anonymous_label(label_token.value)
     elif label_token.kind != "ID":
         raise AssemblerException(param.token, "Expected a label to BANK()")
     else:
@@ -91,3 +93,29 @@ def checksum(assembler, param: AstNode) -> AstNode:
         start, end = param.left.token.value, param.right.left.token.value
     return AstNode('value', Token('NUMBER', sum(assembler.get_rom()[start:end]), 0, ""), None, None)
 
+
+def _label_location(assembler, node: AstNode, function_name: str):
+    label_token = node.token
+    if label_token.kind == "ALABEL":
+        section, offset = assembler.get_anonymous_label(label_token.value)
+    elif label_token.kind != "ID":
+        raise AssemblerException(label_token, f"Expected a label to {function_name}()")
+    else:
+        section, offset = assembler.get_label(label_token.value)
+    if not section:
+        raise AssemblerException(label_token, f"Could not find label {label_token.value} for {function_name}()")
+    return section, offset
+
+
+@builtin(function_type="link")
+def cycles(assembler, param: AstNode) -> AstNode:
+    if not param or not param.right or param.right.right:
+        raise AssemblerException(param.token if param else None, "cycles requires 2 arguments")
+    start_section, start = _label_location(assembler, param.left, "CYCLES")
+    end_section, end = _label_location(assembler, param.right.left, "CYCLES")
+    if start_section is not end_section:
+        raise AssemblerException(param.right.left.token, "CYCLES() requires both labels to be in the same section")
+    if end < start:
+        raise AssemblerException(param.right.left.token, "CYCLES() end label is before the start label")
+    _, worst = assembler.get_cycles(start_section, start, end)
+    return AstNode('value', Token('NUMBER', worst, param.left.token.line_nr, param.left.token.filename), None, None)
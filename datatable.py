@@ -0,0 +1,127 @@
+import array
+import csv
+import io
+import json
+import sys
+
+from exception import AssemblerException
+from tokenizer import Token
+from typing import List, Dict, Any, Tuple
+
+
+# Column type name -> (array typecode, big endian)
+COLUMN_TYPES = {
+    "U8": ("B", False),
+    "I8": ("b", False),
+    "U16LE": ("H", False),
+    "I16LE": ("h", False),
+    "U16BE": ("H", True),
+    "I16BE": ("h", True),
+}
+
+
+def _bool_option(file_token: Token, options: Dict[str, List[List[Token]]], key: str) -> bool:
+    if key not in options:
+        return False
+    if len(options.pop(key)) != 0:
+        raise AssemblerException(file_token, f"Syntax error in {key}, expected no values after it")
+    return True
+
+
+def _parse_cell(file_token: Token, cell: Any, row_number: int) -> int:
+    if isinstance(cell, bool):
+        return int(cell)
+    if isinstance(cell, int):
+        return cell
+    if isinstance(cell, str):
+        cell = cell.strip()
+        try:
+            if cell.startswith("$"):
+                return int(cell[1:], 16)
+            if cell.startswith("%"):
+                return int(cell[1:], 2)
+            return int(cell, 0)
+        except ValueError:
+            pass
+    raise AssemblerException(file_token, f"Could not parse value {cell!r} in row {row_number}")
+
+
+def _read_rows(file_token: Token, raw: bytes, filename: str, header: bool) -> Tuple[List[List[Any]], List[int]]:
+    """Returns the rows and the number of each row in the file, for error messages."""
+    text = raw.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise AssemblerException(file_token, f"Failed to parse JSON: {e}")
+        if not isinstance(rows, list):
+            raise AssemblerException(file_token, "JSON data needs to be a list of rows")
+        result = []
+        for row in rows:
+            if isinstance(row, dict):
+                row = list(row.values())
+            elif not isinstance(row, list):
+                row = [row]
+            result.append(row)
+        return result, list(range(1, len(result) + 1))
+    reader = csv.reader(io.StringIO(text))
+    rows = []
+    row_numbers = []
+    for row in reader:
+        if row:
+            rows.append(row)
+            row_numbers.append(reader.line_num)
+    if header:
+        return rows[1:], row_numbers[1:]
+    return rows, row_numbers
+
+
+def read(file_token: Token, filename: str, raw: bytes, options: Dict[str, List[List[Token]]]) -> Tuple[bytes, int]:
+    """Pack the rows of a CSV or JSON (detected from the filename) data file, returns the data and the number of rows.
+    options are the token lists of the bracket parameters per option name."""
+    if "FORMAT" not in options or len(options["FORMAT"]) == 0:
+        raise AssemblerException(file_token, "#INCDATA requires a FORMAT[type, ...]")
+    columns = []
+    for column in options.pop("FORMAT"):
+        if len(column) != 1 or column[0].kind != "ID":
+            raise AssemblerException(file_token, "Syntax error in FORMAT[type, ...]")
+        name = column[0].value.upper()
+        if name != "SKIP" and name not in COLUMN_TYPES:
+            raise AssemblerException(column[0], f"Unknown column type: {column[0].value}")
+        columns.append(name)
+    header = _bool_option(file_token, options, "HEADER")
+    column_major = _bool_option(file_token, options, "COLUMNMAJOR")
+    if options:
+        raise AssemblerException(file_token, f"Unknown option: {next(iter(options.keys()))}")
+
+    rows, row_numbers = _read_rows(file_token, raw, filename, header)
+
+    for row_number, row in zip(row_numbers, rows):
+        if len(row) != len(columns):
+            raise AssemblerException(file_token, f"Row {row_number} has {len(row)} columns, FORMAT specifies {len(columns)}")
+
+    # Pack each column as a whole, then interleave them for row major layouts.
+    packed = []
+    for column_idx, column in enumerate(columns):
+        if column == "SKIP":
+            continue
+        typecode, big_endian = COLUMN_TYPES[column]
+        values = [_parse_cell(file_token, row[column_idx], row_number) for row_number, row in zip(row_numbers, rows)]
+        try:
+            column_data = array.array(typecode, values)
+        except OverflowError:
+            raise AssemblerException(file_token, f"Value out of range for {column} in column {column_idx + 1}")
+        if big_endian != (sys.byteorder == "big"):
+            column_data.byteswap()
+        packed.append((column_data.itemsize, column_data.tobytes()))
+
+    if column_major:
+        return b''.join(data for _, data in packed), len(rows)
+    row_size = sum(size for size, _ in packed)
+    result = bytearray(row_size * len(rows))
+    offset = 0
+    for size, data in packed:
+        for n in range(size):
+            result[offset + n::row_size] = data[n::size]
+        offset += size
+    return bytes(result), len(rows)
@@ -1,10 +1,9 @@
+import abc
 from tokenizer import Token, Tokenizer
 from exception import AssemblerException
 from typing import Tuple, Dict, Callable, List, Optional
 
 
-g_anonymous_label_count = 0
-
 PREC_NONE = 0
 PREC_ASSIGNMENT = 1  # =
 PREC_LOGIC_OR = 2  # or
@@ -53,18 +52,33 @@ class AstNode:
                 return f"{self.left}, {self.right}"
             return f"{self.left}"
         if self.kind == 'value':
+            if self.token.kind == 'ALABEL':
+                return f"__anonymous_{self.token.value}"
             return f"{self.token.value}"
         if self.right:
             return f"({self.left} {self.kind} {self.right})"
         return f"({self.kind} {self.left})"
 
 
-def parse_value(tok: Tokenizer) -> AstNode:
+class NativeExpression(AstNode, abc.ABC):
+    """Expression imported from an object file, evaluated directly by the linker instead of through an AST.
+    Subclasses provide the token (used for error reporting) and evaluate()"""
+    def __init__(self):
+        self.kind = 'native'
+        self.left = None
+        self.right = None
+
+    @abc.abstractmethod
+    def evaluate(self, assembler, offset: Optional[int]) -> Optional[int]:
+        """Returns the value, or None if it cannot be resolved yet."""
+
+
+def parse_value(tok: Tokenizer, anonymous_label_count: int) -> AstNode:
     t = tok.pop()
     return AstNode("value", t, None, None)
 
 
-def parse_anonymous_label(tok: Tokenizer) -> AstNode:
+def parse_anonymous_label(tok: Tokenizer, anonymous_label_count: int) -> AstNode:
     t = tok.pop()
     offset = 0
     for c in t.value[1:]:
@@ -74,23 +88,23 @@ def parse_anonymous_label(tok: Tokenizer) -> AstNode:
             offset -= 1
     if t.value[1] == '-':
         offset += 1
-    return AstNode("value", Token('ID', f"__anonymous_{g_anonymous_label_count + offset}", t.line_nr, t.filename), None, None)
+    return AstNode("value", Token('ALABEL', anonymous_label_count + offset, t.line_nr, t.filename), None, None)
 
 
-def parse_grouping(tok: Tokenizer) -> AstNode:
+def parse_grouping(tok: Tokenizer, anonymous_label_count: int) -> AstNode:
     tok.pop()
-    res = parse_precedence(tok, PREC_ASSIGNMENT)
+    res = parse_precedence(tok, PREC_ASSIGNMENT, anonymous_label_count)
     tok.expect(')')
     return res
 
 
-def parse_call(tok: Tokenizer) -> AstNode:
+def parse_call(tok: Tokenizer, anonymous_label_count: int) -> AstNode:
     func = AstNode('call', tok.pop(), None, None)
     if tok.match(')'):
         return func
-    args = [parse_precedence(tok, PREC_ASSIGNMENT)]
+    args = [parse_precedence(tok, PREC_ASSIGNMENT, anonymous_label_count)]
     while tok.match(','):
-        args.append(parse_precedence(tok, PREC_ASSIGNMENT))
+        args.append(parse_precedence(tok, PREC_ASSIGNMENT, anonymous_label_count))
     tok.expect(')')
     node = func
     for arg in args:
@@ -99,26 +113,26 @@ def parse_call(tok: Tokenizer) -> AstNode:
     return func
 
 
-def parse_ref(tok: Tokenizer) -> AstNode:
+def parse_ref(tok: Tokenizer, anonymous_label_count: int) -> AstNode:
     t = tok.pop()
-    res = parse_precedence(tok, PREC_ASSIGNMENT)
+    res = parse_precedence(tok, PREC_ASSIGNMENT, anonymous_label_count)
     tok.expect(']')
     return AstNode('REF', t, res, None)
 
 
-def parse_unary(tok: Tokenizer) -> AstNode:
+def parse_unary(tok: Tokenizer, anonymous_label_count: int) -> AstNode:
     t = tok.pop()
-    return AstNode(t.kind, t, parse_precedence(tok, PREC_UNARY), None)
+    return AstNode(t.kind, t, parse_precedence(tok, PREC_UNARY, anonymous_label_count), None)
 
 
-def parse_binary(tok: Tokenizer) -> Tuple[str, AstNode]:
+def parse_binary(tok: Tokenizer, anonymous_label_count: int) -> Tuple[str, AstNode]:
     t = tok.pop()
     rule = EXPRESSION_RULES[t.kind]
-    res = parse_precedence(tok, rule[2] + 1)
+    res = parse_precedence(tok, rule[2] + 1, anonymous_label_count)
     return t.kind, res
 
 
-EXPRESSION_RULES: Dict[str, Tuple[Callable[[Tokenizer], AstNode], Callable[[Tokenizer], Tuple[str, AstNode]], int]] = {
+EXPRESSION_RULES: Dict[str, Tuple[Callable[[Tokenizer, int], AstNode], Callable[[Tokenizer, int], Tuple[str, AstNode]], int]] = {
     'ID': (parse_value, None, PREC_NONE),
     'ALABEL': (parse_anonymous_label, None, PREC_NONE),
     'STRING': (parse_value, None, PREC_NONE),
@@ -151,30 +165,30 @@ EXPRESSION_RULES: Dict[str, Tuple[Callable[[Tokenizer], AstNode], Callable[[Toke
 }
 
 
-def parse_precedence(tok: Tokenizer, precedence: int) -> AstNode:
+def parse_precedence(tok: Tokenizer, precedence: int, anonymous_label_count: int) -> AstNode:
     token = tok.peek()
     if token.kind not in EXPRESSION_RULES:
         raise AssemblerException(token, f"Unexpected: {token.value} ({token.kind})")
     prefix_rule = EXPRESSION_RULES[token.kind][0]
     if prefix_rule is None:
         raise AssemblerException(token, f"Expect expression, but got: {token.kind}")
-    a = prefix_rule(tok)
+    a = prefix_rule(tok, anonymous_label_count)
 
     while tok.peek().kind in EXPRESSION_RULES and precedence <= EXPRESSION_RULES[tok.peek().kind][2]:
         t = tok.peek()
         infix_rule = EXPRESSION_RULES[t.kind][1]
         assert infix_rule is not None
-        b, c = infix_rule(tok)
+        b, c = infix_rule(tok, anonymous_label_count)
         a = AstNode(b, t, a, c)
     return a
 
 
-def parse_expression(tokens: List[Token], anonymous_label_count) -> AstNode:
-    global g_anonymous_label_count
-    g_anonymous_label_count = anonymous_label_count
+def parse_expression(tokens: List[Token], anonymous_label_count: int) -> AstNode:
+    """Parse the tokens of an expression. Anonymous label references are relative to anonymous_label_count,
+    the number of anonymous labels defined before this expression."""
     tok = Tokenizer()
     tok.prepend(tokens)
-    result = parse_precedence(tok, PREC_ASSIGNMENT)
+    result = parse_precedence(tok, PREC_ASSIGNMENT, anonymous_label_count)
     if not tok.match('EOF'):
         raise AssemblerException(tok.pop(), "Syntax error")
     return result
@@ -0,0 +1,98 @@
+import abc
+import fnmatch
+import glob
+import os
+from typing import Dict, List, Optional, Union
+
+
+class FileProvider(abc.ABC):
+    """Access to the files of a build: sources, included binaries, graphics, data tables and object files.
+    Paths are the paths as the assembler builds them from the include paths."""
+    @abc.abstractmethod
+    def exists(self, path: str) -> bool:
+        """True if the file exists."""
+
+    @abc.abstractmethod
+    def read_bytes(self, path: str) -> bytes:
+        """Contents of a file."""
+
+    @abc.abstractmethod
+    def read_text(self, path: str) -> str:
+        """Contents of a source file, with Unix line endings."""
+
+    @abc.abstractmethod
+    def glob(self, pattern: str) -> List[str]:
+        """Sorted list of the paths matching a wildcard pattern."""
+
+    @abc.abstractmethod
+    def realpath(self, path: str) -> str:
+        """Unique name of the file, used to recognize the same file included through different paths."""
+
+    def __deepcopy__(self, memo) -> "FileProvider":
+        # Providers are not changed by the assembler, so cloned assemblers share them.
+        return self
+
+
+class DiskFileProvider(FileProvider):
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def read_text(self, path: str) -> str:
+        with open(path, "rt") as f:
+            return f.read()
+
+    def glob(self, pattern: str) -> List[str]:
+        return sorted(glob.glob(pattern))
+
+    def realpath(self, path: str) -> str:
+        return os.path.realpath(path)
+
+
+class MemoryFileProvider(FileProvider):
+    """Files from a dictionary of path to contents, so a build does not need to touch the disk.
+    Files that are not in the dictionary are looked up in the fallback provider, if given,
+    for example a DiskFileProvider for the gbz80 library files that come with the assembler."""
+    def __init__(self, files: Dict[str, Union[bytes, str]], fallback: Optional[FileProvider] = None):
+        self.__files: Dict[str, bytes] = {}
+        for path, contents in files.items():
+            self.__files[os.path.normpath(path)] = contents.encode() if isinstance(contents, str) else contents
+        self.__fallback = fallback
+
+    def exists(self, path: str) -> bool:
+        if os.path.normpath(path) in self.__files:
+            return True
+        return self.__fallback is not None and self.__fallback.exists(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        contents = self.__files.get(os.path.normpath(path))
+        if contents is not None:
+            return contents
+        if self.__fallback is not None:
+            return self.__fallback.read_bytes(path)
+        raise FileNotFoundError(path)
+
+    def read_text(self, path: str) -> str:
+        contents = self.__files.get(os.path.normpath(path))
+        if contents is not None:
+            # Same newline handling as reading a file in text mode.
+            return contents.decode().replace("\r\n", "\n").replace("\r", "\n")
+        if self.__fallback is not None:
+            return self.__fallback.read_text(path)
+        raise FileNotFoundError(path)
+
+    def glob(self, pattern: str) -> List[str]:
+        pattern = os.path.normpath(pattern)
+        matches = sorted(path for path in self.__files if fnmatch.fnmatchcase(path, pattern))
+        if not matches and self.__fallback is not None:
+            return self.__fallback.glob(pattern)
+        return matches
+
+    def realpath(self, path: str) -> str:
+        path = os.path.normpath(path)
+        if path not in self.__files and self.__fallback is not None:
+            return self.__fallback.realpath(path)
+        return path
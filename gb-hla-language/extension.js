@@ -0,0 +1,35 @@
+const vscode = require("vscode");
+const { LanguageClient } = require("vscode-languageclient/node");
+
+let client = null;
+
+function activate(context) {
+    const config = vscode.workspace.getConfiguration("gbhla");
+    const serverPath = config.get("serverPath");
+    if (!serverPath) {
+        // Without the path to lsp.py only the syntax highlighting is available.
+        return;
+    }
+    client = new LanguageClient("gbhla", "GB.HLA", {
+        command: config.get("pythonPath"),
+        args: [serverPath],
+    }, {
+        documentSelector: [{ scheme: "file", language: "gbhla" }],
+        initializationOptions: {
+            prelude: config.get("prelude"),
+            includePaths: config.get("includePaths"),
+            fastInstructions: config.get("fastInstructions"),
+            statementCache: config.get("statementCache"),
+            lineMemo: config.get("lineMemo"),
+        },
+    });
+    client.start();
+}
+
+function deactivate() {
+    if (client) {
+        return client.stop();
+    }
+}
+
+module.exports = { activate, deactivate };
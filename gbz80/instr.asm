@@ -8,369 +8,370 @@
 #FMACRO LOW _value { ((_value) & $FF) }
 #FMACRO JR_OFFSET _target { _target - @ }
 #MACRO adc _value { adc a, _value }
-#MACRO adc a, [hl] { db $8e }
-#MACRO adc a, _value { db $ce, _value }
-#MACRO adc a, a { db $8f }
-#MACRO adc a, b { db $88 }
-#MACRO adc a, c { db $89 }
-#MACRO adc a, d { db $8a }
-#MACRO adc a, e { db $8b }
-#MACRO adc a, h { db $8c }
-#MACRO adc a, l { db $8d }
+#MACRO adc a, [hl] { #CYCLES 8 db $8e }
+#MACRO adc a, _value { #CYCLES 8 db $ce, _value }
+#MACRO adc a, a { #CYCLES 4 db $8f }
+#MACRO adc a, b { #CYCLES 4 db $88 }
+#MACRO adc a, c { #CYCLES 4 db $89 }
+#MACRO adc a, d { #CYCLES 4 db $8a }
+#MACRO adc a, e { #CYCLES 4 db $8b }
+#MACRO adc a, h { #CYCLES 4 db $8c }
+#MACRO adc a, l { #CYCLES 4 db $8d }
 #MACRO add _value { add a, _value }
-#MACRO add a, [hl] { db $86 }
-#MACRO add a, _value { db $c6, _value }
-#MACRO add a, a { db $87 }
-#MACRO add a, b { db $80 }
-#MACRO add a, c { db $81 }
-#MACRO add a, d { db $82 }
-#MACRO add a, e { db $83 }
-#MACRO add a, h { db $84 }
-#MACRO add a, l { db $85 }
-#MACRO add hl, bc { db $09 }
-#MACRO add hl, de { db $19 }
-#MACRO add hl, hl { db $29 }
-#MACRO add hl, sp { db $39 }
-#MACRO add sp, _offset { db $e8, _offset }
+#MACRO add a, [hl] { #CYCLES 8 db $86 }
+#MACRO add a, _value { #CYCLES 8 db $c6, _value }
+#MACRO add a, a { #CYCLES 4 db $87 }
+#MACRO add a, b { #CYCLES 4 db $80 }
+#MACRO add a, c { #CYCLES 4 db $81 }
+#MACRO add a, d { #CYCLES 4 db $82 }
+#MACRO add a, e { #CYCLES 4 db $83 }
+#MACRO add a, h { #CYCLES 4 db $84 }
+#MACRO add a, l { #CYCLES 4 db $85 }
+#MACRO add hl, bc { #CYCLES 8 db $09 }
+#MACRO add hl, de { #CYCLES 8 db $19 }
+#MACRO add hl, hl { #CYCLES 8 db $29 }
+#MACRO add hl, sp { #CYCLES 8 db $39 }
+#MACRO add sp, _offset { #CYCLES 16 db $e8, _offset }
 #MACRO and _value { and a, _value }
-#MACRO and a, [hl] { db $a6 }
-#MACRO and a, _value { db $e6, _value }
-#MACRO and a, a { db $a7 }
-#MACRO and a, b { db $a0 }
-#MACRO and a, c { db $a1 }
-#MACRO and a, d { db $a2 }
-#MACRO and a, e { db $a3 }
-#MACRO and a, h { db $a4 }
-#MACRO and a, l { db $a5 }
-#MACRO bit _idx, [hl] { db $cb, $46 | ((_idx) << 3) }
-#MACRO bit _idx, a { db $cb, $47 | ((_idx) << 3) }
-#MACRO bit _idx, b { db $cb, $40 | ((_idx) << 3) }
-#MACRO bit _idx, c { db $cb, $41 | ((_idx) << 3) }
-#MACRO bit _idx, d { db $cb, $42 | ((_idx) << 3) }
-#MACRO bit _idx, e { db $cb, $43 | ((_idx) << 3) }
-#MACRO bit _idx, h { db $cb, $44 | ((_idx) << 3) }
-#MACRO bit _idx, l { db $cb, $45 | ((_idx) << 3) }
-#MACRO call _target { db $cd
+#MACRO and a, [hl] { #CYCLES 8 db $a6 }
+#MACRO and a, _value { #CYCLES 8 db $e6, _value }
+#MACRO and a, a { #CYCLES 4 db $a7 }
+#MACRO and a, b { #CYCLES 4 db $a0 }
+#MACRO and a, c { #CYCLES 4 db $a1 }
+#MACRO and a, d { #CYCLES 4 db $a2 }
+#MACRO and a, e { #CYCLES 4 db $a3 }
+#MACRO and a, h { #CYCLES 4 db $a4 }
+#MACRO and a, l { #CYCLES 4 db $a5 }
+#MACRO bit _idx, [hl] { #CYCLES 12 db $cb, $46 | ((_idx) << 3) }
+#MACRO bit _idx, a { #CYCLES 8 db $cb, $47 | ((_idx) << 3) }
+#MACRO bit _idx, b { #CYCLES 8 db $cb, $40 | ((_idx) << 3) }
+#MACRO bit _idx, c { #CYCLES 8 db $cb, $41 | ((_idx) << 3) }
+#MACRO bit _idx, d { #CYCLES 8 db $cb, $42 | ((_idx) << 3) }
+#MACRO bit _idx, e { #CYCLES 8 db $cb, $43 | ((_idx) << 3) }
+#MACRO bit _idx, h { #CYCLES 8 db $cb, $44 | ((_idx) << 3) }
+#MACRO bit _idx, l { #CYCLES 8 db $cb, $45 | ((_idx) << 3) }
+#MACRO call _target { #CYCLES 24 db $cd
     dw _target }
-#MACRO call c, _target { db $dc
+#MACRO call c, _target { #CYCLES 12, 24 db $dc
     dw _target }
-#MACRO call nc, _target { db $d4
+#MACRO call nc, _target { #CYCLES 12, 24 db $d4
     dw _target }
-#MACRO call nz, _target { db $c4
+#MACRO call nz, _target { #CYCLES 12, 24 db $c4
     dw _target }
-#MACRO call z, _target { db $cc
+#MACRO call z, _target { #CYCLES 12, 24 db $cc
     dw _target }
-#MACRO ccf { db $3f }
-#MACRO cp a, [hl] { db $be }
+#MACRO ccf { #CYCLES 4 db $3f }
+#MACRO cp a, [hl] { #CYCLES 8 db $be }
 #MACRO cp _value { cp a, _value }
-#MACRO cp a, _value { db $fe, _value }
-#MACRO cp a, a { db $bf }
-#MACRO cp a, b { db $b8 }
-#MACRO cp a, c { db $b9 }
-#MACRO cp a, d { db $ba }
-#MACRO cp a, e { db $bb }
-#MACRO cp a, h { db $bc }
-#MACRO cp a, l { db $bd }
-#MACRO cpl { db $2f }
-#MACRO daa { db $27 }
-#MACRO dec [hl] { db $35 }
-#MACRO dec a { db $3d }
-#MACRO dec b { db $05 }
-#MACRO dec bc { db $0b }
-#MACRO dec c { db $0d }
-#MACRO dec d { db $15 }
-#MACRO dec de { db $1b }
-#MACRO dec e { db $1d }
-#MACRO dec h { db $25 }
-#MACRO dec hl { db $2b }
-#MACRO dec l { db $2d }
-#MACRO dec sp { db $3b }
-#MACRO di { db $f3 }
-#MACRO ei { db $fb }
-#MACRO halt { db $76 }
-#MACRO inc [hl] { db $34 }
-#MACRO inc a { db $3c }
-#MACRO inc b { db $04 }
-#MACRO inc bc { db $03 }
-#MACRO inc c { db $0c }
-#MACRO inc d { db $14 }
-#MACRO inc de { db $13 }
-#MACRO inc e { db $1c }
-#MACRO inc h { db $24 }
-#MACRO inc hl { db $23 }
-#MACRO inc l { db $2c }
-#MACRO inc sp { db $33 }
-#MACRO jp _target { db $c3
+#MACRO cp a, _value { #CYCLES 8 db $fe, _value }
+#MACRO cp a, a { #CYCLES 4 db $bf }
+#MACRO cp a, b { #CYCLES 4 db $b8 }
+#MACRO cp a, c { #CYCLES 4 db $b9 }
+#MACRO cp a, d { #CYCLES 4 db $ba }
+#MACRO cp a, e { #CYCLES 4 db $bb }
+#MACRO cp a, h { #CYCLES 4 db $bc }
+#MACRO cp a, l { #CYCLES 4 db $bd }
+#MACRO cpl { #CYCLES 4 db $2f }
+#MACRO daa { #CYCLES 4 db $27 }
+#MACRO dec [hl] { #CYCLES 12 db $35 }
+#MACRO dec a { #CYCLES 4 db $3d }
+#MACRO dec b { #CYCLES 4 db $05 }
+#MACRO dec bc { #CYCLES 8 db $0b }
+#MACRO dec c { #CYCLES 4 db $0d }
+#MACRO dec d { #CYCLES 4 db $15 }
+#MACRO dec de { #CYCLES 8 db $1b }
+#MACRO dec e { #CYCLES 4 db $1d }
+#MACRO dec h { #CYCLES 4 db $25 }
+#MACRO dec hl { #CYCLES 8 db $2b }
+#MACRO dec l { #CYCLES 4 db $2d }
+#MACRO dec sp { #CYCLES 8 db $3b }
+#MACRO di { #CYCLES 4 db $f3 }
+#MACRO ei { #CYCLES 4 db $fb }
+#MACRO halt { #CYCLES 4 db $76 }
+#MACRO inc [hl] { #CYCLES 12 db $34 }
+#MACRO inc a { #CYCLES 4 db $3c }
+#MACRO inc b { #CYCLES 4 db $04 }
+#MACRO inc bc { #CYCLES 8 db $03 }
+#MACRO inc c { #CYCLES 4 db $0c }
+#MACRO inc d { #CYCLES 4 db $14 }
+#MACRO inc de { #CYCLES 8 db $13 }
+#MACRO inc e { #CYCLES 4 db $1c }
+#MACRO inc h { #CYCLES 4 db $24 }
+#MACRO inc hl { #CYCLES 8 db $23 }
+#MACRO inc l { #CYCLES 4 db $2c }
+#MACRO inc sp { #CYCLES 8 db $33 }
+#MACRO jp _target { #CYCLES 16 db $c3
     dw _target }
-#MACRO jp c, _target { db $da
+#MACRO jp c, _target { #CYCLES 12, 16 db $da
     dw _target }
-#MACRO jp hl { db $e9 }
-#MACRO jp nc, _target { db $d2
+#MACRO jp hl { #CYCLES 4 db $e9 }
+#MACRO jp nc, _target { #CYCLES 12, 16 db $d2
     dw _target }
-#MACRO jp nz, _target { db $c2
+#MACRO jp nz, _target { #CYCLES 12, 16 db $c2
     dw _target }
-#MACRO jp z, _target { db $ca
+#MACRO jp z, _target { #CYCLES 12, 16 db $ca
     dw _target }
 #MACRO _jr_offset_byte _target {
     #ASSERT ((_target) - @ - 1) < 128, ((_target) - @ - 1) >= -128, "JR offset out of range"
     db (_target) - @ - 1 }
-#MACRO jr _target { db $18
+#MACRO jr _target { #CYCLES 12 db $18
     _jr_offset_byte _target }
-#MACRO jr c, _target { db $38
+#MACRO jr c, _target { #CYCLES 8, 12 db $38
     _jr_offset_byte _target }
-#MACRO jr nc, _target { db $30
+#MACRO jr nc, _target { #CYCLES 8, 12 db $30
     _jr_offset_byte _target }
-#MACRO jr nz, _target { db $20
+#MACRO jr nz, _target { #CYCLES 8, 12 db $20
     _jr_offset_byte _target }
-#MACRO jr z, _target { db $28
+#MACRO jr z, _target { #CYCLES 8, 12 db $28
     _jr_offset_byte _target }
-#MACRO ld [_target], a { db $ea
+#MACRO ld [_target], a { #CYCLES 16 db $ea
     dw _target }
-#MACRO ld [_target], sp { db $08
+#MACRO ld [_target], sp { #CYCLES 20 db $08
     dw _target }
-#MACRO ld [bc], a { db $02 }
-#MACRO ldh [c], a { db $e2 }
-#MACRO ldh [$FF00+c], a { db $e2 }
-#MACRO ld [de], a { db $12 }
-#MACRO ld [hl], _value { db $36, _value }
-#MACRO ld [hl+], a { db $22 }
-#MACRO ld [hl-], a { db $32 }
-#MACRO ld [hl], a { db $77 }
-#MACRO ld [hl], b { db $70 }
-#MACRO ld [hl], c { db $71 }
-#MACRO ld [hl], d { db $72 }
-#MACRO ld [hl], e { db $73 }
-#MACRO ld [hl], h { db $74 }
-#MACRO ld [hl], l { db $75 }
-#MACRO ld a, [_target] { db $fa
+#MACRO ld [bc], a { #CYCLES 8 db $02 }
+#MACRO ldh [c], a { #CYCLES 8 db $e2 }
+#MACRO ldh [$FF00+c], a { #CYCLES 8 db $e2 }
+#MACRO ld [de], a { #CYCLES 8 db $12 }
+#MACRO ld [hl], _value { #CYCLES 12 db $36, _value }
+#MACRO ld [hl+], a { #CYCLES 8 db $22 }
+#MACRO ld [hl-], a { #CYCLES 8 db $32 }
+#MACRO ld [hl], a { #CYCLES 8 db $77 }
+#MACRO ld [hl], b { #CYCLES 8 db $70 }
+#MACRO ld [hl], c { #CYCLES 8 db $71 }
+#MACRO ld [hl], d { #CYCLES 8 db $72 }
+#MACRO ld [hl], e { #CYCLES 8 db $73 }
+#MACRO ld [hl], h { #CYCLES 8 db $74 }
+#MACRO ld [hl], l { #CYCLES 8 db $75 }
+#MACRO ld a, [_target] { #CYCLES 16 db $fa
     dw _target }
-#MACRO ld a, [bc] { db $0a }
-#MACRO ldh a, [c] { db $f2 }
-#MACRO ldh a, [$FF00+c] { db $f2 }
-#MACRO ld a, [de] { db $1a }
-#MACRO ld a, [hl+] { db $2a }
-#MACRO ld a, [hl-] { db $3a }
-#MACRO ld a, [hl] { db $7e }
-#MACRO ld a, _value { db $3e, _value }
-#MACRO ld a, a { db $7f }
-#MACRO ld a, b { db $78 }
-#MACRO ld a, c { db $79 }
-#MACRO ld a, d { db $7a }
-#MACRO ld a, e { db $7b }
-#MACRO ld a, h { db $7c }
-#MACRO ld a, l { db $7d }
-#MACRO ld b, [hl] { db $46 }
-#MACRO ld b, _value { db $06, _value }
-#MACRO ld b, a { db $47 }
-#MACRO ld b, b { db $40 }
-#MACRO ld b, c { db $41 }
-#MACRO ld b, d { db $42 }
-#MACRO ld b, e { db $43 }
-#MACRO ld b, h { db $44 }
-#MACRO ld b, l { db $45 }
-#MACRO ld bc, _value { db $01
+#MACRO ld a, [bc] { #CYCLES 8 db $0a }
+#MACRO ldh a, [c] { #CYCLES 8 db $f2 }
+#MACRO ldh a, [$FF00+c] { #CYCLES 8 db $f2 }
+#MACRO ld a, [de] { #CYCLES 8 db $1a }
+#MACRO ld a, [hl+] { #CYCLES 8 db $2a }
+#MACRO ld a, [hl-] { #CYCLES 8 db $3a }
+#MACRO ld a, [hl] { #CYCLES 8 db $7e }
+#MACRO ld a, _value { #CYCLES 8 db $3e, _value }
+#MACRO ld a, a { #CYCLES 4 db $7f }
+#MACRO ld a, b { #CYCLES 4 db $78 }
+#MACRO ld a, c { #CYCLES 4 db $79 }
+#MACRO ld a, d { #CYCLES 4 db $7a }
+#MACRO ld a, e { #CYCLES 4 db $7b }
+#MACRO ld a, h { #CYCLES 4 db $7c }
+#MACRO ld a, l { #CYCLES 4 db $7d }
+#MACRO ld b, [hl] { #CYCLES 8 db $46 }
+#MACRO ld b, _value { #CYCLES 8 db $06, _value }
+#MACRO ld b, a { #CYCLES 4 db $47 }
+#MACRO ld b, b { #CYCLES 4 db $40 }
+#MACRO ld b, c { #CYCLES 4 db $41 }
+#MACRO ld b, d { #CYCLES 4 db $42 }
+#MACRO ld b, e { #CYCLES 4 db $43 }
+#MACRO ld b, h { #CYCLES 4 db $44 }
+#MACRO ld b, l { #CYCLES 4 db $45 }
+#MACRO ld bc, _value { #CYCLES 12 db $01
     dw _value }
-#MACRO ld c, [hl] { db $4e }
-#MACRO ld c, _value { db $0e, _value }
-#MACRO ld c, a { db $4f }
-#MACRO ld c, b { db $48 }
-#MACRO ld c, c { db $49 }
-#MACRO ld c, d { db $4a }
-#MACRO ld c, e { db $4b }
-#MACRO ld c, h { db $4c }
-#MACRO ld c, l { db $4d }
-#MACRO ld d, [hl] { db $56 }
-#MACRO ld d, _value { db $16, _value }
-#MACRO ld d, a { db $57 }
-#MACRO ld d, b { db $50 }
-#MACRO ld d, c { db $51 }
-#MACRO ld d, d { db $52 }
-#MACRO ld d, e { db $53 }
-#MACRO ld d, h { db $54 }
-#MACRO ld d, l { db $55 }
-#MACRO ld de, _value { db $11
+#MACRO ld c, [hl] { #CYCLES 8 db $4e }
+#MACRO ld c, _value { #CYCLES 8 db $0e, _value }
+#MACRO ld c, a { #CYCLES 4 db $4f }
+#MACRO ld c, b { #CYCLES 4 db $48 }
+#MACRO ld c, c { #CYCLES 4 db $49 }
+#MACRO ld c, d { #CYCLES 4 db $4a }
+#MACRO ld c, e { #CYCLES 4 db $4b }
+#MACRO ld c, h { #CYCLES 4 db $4c }
+#MACRO ld c, l { #CYCLES 4 db $4d }
+#MACRO ld d, [hl] { #CYCLES 8 db $56 }
+#MACRO ld d, _value { #CYCLES 8 db $16, _value }
+#MACRO ld d, a { #CYCLES 4 db $57 }
+#MACRO ld d, b { #CYCLES 4 db $50 }
+#MACRO ld d, c { #CYCLES 4 db $51 }
+#MACRO ld d, d { #CYCLES 4 db $52 }
+#MACRO ld d, e { #CYCLES 4 db $53 }
+#MACRO ld d, h { #CYCLES 4 db $54 }
+#MACRO ld d, l { #CYCLES 4 db $55 }
+#MACRO ld de, _value { #CYCLES 12 db $11
     dw _value }
-#MACRO ld e, [hl] { db $5e }
-#MACRO ld e, _value { db $1e, _value }
-#MACRO ld e, a { db $5f }
-#MACRO ld e, b { db $58 }
-#MACRO ld e, c { db $59 }
-#MACRO ld e, d { db $5a }
-#MACRO ld e, e { db $5b }
-#MACRO ld e, h { db $5c }
-#MACRO ld e, l { db $5d }
-#MACRO ld h, [hl] { db $66 }
-#MACRO ld h, _value { db $26, _value }
-#MACRO ld h, a { db $67 }
-#MACRO ld h, b { db $60 }
-#MACRO ld h, c { db $61 }
-#MACRO ld h, d { db $62 }
-#MACRO ld h, e { db $63 }
-#MACRO ld h, h { db $64 }
-#MACRO ld h, l { db $65 }
-#MACRO ld hl, sp + _offset { db $f8, _offset }
-#MACRO ld hl, _value { db $21
+#MACRO ld e, [hl] { #CYCLES 8 db $5e }
+#MACRO ld e, _value { #CYCLES 8 db $1e, _value }
+#MACRO ld e, a { #CYCLES 4 db $5f }
+#MACRO ld e, b { #CYCLES 4 db $58 }
+#MACRO ld e, c { #CYCLES 4 db $59 }
+#MACRO ld e, d { #CYCLES 4 db $5a }
+#MACRO ld e, e { #CYCLES 4 db $5b }
+#MACRO ld e, h { #CYCLES 4 db $5c }
+#MACRO ld e, l { #CYCLES 4 db $5d }
+#MACRO ld h, [hl] { #CYCLES 8 db $66 }
+#MACRO ld h, _value { #CYCLES 8 db $26, _value }
+#MACRO ld h, a { #CYCLES 4 db $67 }
+#MACRO ld h, b { #CYCLES 4 db $60 }
+#MACRO ld h, c { #CYCLES 4 db $61 }
+#MACRO ld h, d { #CYCLES 4 db $62 }
+#MACRO ld h, e { #CYCLES 4 db $63 }
+#MACRO ld h, h { #CYCLES 4 db $64 }
+#MACRO ld h, l { #CYCLES 4 db $65 }
+#MACRO ld hl, sp + _offset { #CYCLES 12 db $f8, _offset }
+#MACRO ld hl, _value { #CYCLES 12 db $21
     dw _value }
-#MACRO ld l, [hl] { db $6e }
-#MACRO ld l, _value { db $2e, _value }
-#MACRO ld l, a { db $6f }
-#MACRO ld l, b { db $68 }
-#MACRO ld l, c { db $69 }
-#MACRO ld l, d { db $6a }
-#MACRO ld l, e { db $6b }
-#MACRO ld l, h { db $6c }
-#MACRO ld l, l { db $6d }
-#MACRO ld sp, hl { db $f9 }
-#MACRO ld sp, _value { db $31 
+#MACRO ld l, [hl] { #CYCLES 8 db $6e }
+#MACRO ld l, _value { #CYCLES 8 db $2e, _value }
+#MACRO ld l, a { #CYCLES 4 db $6f }
+#MACRO ld l, b { #CYCLES 4 db $68 }
+#MACRO ld l, c { #CYCLES 4 db $69 }
+#MACRO ld l, d { #CYCLES 4 db $6a }
+#MACRO ld l, e { #CYCLES 4 db $6b }
+#MACRO ld l, h { #CYCLES 4 db $6c }
+#MACRO ld l, l { #CYCLES 4 db $6d }
+#MACRO ld sp, hl { #CYCLES 8 db $f9 }
+#MACRO ld sp, _value { #CYCLES 12 db $31 
     dw _value }
-#MACRO ldh [_target], a { db $e0
+#MACRO ldh [_target], a { #CYCLES 12 db $e0
     #ASSERT HIGH(_target) == $ff
     db LOW(_target) }
-#MACRO ldh a, [_target] { db $f0
+#MACRO ldh a, [_target] { #CYCLES 12 db $f0
     #ASSERT HIGH(_target) == $ff
     db LOW(_target) }
-#MACRO nop { db $00 }
+#MACRO nop { #CYCLES 4 db $00 }
 #MACRO or _value { or a, _value }
-#MACRO or a, [hl] { db $b6 }
-#MACRO or a, _value { db $f6, _value }
-#MACRO or a, a { db $b7 }
-#MACRO or a, b { db $b0 }
-#MACRO or a, c { db $b1 }
-#MACRO or a, d { db $b2 }
-#MACRO or a, e { db $b3 }
-#MACRO or a, h { db $b4 }
-#MACRO or a, l { db $b5 }
-#MACRO pop af { db $f1 }
-#MACRO pop bc { db $c1 }
-#MACRO pop de { db $d1 }
-#MACRO pop hl { db $e1 }
-#MACRO push af { db $f5 }
-#MACRO push bc { db $c5 }
-#MACRO push de { db $d5 }
-#MACRO push hl { db $e5 }
-#MACRO res _idx, [hl] { db $cb, $86 | ((_idx) << 3) }
-#MACRO res _idx, a { db $cb, $87 | ((_idx) << 3) }
-#MACRO res _idx, b { db $cb, $80 | ((_idx) << 3) }
-#MACRO res _idx, c { db $cb, $81 | ((_idx) << 3) }
-#MACRO res _idx, d { db $cb, $82 | ((_idx) << 3) }
-#MACRO res _idx, e { db $cb, $83 | ((_idx) << 3) }
-#MACRO res _idx, h { db $cb, $84 | ((_idx) << 3) }
-#MACRO res _idx, l { db $cb, $85 | ((_idx) << 3) }
-#MACRO ret { db $c9 }
-#MACRO ret c { db $d8 }
-#MACRO ret nc { db $d0 }
-#MACRO ret nz { db $c0 }
-#MACRO ret z { db $c8 }
-#MACRO reti { db $d9 }
-#MACRO rl [hl] { db $cb, $16 }
-#MACRO rl a { db $cb, $17 }
-#MACRO rl b { db $cb, $10 }
-#MACRO rl c { db $cb, $11 }
-#MACRO rl d { db $cb, $12 }
-#MACRO rl e { db $cb, $13 }
-#MACRO rl h { db $cb, $14 }
-#MACRO rl l { db $cb, $15 }
-#MACRO rla { db $17 }
-#MACRO rlc [hl] { db $cb, $06 }
-#MACRO rlc a { db $cb, $07 }
-#MACRO rlc b { db $cb, $00 }
-#MACRO rlc c { db $cb, $01 }
-#MACRO rlc d { db $cb, $02 }
-#MACRO rlc e { db $cb, $03 }
-#MACRO rlc h { db $cb, $04 }
-#MACRO rlc l { db $cb, $05 }
-#MACRO rlca { db $07 }
-#MACRO rr [hl] { db $cb, $1e }
-#MACRO rr a { db $cb, $1f }
-#MACRO rr b { db $cb, $18 }
-#MACRO rr c { db $cb, $19 }
-#MACRO rr d { db $cb, $1a }
-#MACRO rr e { db $cb, $1b }
-#MACRO rr h { db $cb, $1c }
-#MACRO rr l { db $cb, $1d }
-#MACRO rra { db $1f }
-#MACRO rrc [hl] { db $cb, $0e }
-#MACRO rrc a { db $cb, $0f }
-#MACRO rrc b { db $cb, $08 }
-#MACRO rrc c { db $cb, $09 }
-#MACRO rrc d { db $cb, $0a }
-#MACRO rrc e { db $cb, $0b }
-#MACRO rrc h { db $cb, $0c }
-#MACRO rrc l { db $cb, $0d }
-#MACRO rrca { db $0f }
+#MACRO or a, [hl] { #CYCLES 8 db $b6 }
+#MACRO or a, _value { #CYCLES 8 db $f6, _value }
+#MACRO or a, a { #CYCLES 4 db $b7 }
+#MACRO or a, b { #CYCLES 4 db $b0 }
+#MACRO or a, c { #CYCLES 4 db $b1 }
+#MACRO or a, d { #CYCLES 4 db $b2 }
+#MACRO or a, e { #CYCLES 4 db $b3 }
+#MACRO or a, h { #CYCLES 4 db $b4 }
+#MACRO or a, l { #CYCLES 4 db $b5 }
+#MACRO pop af { #CYCLES 12 db $f1 }
+#MACRO pop bc { #CYCLES 12 db $c1 }
+#MACRO pop de { #CYCLES 12 db $d1 }
+#MACRO pop hl { #CYCLES 12 db $e1 }
+#MACRO push af { #CYCLES 16 db $f5 }
+#MACRO push bc { #CYCLES 16 db $c5 }
+#MACRO push de { #CYCLES 16 db $d5 }
+#MACRO push hl { #CYCLES 16 db $e5 }
+#MACRO res _idx, [hl] { #CYCLES 16 db $cb, $86 | ((_idx) << 3) }
+#MACRO res _idx, a { #CYCLES 8 db $cb, $87 | ((_idx) << 3) }
+#MACRO res _idx, b { #CYCLES 8 db $cb, $80 | ((_idx) << 3) }
+#MACRO res _idx, c { #CYCLES 8 db $cb, $81 | ((_idx) << 3) }
+#MACRO res _idx, d { #CYCLES 8 db $cb, $82 | ((_idx) << 3) }
+#MACRO res _idx, e { #CYCLES 8 db $cb, $83 | ((_idx) << 3) }
+#MACRO res _idx, h { #CYCLES 8 db $cb, $84 | ((_idx) << 3) }
+#MACRO res _idx, l { #CYCLES 8 db $cb, $85 | ((_idx) << 3) }
+#MACRO ret { #CYCLES 16 db $c9 }
+#MACRO ret c { #CYCLES 8, 20 db $d8 }
+#MACRO ret nc { #CYCLES 8, 20 db $d0 }
+#MACRO ret nz { #CYCLES 8, 20 db $c0 }
+#MACRO ret z { #CYCLES 8, 20 db $c8 }
+#MACRO reti { #CYCLES 16 db $d9 }
+#MACRO rl [hl] { #CYCLES 16 db $cb, $16 }
+#MACRO rl a { #CYCLES 8 db $cb, $17 }
+#MACRO rl b { #CYCLES 8 db $cb, $10 }
+#MACRO rl c { #CYCLES 8 db $cb, $11 }
+#MACRO rl d { #CYCLES 8 db $cb, $12 }
+#MACRO rl e { #CYCLES 8 db $cb, $13 }
+#MACRO rl h { #CYCLES 8 db $cb, $14 }
+#MACRO rl l { #CYCLES 8 db $cb, $15 }
+#MACRO rla { #CYCLES 4 db $17 }
+#MACRO rlc [hl] { #CYCLES 16 db $cb, $06 }
+#MACRO rlc a { #CYCLES 8 db $cb, $07 }
+#MACRO rlc b { #CYCLES 8 db $cb, $00 }
+#MACRO rlc c { #CYCLES 8 db $cb, $01 }
+#MACRO rlc d { #CYCLES 8 db $cb, $02 }
+#MACRO rlc e { #CYCLES 8 db $cb, $03 }
+#MACRO rlc h { #CYCLES 8 db $cb, $04 }
+#MACRO rlc l { #CYCLES 8 db $cb, $05 }
+#MACRO rlca { #CYCLES 4 db $07 }
+#MACRO rr [hl] { #CYCLES 16 db $cb, $1e }
+#MACRO rr a { #CYCLES 8 db $cb, $1f }
+#MACRO rr b { #CYCLES 8 db $cb, $18 }
+#MACRO rr c { #CYCLES 8 db $cb, $19 }
+#MACRO rr d { #CYCLES 8 db $cb, $1a }
+#MACRO rr e { #CYCLES 8 db $cb, $1b }
+#MACRO rr h { #CYCLES 8 db $cb, $1c }
+#MACRO rr l { #CYCLES 8 db $cb, $1d }
+#MACRO rra { #CYCLES 4 db $1f }
+#MACRO rrc [hl] { #CYCLES 16 db $cb, $0e }
+#MACRO rrc a { #CYCLES 8 db $cb, $0f }
+#MACRO rrc b { #CYCLES 8 db $cb, $08 }
+#MACRO rrc c { #CYCLES 8 db $cb, $09 }
+#MACRO rrc d { #CYCLES 8 db $cb, $0a }
+#MACRO rrc e { #CYCLES 8 db $cb, $0b }
+#MACRO rrc h { #CYCLES 8 db $cb, $0c }
+#MACRO rrc l { #CYCLES 8 db $cb, $0d }
+#MACRO rrca { #CYCLES 4 db $0f }
 #MACRO rst _value {
+    #CYCLES 16
     #ASSERT (_value & $07) == 0, _value < $40, "RST target invalid"
     db $c7 + _value }
 #MACRO sbc _value { sbc a, _value }
-#MACRO sbc a, [hl] { db $9e }
-#MACRO sbc a, _value { db $de, _value }
-#MACRO sbc a, a { db $9f }
-#MACRO sbc a, b { db $98 }
-#MACRO sbc a, c { db $99 }
-#MACRO sbc a, d { db $9a }
-#MACRO sbc a, e { db $9b }
-#MACRO sbc a, h { db $9c }
-#MACRO sbc a, l { db $9d }
-#MACRO scf { db $37 }
-#MACRO set _idx, [hl] { db $cb, $c6 | ((_idx) << 3) }
-#MACRO set _idx, a { db $cb, $c7 | ((_idx) << 3) }
-#MACRO set _idx, b { db $cb, $c0 | ((_idx) << 3) }
-#MACRO set _idx, c { db $cb, $c1 | ((_idx) << 3) }
-#MACRO set _idx, d { db $cb, $c2 | ((_idx) << 3) }
-#MACRO set _idx, e { db $cb, $c3 | ((_idx) << 3) }
-#MACRO set _idx, h { db $cb, $c4 | ((_idx) << 3) }
-#MACRO set _idx, l { db $cb, $c5 | ((_idx) << 3) }
-#MACRO sla [hl] { db $cb, $26 }
-#MACRO sla a { db $cb, $27 }
-#MACRO sla b { db $cb, $20 }
-#MACRO sla c { db $cb, $21 }
-#MACRO sla d { db $cb, $22 }
-#MACRO sla e { db $cb, $23 }
-#MACRO sla h { db $cb, $24 }
-#MACRO sla l { db $cb, $25 }
-#MACRO sra [hl] { db $cb, $2e }
-#MACRO sra a { db $cb, $2f }
-#MACRO sra b { db $cb, $28 }
-#MACRO sra c { db $cb, $29 }
-#MACRO sra d { db $cb, $2a }
-#MACRO sra e { db $cb, $2b }
-#MACRO sra h { db $cb, $2c }
-#MACRO sra l { db $cb, $2d }
-#MACRO srl [hl] { db $cb, $3e }
-#MACRO srl a { db $cb, $3f }
-#MACRO srl b { db $cb, $38 }
-#MACRO srl c { db $cb, $39 }
-#MACRO srl d { db $cb, $3a }
-#MACRO srl e { db $cb, $3b }
-#MACRO srl h { db $cb, $3c }
-#MACRO srl l { db $cb, $3d }
-#MACRO stop { db $10, $00 }
-#MACRO stop _value { db $10, _value }
+#MACRO sbc a, [hl] { #CYCLES 8 db $9e }
+#MACRO sbc a, _value { #CYCLES 8 db $de, _value }
+#MACRO sbc a, a { #CYCLES 4 db $9f }
+#MACRO sbc a, b { #CYCLES 4 db $98 }
+#MACRO sbc a, c { #CYCLES 4 db $99 }
+#MACRO sbc a, d { #CYCLES 4 db $9a }
+#MACRO sbc a, e { #CYCLES 4 db $9b }
+#MACRO sbc a, h { #CYCLES 4 db $9c }
+#MACRO sbc a, l { #CYCLES 4 db $9d }
+#MACRO scf { #CYCLES 4 db $37 }
+#MACRO set _idx, [hl] { #CYCLES 16 db $cb, $c6 | ((_idx) << 3) }
+#MACRO set _idx, a { #CYCLES 8 db $cb, $c7 | ((_idx) << 3) }
+#MACRO set _idx, b { #CYCLES 8 db $cb, $c0 | ((_idx) << 3) }
+#MACRO set _idx, c { #CYCLES 8 db $cb, $c1 | ((_idx) << 3) }
+#MACRO set _idx, d { #CYCLES 8 db $cb, $c2 | ((_idx) << 3) }
+#MACRO set _idx, e { #CYCLES 8 db $cb, $c3 | ((_idx) << 3) }
+#MACRO set _idx, h { #CYCLES 8 db $cb, $c4 | ((_idx) << 3) }
+#MACRO set _idx, l { #CYCLES 8 db $cb, $c5 | ((_idx) << 3) }
+#MACRO sla [hl] { #CYCLES 16 db $cb, $26 }
+#MACRO sla a { #CYCLES 8 db $cb, $27 }
+#MACRO sla b { #CYCLES 8 db $cb, $20 }
+#MACRO sla c { #CYCLES 8 db $cb, $21 }
+#MACRO sla d { #CYCLES 8 db $cb, $22 }
+#MACRO sla e { #CYCLES 8 db $cb, $23 }
+#MACRO sla h { #CYCLES 8 db $cb, $24 }
+#MACRO sla l { #CYCLES 8 db $cb, $25 }
+#MACRO sra [hl] { #CYCLES 16 db $cb, $2e }
+#MACRO sra a { #CYCLES 8 db $cb, $2f }
+#MACRO sra b { #CYCLES 8 db $cb, $28 }
+#MACRO sra c { #CYCLES 8 db $cb, $29 }
+#MACRO sra d { #CYCLES 8 db $cb, $2a }
+#MACRO sra e { #CYCLES 8 db $cb, $2b }
+#MACRO sra h { #CYCLES 8 db $cb, $2c }
+#MACRO sra l { #CYCLES 8 db $cb, $2d }
+#MACRO srl [hl] { #CYCLES 16 db $cb, $3e }
+#MACRO srl a { #CYCLES 8 db $cb, $3f }
+#MACRO srl b { #CYCLES 8 db $cb, $38 }
+#MACRO srl c { #CYCLES 8 db $cb, $39 }
+#MACRO srl d { #CYCLES 8 db $cb, $3a }
+#MACRO srl e { #CYCLES 8 db $cb, $3b }
+#MACRO srl h { #CYCLES 8 db $cb, $3c }
+#MACRO srl l { #CYCLES 8 db $cb, $3d }
+#MACRO stop { #CYCLES 4 db $10, $00 }
+#MACRO stop _value { #CYCLES 4 db $10, _value }
 #MACRO sub _value { sub a, _value }
-#MACRO sub a, [hl] { db $96 }
-#MACRO sub a, _value { db $d6, _value }
-#MACRO sub a, a { db $97 }
-#MACRO sub a, b { db $90 }
-#MACRO sub a, c { db $91 }
-#MACRO sub a, d { db $92 }
-#MACRO sub a, e { db $93 }
-#MACRO sub a, h { db $94 }
-#MACRO sub a, l { db $95 }
-#MACRO swap [hl] { db $cb, $36 }
-#MACRO swap a { db $cb, $37 }
-#MACRO swap b { db $cb, $30 }
-#MACRO swap c { db $cb, $31 }
-#MACRO swap d { db $cb, $32 }
-#MACRO swap e { db $cb, $33 }
-#MACRO swap h { db $cb, $34 }
-#MACRO swap l { db $cb, $35 }
-#MACRO xor a, [hl] { db $ae }
+#MACRO sub a, [hl] { #CYCLES 8 db $96 }
+#MACRO sub a, _value { #CYCLES 8 db $d6, _value }
+#MACRO sub a, a { #CYCLES 4 db $97 }
+#MACRO sub a, b { #CYCLES 4 db $90 }
+#MACRO sub a, c { #CYCLES 4 db $91 }
+#MACRO sub a, d { #CYCLES 4 db $92 }
+#MACRO sub a, e { #CYCLES 4 db $93 }
+#MACRO sub a, h { #CYCLES 4 db $94 }
+#MACRO sub a, l { #CYCLES 4 db $95 }
+#MACRO swap [hl] { #CYCLES 16 db $cb, $36 }
+#MACRO swap a { #CYCLES 8 db $cb, $37 }
+#MACRO swap b { #CYCLES 8 db $cb, $30 }
+#MACRO swap c { #CYCLES 8 db $cb, $31 }
+#MACRO swap d { #CYCLES 8 db $cb, $32 }
+#MACRO swap e { #CYCLES 8 db $cb, $33 }
+#MACRO swap h { #CYCLES 8 db $cb, $34 }
+#MACRO swap l { #CYCLES 8 db $cb, $35 }
+#MACRO xor a, [hl] { #CYCLES 8 db $ae }
 #MACRO xor _value { xor a, _value }
-#MACRO xor a, _value { db $ee, _value }
-#MACRO xor a, a { db $af }
-#MACRO xor a, b { db $a8 }
-#MACRO xor a, c { db $a9 }
-#MACRO xor a, d { db $aa }
-#MACRO xor a, e { db $ab }
-#MACRO xor a, h { db $ac }
-#MACRO xor a, l { db $ad }
+#MACRO xor a, _value { #CYCLES 8 db $ee, _value }
+#MACRO xor a, a { #CYCLES 4 db $af }
+#MACRO xor a, b { #CYCLES 4 db $a8 }
+#MACRO xor a, c { #CYCLES 4 db $a9 }
+#MACRO xor a, d { #CYCLES 4 db $aa }
+#MACRO xor a, e { #CYCLES 4 db $ab }
+#MACRO xor a, h { #CYCLES 4 db $ac }
+#MACRO xor a, l { #CYCLES 4 db $ad }
@@ -1,3 +1,4 @@
+import io
 import PIL.Image
 
 from exception import AssemblerException
@@ -13,7 +14,7 @@ def _bool_option(file_token: Token, options: Dict[str, List[Any]], key: str) ->
     return True
 
 
-def read(file_token: Token, filename: str, options: Dict[str, List[Any]]) -> bytes:
+def read(file_token: Token, image_data: bytes, options: Dict[str, List[Any]]) -> bytes:
     tileheight = 8
     colormap = None
     unique = _bool_option(file_token, options, "UNIQUE")
@@ -41,7 +42,7 @@ def read(file_token: Token, filename: str, options: Dict[str, List[Any]]) -> byt
     if options:
         raise AssemblerException(file_token, f"Unknown option: {next(iter(options.keys()))}")
 
-    img = PIL.Image.open(filename)
+    img = PIL.Image.open(io.BytesIO(image_data))
     if img.mode != "P":
         img = img.convert("P", palette=PIL.Image.ADAPTIVE)
     if (img.size[0] % 8) != 0:
@@ -0,0 +1,497 @@
+"""Language server for editors, speaking the Language Server Protocol on stdin/stdout.
+Provides error diagnostics, go to definition for labels, macros and fmacros, and hover info for macro overloads."""
+from typing import List, Optional, Dict, Tuple, Set, Any, Callable, BinaryIO
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import traceback
+import urllib.parse
+from main import Assembler
+from exception import AssemblerException
+from fileprovider import DiskFileProvider
+from macrodb import Macro
+from tokenizer import Token
+
+
+# Library files that are processed once, and are the starting point of every build.
+DEFAULT_PRELUDE = ("gbz80/instr.asm", "gbz80/regs.asm")
+# Time without new messages after an edit before the changed files are built.
+DEBOUNCE_TIME = 0.15
+
+_WORD_REGEX = re.compile(r'\.?[A-Za-z_][A-Za-z0-9_\.]*')
+_INCLUDE_LINE_REGEX = re.compile(r'\s*#INCLUDE(_ONCE)?\s+"[^"\\]*"\s*(;.*)?$', re.IGNORECASE)
+_EMPTY_LINE_REGEX = re.compile(r'\s*(;.*)?$')
+
+
+def read_message(stream: BinaryIO) -> Optional[Dict[str, Any]]:
+    """Read a single message with its Content-Length header, returns None at the end of the stream."""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.decode("ascii").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    if length is None:
+        return None
+    return json.loads(stream.read(length).decode("utf-8"))
+
+
+def write_message(stream: BinaryIO, message: Dict[str, Any]) -> None:
+    data = json.dumps(message).encode("utf-8")
+    stream.write(f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data)
+    stream.flush()
+
+
+def uri_to_path(uri: str) -> str:
+    parsed = urllib.parse.urlparse(uri)
+    path = urllib.parse.unquote(parsed.path)
+    if os.name == "nt" and re.match(r"/[A-Za-z]:", path):
+        path = path[1:]
+    return os.path.realpath(path)
+
+
+def path_to_uri(path: str) -> str:
+    path = os.path.abspath(path).replace("\\", "/")
+    if not path.startswith("/"):
+        path = "/" + path
+    return "file://" + urllib.parse.quote(path)
+
+
+def format_tokens(tokens: List[Token]) -> str:
+    """Source-like text for a list of tokens, like macro parameters."""
+    result = ""
+    for token in tokens:
+        if token.kind == 'STRING':
+            text = json.dumps(token.value)
+        elif token.kind == 'FUNC':
+            text = f"{token.value}("
+        else:
+            text = str(token.value)
+        if result and not result.endswith(("(", "[")) and token.kind not in (',', ')', ']'):
+            result += " "
+        result += text
+    return result
+
+
+def format_macro(macro: Macro, function: bool) -> str:
+    # Macros are stored on their case folded name, show the name as written in the definition.
+    name = macro.token.value if macro.token is not None else macro.name
+    params = ", ".join(format_tokens(param) for param in macro.params)
+    if function:
+        return f"{name}({params})"
+    return f"{name} {params}".rstrip()
+
+
+class DocumentFileProvider(DiskFileProvider):
+    """Files from disk, except for the documents open in the editor, which are read from the editor's buffer."""
+    def __init__(self):
+        self.__documents: Dict[str, str] = {}
+        # Number of the last change of each open document.
+        self.__changes: Dict[str, int] = {}
+        self.__change_count = 0
+
+    def set_document(self, path: str, text: str) -> None:
+        path = os.path.realpath(path)
+        self.__documents[path] = text
+        self.__change_count += 1
+        self.__changes[path] = self.__change_count
+
+    def remove_document(self, path: str) -> None:
+        self.__documents.pop(os.path.realpath(path), None)
+
+    def version(self, path: str) -> Any:
+        """Value that changes when the contents of the file change."""
+        path = os.path.realpath(path)
+        if path in self.__documents:
+            return "document", self.__changes[path]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def exists(self, path: str) -> bool:
+        return os.path.realpath(path) in self.__documents or super().exists(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        text = self.__documents.get(os.path.realpath(path))
+        if text is not None:
+            return text.encode()
+        return super().read_bytes(path)
+
+    def read_text(self, path: str) -> str:
+        text = self.__documents.get(os.path.realpath(path))
+        if text is not None:
+            return text.replace("\r\n", "\n").replace("\r", "\n")
+        return super().read_text(path)
+
+
+class Build:
+    """Result of building a root file: the assembler state (also after an error) and the files it used."""
+    def __init__(self, root: str, assembler: Assembler, files: Set[str], error: Optional[Tuple[str, int, str]]):
+        self.root = root
+        self.assembler = assembler
+        self.files = files
+        # (path, line number, message) of the error that stopped the build.
+        self.error = error
+
+
+class Checkpoint:
+    """Copy of the assembler state after one of the #INCLUDE lines at the start of a root file.
+    Valid as long as the line and the files it processed are unchanged."""
+    def __init__(self, line_index: int, line: str, versions: Dict[str, Any], assembler: Assembler):
+        self.line_index = line_index
+        self.line = line
+        self.versions = versions
+        self.assembler = assembler
+
+
+class LanguageServer:
+    """Builds each open file from a copy of the already processed prelude, and keeps the result for queries.
+    A file that was included by an earlier build is built through the file that included it, so labels and macros
+    from the rest of the project are known. The #INCLUDE lines at the start of a root file are processed one at a time,
+    and the state after each is kept, so the next build only processes the includes from the first changed one."""
+    def __init__(self, send: Callable[[Dict[str, Any]], None]):
+        self.__send = send
+        self.__files = DocumentFileProvider()
+        self.__prelude = list(DEFAULT_PRELUDE)
+        self.__include_paths: List[str] = []
+        self.__assembler_options: Dict[str, bool] = {}
+        self.__prelude_assembler: Optional[Assembler] = None
+        self.__prelude_files: Set[str] = set()
+        # Roots that include the prelude files themselves, these are build without the prelude.
+        self.__without_prelude: Set[str] = set()
+        self.__open_documents: Set[str] = set()
+        self.__builds: Dict[str, Build] = {}
+        self.__checkpoints: Dict[str, List[Checkpoint]] = {}
+        self.__dirty: Set[str] = set()
+        self.__published: Set[str] = set()
+        self.running = True
+        self.__handlers = {
+            "initialize": self._initialize,
+            "shutdown": lambda params: None,
+            "exit": self._exit,
+            "textDocument/didOpen": self._did_open,
+            "textDocument/didChange": self._did_change,
+            "textDocument/didClose": self._did_close,
+            "textDocument/definition": self._definition,
+            "textDocument/hover": self._hover,
+        }
+
+    def handle(self, message: Dict[str, Any]) -> None:
+        handler = self.__handlers.get(message.get("method"))
+        if "id" not in message:
+            if handler is not None:
+                handler(message.get("params") or {})
+            return
+        if handler is None:
+            self.__send({"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32601, "message": f"Unknown method: {message.get('method')}"}})
+            return
+        try:
+            result = handler(message.get("params") or {})
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            self.__send({"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32603, "message": str(e)}})
+        else:
+            self.__send({"jsonrpc": "2.0", "id": message["id"], "result": result})
+
+    def has_pending_builds(self) -> bool:
+        return bool(self.__dirty)
+
+    def flush(self) -> None:
+        """Build all roots that use changed files, and publish the diagnostics."""
+        if not self.__dirty:
+            return
+        dirty, self.__dirty = self.__dirty, set()
+        roots = {root for root, build in self.__builds.items() if build.files & dirty}
+        if self.__prelude_files & dirty:
+            self.__prelude_assembler = None
+            self.__checkpoints.clear()
+            roots.update(self.__builds)
+        roots.update(path for path in dirty if path in self.__open_documents and self._build_for(path) is None)
+        for root in sorted(roots):
+            if root in self.__open_documents or any(path in self.__open_documents for path in self.__builds[root].files):
+                self.__builds[root] = self._build(root)
+            else:
+                del self.__builds[root]
+        # A file that was opened before the file that includes it, is from now on built through that file.
+        for root in list(self.__builds):
+            if any(root in build.files for other, build in self.__builds.items() if other != root):
+                del self.__builds[root]
+        for root in list(self.__checkpoints):
+            if root not in self.__builds:
+                del self.__checkpoints[root]
+        self._publish_diagnostics()
+
+    def _initialize(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        options = params.get("initializationOptions") or {}
+        if "prelude" in options:
+            self.__prelude = list(options["prelude"])
+        self.__include_paths = list(options.get("includePaths", []))
+        # Assembler speedups, these cost memory and are off unless enabled in the settings.
+        self.__assembler_options = {
+            "fast_instructions": bool(options.get("fastInstructions", False)),
+            "statement_cache": bool(options.get("statementCache", False)),
+            "line_memo": bool(options.get("lineMemo", False)),
+        }
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": 1},
+                "definitionProvider": True,
+                "hoverProvider": True,
+            },
+            "serverInfo": {"name": "gb-hla"},
+        }
+
+    def _exit(self, params: Dict[str, Any]) -> None:
+        self.running = False
+
+    def _did_open(self, params: Dict[str, Any]) -> None:
+        path = uri_to_path(params["textDocument"]["uri"])
+        self.__files.set_document(path, params["textDocument"]["text"])
+        self.__open_documents.add(path)
+        self.__dirty.add(path)
+
+    def _did_change(self, params: Dict[str, Any]) -> None:
+        path = uri_to_path(params["textDocument"]["uri"])
+        # Only full document sync is supported, so the last change contains the whole text.
+        self.__files.set_document(path, params["contentChanges"][-1]["text"])
+        self.__dirty.add(path)
+
+    def _did_close(self, params: Dict[str, Any]) -> None:
+        path = uri_to_path(params["textDocument"]["uri"])
+        self.__files.remove_document(path)
+        self.__open_documents.discard(path)
+        self.__dirty.add(path)
+
+    def _definition(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.flush()
+        path, word, is_function = self._word_at(params)
+        build = self._build_for(path)
+        if word is None or build is None:
+            return []
+        a = build.assembler
+        if is_function:
+            return [self._location(func.token) for func in a.get_function_overloads(word) if func.token is not None]
+        label = self._find_label(a, word, path, params["position"]["line"] + 1)
+        if label is not None:
+            return [self._location(a.get_label_definitions()[label])]
+        return [self._location(macro.token) for macro in a.get_macro_overloads(word) if macro.token is not None]
+
+    def _hover(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        self.flush()
+        path, word, is_function = self._word_at(params)
+        build = self._build_for(path)
+        if word is None or build is None:
+            return None
+        a = build.assembler
+        if is_function:
+            overloads = a.get_function_overloads(word)
+        else:
+            label = self._find_label(a, word, path, params["position"]["line"] + 1)
+            if label is not None:
+                section, offset = a.get_label(label)
+                address = a.get_label_address(label)
+                text = f"`{label}`: {section.name} + {offset}" if address is None else f"`{label}`: {section.name}, ${address:04X}"
+                return {"contents": {"kind": "markdown", "value": text}}
+            overloads = a.get_macro_overloads(word)
+        if not overloads:
+            return None
+        lines = [format_macro(macro, is_function) for macro in overloads]
+        return {"contents": {"kind": "markdown", "value": "```gbhla\n" + "\n".join(lines) + "\n```"}}
+
+    def _word_at(self, params: Dict[str, Any]) -> Tuple[str, Optional[str], bool]:
+        path = uri_to_path(params["textDocument"]["uri"])
+        line_nr, column = params["position"]["line"], params["position"]["character"]
+        line = self._line(path, line_nr + 1)
+        for m in _WORD_REGEX.finditer(line):
+            if m.start() <= column <= m.end():
+                return path, m.group(), line[m.end():m.end() + 1] == "("
+        return path, None, False
+
+    def _find_label(self, a: Assembler, word: str, path: str, line_nr: int) -> Optional[str]:
+        labels = a.get_label_definitions()
+        if not word.startswith("."):
+            return word if word in labels else None
+        # Local label, prefer the closest definition before the current line in the same file.
+        def rank(label: str) -> Tuple[bool, int]:
+            token = labels[label]
+            before = self._real_filename(token) == path and token.line_nr <= line_nr
+            return before, token.line_nr if before else 0
+        return max((label for label in labels if label.endswith(word) and label != word), key=rank, default=None)
+
+    def _build_for(self, path: str) -> Optional[Build]:
+        if path in self.__builds:
+            return self.__builds[path]
+        for build in self.__builds.values():
+            if path in build.files:
+                return build
+        return None
+
+    def _prelude(self) -> Assembler:
+        if self.__prelude_assembler is None:
+            a = self._new_assembler()
+            for filename in self.__prelude:
+                a.process_file(filename if os.path.isabs(filename) else os.path.join(os.path.dirname(os.path.abspath(__file__)), filename))
+            self.__prelude_assembler = a
+            self.__prelude_files = set(a.get_processed_files())
+        return self.__prelude_assembler
+
+    def _new_assembler(self) -> Assembler:
+        a = Assembler(file_provider=self.__files, record_definitions=True, **self.__assembler_options)
+        for path in self.__include_paths:
+            a.add_include_path(path)
+        return a
+
+    def _build(self, root: str) -> Build:
+        use_prelude = root not in self.__without_prelude
+        if use_prelude:
+            try:
+                prelude = self._prelude()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                use_prelude = False
+        try:
+            lines: Optional[List[str]] = self.__files.read_text(root).split("\n")
+        except OSError:
+            # Leave the error to process_file().
+            lines = None
+        includes = self._leading_includes(lines) if lines is not None else []
+        checkpoints = self.__checkpoints.get(root, [])
+        valid = 0
+        for checkpoint, line_index in zip(checkpoints, includes):
+            if checkpoint.line_index != line_index or checkpoint.line != lines[line_index]:
+                break
+            if any(self.__files.version(path) != version for path, version in checkpoint.versions.items()):
+                break
+            valid += 1
+        checkpoints = self.__checkpoints[root] = checkpoints[:valid]
+        if checkpoints:
+            a = checkpoints[-1].assembler.clone()
+        elif use_prelude:
+            a = prelude.clone()
+        else:
+            a = self._new_assembler()
+        error = None
+        try:
+            for line_index in includes[valid:]:
+                # Same line number as in the file, for errors in the #INCLUDE line itself.
+                before = set(a.get_processed_files())
+                a.process_file(root, code="\n" * line_index + lines[line_index])
+                versions = {path: self.__files.version(path) for path in set(a.get_processed_files()) - before if path != root}
+                checkpoints.append(Checkpoint(line_index, lines[line_index], versions, a.clone()))
+            if lines is not None:
+                for line_index in includes:
+                    lines[line_index] = ""
+            a.process_file(root, code="\n".join(lines) if lines is not None else None)
+            a.link()
+        except AssemblerException as e:
+            if e.token is None:
+                error = (root, 1, e.message)
+            else:
+                filename = self._real_filename(e.token)
+                if use_prelude and filename in self.__prelude_files:
+                    # The prelude files are included again, so build this root without the prelude.
+                    self.__without_prelude.add(root)
+                    self.__checkpoints.pop(root, None)
+                    return self._build(root)
+                error = (filename, e.token.line_nr, e.message)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            error = (root, 1, str(e))
+        files = set(a.get_processed_files())
+        files.add(root)
+        if error is not None and root in self.__builds:
+            # The build stopped early, keep the files of the previous build so changes to them still trigger a build.
+            files |= self.__builds[root].files
+        return Build(root, a, files - self.__prelude_files if use_prelude else files, error)
+
+    @staticmethod
+    def _leading_includes(lines: List[str]) -> List[int]:
+        """Indexes of the #INCLUDE lines before the first other statement."""
+        result = []
+        for index, line in enumerate(lines):
+            if _INCLUDE_LINE_REGEX.match(line):
+                result.append(index)
+            elif not _EMPTY_LINE_REGEX.match(line):
+                break
+        return result
+
+    def _publish_diagnostics(self) -> None:
+        diagnostics: Dict[str, List[Dict[str, Any]]] = {}
+        for build in self.__builds.values():
+            if build.error is None:
+                continue
+            path, line_nr, message = build.error
+            line = self._line(path, line_nr)
+            diagnostic = {
+                "range": {"start": {"line": line_nr - 1, "character": len(line) - len(line.lstrip())}, "end": {"line": line_nr - 1, "character": len(line)}},
+                "severity": 1,
+                "source": "gb-hla",
+                "message": message,
+            }
+            if diagnostic not in diagnostics.setdefault(path, []):
+                diagnostics[path].append(diagnostic)
+        for path in sorted(self.__published | set(diagnostics)):
+            self.__send({"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics", "params": {"uri": path_to_uri(path), "diagnostics": diagnostics.get(path, [])}})
+        self.__published = set(diagnostics)
+
+    def _location(self, token: Token) -> Dict[str, Any]:
+        path = self._real_filename(token)
+        line = self._line(path, token.line_nr)
+        column = max(0, line.find(token.value))
+        return {"uri": path_to_uri(path), "range": {"start": {"line": token.line_nr - 1, "character": column}, "end": {"line": token.line_nr - 1, "character": column + len(token.value)}}}
+
+    def _line(self, path: str, line_nr: int) -> str:
+        try:
+            lines = self.__files.read_text(path).split("\n")
+        except OSError:
+            return ""
+        return lines[line_nr - 1] if 0 < line_nr <= len(lines) else ""
+
+    @staticmethod
+    def _real_filename(token: Token) -> str:
+        return os.path.realpath(token.filename)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="GB.HLA language server, communicates over stdin/stdout")
+    parser.parse_args()
+
+    output = sys.stdout.buffer
+    # The assembler prints progress, which should not end up between the messages.
+    sys.stdout = sys.stderr
+    server = LanguageServer(lambda message: write_message(output, message))
+
+    messages: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+    def reader():
+        while (message := read_message(sys.stdin.buffer)) is not None:
+            messages.put(message)
+            if message.get("method") == "exit":
+                # Stop reading, a thread blocked on stdin prevents a clean shutdown.
+                return
+        messages.put(None)
+    threading.Thread(target=reader, daemon=True).start()
+
+    while server.running:
+        try:
+            message = messages.get(timeout=DEBOUNCE_TIME if server.has_pending_builds() else None)
+        except queue.Empty:
+            server.flush()
+            continue
+        if message is None:
+            break
+        server.handle(message)
+
+
+if __name__ == "__main__":
+    main()
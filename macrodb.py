@@ -1,14 +1,75 @@
-from typing import List, Optional, Dict, Tuple
+from typing import List, Optional, Dict, Tuple, Union
 from collections import defaultdict
-from tokenizer import Token
+from tokenizer import Token, RawBlock
 
 
+def block_contents(tokens: List[Token]) -> List[Token]:
+    """Macro blocks always end in a newline, so the last statement of the block is terminated."""
+    if not tokens or not tokens[-1].isA('NEWLINE'):
+        tokens.append(Token('NEWLINE', '', 0, ''))
+    return tokens
+
+
+# Tokens that can end an expression, an ID after one of these starts the statement that follows the #CYCLES numbers.
+_EXPRESSION_END_KINDS = frozenset(('NUMBER', 'ID', 'STRING', ')', ']'))
+
+
+def cycles_end(tokens: List[Token], start: int) -> int:
+    """Index of the end of the `cycles[, taken]` expressions of a #CYCLES directive that start at tokens[start].
+    This is the NEWLINE, block or statement that follows them, so `#CYCLES 4 db $00` also works on one line."""
+    brackets = 0
+    for idx in range(start, len(tokens)):
+        kind = tokens[idx].kind
+        if kind == '(' or kind == '[':
+            brackets += 1
+        elif kind == ')' or kind == ']':
+            brackets -= 1
+        elif brackets == 0 and kind in ('NEWLINE', '{', '}', 'EOF'):
+            return idx
+        elif brackets == 0 and kind == 'ID' and idx > start and tokens[idx - 1].kind in _EXPRESSION_END_KINDS:
+            return idx
+    return len(tokens)
+
+
+def split_cycles(tokens: List[Token]) -> Tuple[Optional[Tuple[int, int]], List[Token]]:
+    """A macro that starts with `#CYCLES n` or `#CYCLES n, taken` with constant numbers, has these cycles for each use.
+    Returns the (cycles, taken) and the contents without the #CYCLES directive, or None and the unchanged contents.
+    Other expressions, like `#CYCLES 4 + EXTRA`, are left to the #CYCLES directive."""
+    idx = 0
+    while idx < len(tokens) and tokens[idx].kind == 'NEWLINE':
+        idx += 1
+    if idx == len(tokens) or not tokens[idx].isA('DIRECTIVE', '#CYCLES'):
+        return None, tokens
+    end = cycles_end(tokens, idx + 1)
+    line = tokens[idx + 1:end]
+    if len(line) == 1 and line[0].kind == 'NUMBER':
+        cycles = (line[0].value, line[0].value)
+    elif len(line) == 3 and line[0].kind == 'NUMBER' and line[1].kind == ',' and line[2].kind == 'NUMBER':
+        cycles = (line[0].value, line[2].value)
+    else:
+        return None, tokens
+    if end < len(tokens) and tokens[end].kind == 'NEWLINE':
+        end += 1
+    return cycles, tokens[:idx] + tokens[end:]
+
+
+# Tokens that need the normal statement processing (function calls, labels, current address, nested directives).
+_NO_EMIT_PLAN_KINDS = frozenset(('FUNC', 'CURADDR', 'ALABEL', 'LABEL', 'DIRECTIVE', 'TOKENCONCAT', 'STRING', '{', '}', 'EOF'))
+
 
 class Macro:
-    def __init__(self, name: str, params: List[List[Token]], contents: List[Token]):
+    def __init__(self, name: str, params: List[List[Token]], contents: Union[List[Token], RawBlock]):
         self.name = name
         self.params = params
-        self.contents = contents
+        # Name token of the definition, for reporting where the macro comes from.
+        self.token: Optional[Token] = None
+        # Contents can be the source code of the body, which is only tokenized on first use.
+        # Macros are shared between cloned assemblers, so the (cycles, contents) are set with a single assignment.
+        self.__raw = contents if isinstance(contents, RawBlock) else None
+        self.__split: Optional[Tuple[Optional[Tuple[int, int]], List[Token]]] = None if self.__raw is not None else split_cycles(contents)
+        self.__template = None
+        self.__post_template = None
+        self.__emit_plan = None
         self.post_contents = []
         self.chains = {}
         self.linked = None
@@ -20,6 +81,98 @@ class Macro:
                     sort_key.append(-param_idx * 100 - t_idx)
         self.__sort_key = tuple(sort_key)
 
+    def __split_contents(self) -> Tuple[Optional[Tuple[int, int]], List[Token]]:
+        split = self.__split
+        if split is None:
+            split = split_cycles(block_contents(self.__raw.tokens()))
+            self.__split = split
+        return split
+
+    @property
+    def contents(self) -> List[Token]:
+        return self.__split_contents()[1]
+
+    @property
+    def cycles(self) -> Optional[Tuple[int, int]]:
+        """Cycles and cycles when a condition is taken, from a #CYCLES at the start of the macro."""
+        return self.__split_contents()[0]
+
+    def expand(self, args: Dict[str, List[Token]]) -> List[Token]:
+        """Contents of the macro with the parameters replaced by the given arguments."""
+        if self.__template is None:
+            self.__template = self.__compile(self.contents)
+        return Macro.apply_template(self.__template, args)
+
+    def expand_post(self, args: Dict[str, List[Token]]) -> List[Token]:
+        if self.__post_template is None:
+            self.__post_template = self.__compile(self.post_contents)
+        return Macro.apply_template(self.__post_template, args)
+
+    def get_emit_plan(self) -> Tuple:
+        """For macros that only contain db/dw lines, a list of the data to emit directly, without expanding the macro:
+        bytes for constant values, or (size, template) for expressions that still need to be processed.
+        Returns an empty tuple for macros that need the normal expansion."""
+        if self.__emit_plan is None:
+            self.__emit_plan = self.__compile_emit_plan() or ()
+        return self.__emit_plan
+
+    def __compile_emit_plan(self) -> Optional[Tuple]:
+        if self.post_contents or self.chains or self.linked:
+            return None
+        plan = []
+        line = []
+        for token in self.contents:
+            if token.kind != 'NEWLINE':
+                line.append(token)
+                continue
+            if not line:
+                continue
+            if line[0].kind != 'ID' or (line[0].key != 'DB' and line[0].key != 'DW'):
+                return None
+            size = 1 if line[0].key == 'DB' else 2
+            item = []
+            brackets = 0
+            for t in line[1:] + [Token(',', ',', 0, '')]:
+                if t.kind in _NO_EMIT_PLAN_KINDS or (t.kind == 'ID' and t.value.startswith('.')):
+                    return None
+                if t.kind == '(' or t.kind == '[':
+                    brackets += 1
+                elif t.kind == ')' or t.kind == ']':
+                    brackets -= 1
+                if t.kind == ',' and brackets == 0:
+                    if not item:
+                        return None
+                    if len(item) == 1 and item[0].kind == 'NUMBER' and 0 <= item[0].value < (1 << (8 * size)):
+                        plan.append(item[0].value.to_bytes(size, "little"))
+                    else:
+                        plan.append((size, self.__compile(item)))
+                    item = []
+                else:
+                    item.append(t)
+            line = []
+        # Merge constant bytes that follow each other
+        merged = []
+        for entry in plan:
+            if isinstance(entry, bytes) and merged and isinstance(merged[-1], bytes):
+                merged[-1] += entry
+            else:
+                merged.append(entry)
+        return tuple(merged)
+
+    def __compile(self, tokens: List[Token]) -> List[Tuple[Token, Optional[str]]]:
+        param_names = {t.value for param in self.params for t in param if t.kind == 'ID' and t.value.startswith('_')}
+        return [(token, token.value if token.kind == 'ID' and token.value in param_names else None) for token in tokens]
+
+    @staticmethod
+    def apply_template(template: List[Tuple[Token, Optional[str]]], args: Dict[str, List[Token]]) -> List[Token]:
+        result = []
+        for token, param_name in template:
+            if param_name is None:
+                result.append(token)
+            else:
+                result += args[param_name]
+        return result
+
     def is_constant_params(self):
         for param in self.params:
             for t in param:
@@ -84,9 +237,13 @@ class Macro:
 class MacroDB:
     def __init__(self):
         self.__macros: Dict[str, Tuple[List[Macro], List[Macro]]] = defaultdict(lambda: ([], []))
+        # Optional index of statements with only constant parameters to the macro they resolve to.
+        self.index_constant_signatures = False
+        self.__constant_index: Dict[Tuple, Macro] = {}
 
-    def add(self, name: str, params: List[List[Token]], contents: List[Token]) -> Optional[Macro]:
+    def add(self, name: str, params: List[List[Token]], contents: Union[List[Token], RawBlock]) -> Optional[Macro]:
         macro = Macro(name, params, contents)
+        self.__constant_index.clear()
         if macro.is_constant_params():
             for other_macro in self.__macros[name][0]:
                 if other_macro.is_equal(macro):
@@ -101,14 +258,48 @@ class MacroDB:
         return macro
 
     def get(self, name: str, params: List[List[Token]]) -> Optional[Tuple[Macro, Dict[str, List[Token]]]]:
+        if self.index_constant_signatures:
+            key = (name, tuple(tuple((t.kind, t.key) for t in param) for param in params))
+            macro = self.__constant_index.get(key)
+            if macro is not None:
+                return macro, {}
         for macro in self.__macros[name][0]:
             if len(macro.params) != len(params):
                 continue
             res = macro.match_params(params)
             if res is not None:
+                if self.index_constant_signatures:
+                    self.__constant_index[key] = macro
                 return macro, res
         for macro in self.__macros[name][1]:
             res = macro.match_params(params)
             if res is not None:
                 return macro, res
         return None
+
+    def overloads(self, name: str) -> List[Macro]:
+        """All macros with this name, in the order get() tries them."""
+        constant_macros, param_macros = self.__macros.get(name, ((), ()))
+        return list(constant_macros) + list(param_macros)
+
+    def copy(self) -> "MacroDB":
+        """Copy of the database to which macros can be added without changing this one.
+        Macros are not modified after they are defined, so both databases share the Macro objects."""
+        result = MacroDB()
+        result.index_constant_signatures = self.index_constant_signatures
+        for name, (constant_macros, param_macros) in self.__macros.items():
+            result.__macros[name] = (list(constant_macros), list(param_macros))
+        return result
+
+    def __deepcopy__(self, memo) -> "MacroDB":
+        return self.copy()
+
+    def constant_index_size(self) -> int:
+        return len(self.__constant_index)
+
+    def candidates_tried(self, name: str, macro: Macro) -> int:
+        """Number of overloads get() checks before it finds the given macro."""
+        constant_macros, param_macros = self.__macros[name]
+        if macro in constant_macros:
+            return constant_macros.index(macro) + 1
+        return len(constant_macros) + param_macros.index(macro) + 1
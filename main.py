@@ -1,14 +1,25 @@
-from typing import List, Optional, Dict, Tuple, Union
+from typing import List, Optional, Dict, Tuple, Union, Any, Set, Callable
 import binascii
+import concurrent.futures
+import bisect
+import copy
+import itertools
+import multiprocessing
+import operator
 import os
-from tokenizer import Token, Tokenizer
+import time
+from tokenizer import Token, Tokenizer, LineMemo, fold
 from expression import AstNode, parse_expression
 from exception import AssemblerException
-from macrodb import MacroDB, Macro
+from macrodb import MacroDB, Macro, block_contents, cycles_end
 from layout import Layout
 from spaceallocator import SpaceAllocator
+from symboltable import SymbolTable
+from profiler import Profiler, MacroStats, MemoryReport
+from fileprovider import FileProvider, DiskFileProvider
 import builtin
 import gfx
+import datatable
 
 
 def tokens_to_string(tokens: List[Token]) -> str:
@@ -31,6 +42,113 @@ class PostRomBuild(Exception):
     pass
 
 
+def _profile_category(start: Token, next_token: Token) -> Optional[Tuple[str, str]]:
+    if start.kind == 'DIRECTIVE':
+        # Includes are already measured per file.
+        if start.key == '#INCLUDE' or start.key == '#INCLUDE_ONCE':
+            return None
+        return "directive", start.key
+    if start.kind == 'ID':
+        if start.key in ('DB', 'DW', 'DS'):
+            return "directive", start.key
+        if next_token.kind == '=':
+            return "statement", "assignment"
+        if next_token.kind == 'LABEL':
+            return "statement", "label"
+        return "macro", "expand"
+    return None
+
+
+# Operators on numbers, for folding expressions. Comparisons and logic operators give 1 or 0.
+_BINARY_OPERATORS: Dict[str, Callable[[int, int], int]] = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.floordiv,
+    '%': operator.mod,
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+    '>>': operator.rshift,
+    '<<': operator.lshift,
+    '>': lambda a, b: 1 if a > b else 0,
+    '<': lambda a, b: 1 if a < b else 0,
+    '>=': lambda a, b: 1 if a >= b else 0,
+    '<=': lambda a, b: 1 if a <= b else 0,
+    '==': lambda a, b: 1 if a == b else 0,
+    '!=': lambda a, b: 1 if a != b else 0,
+    '&&': lambda a, b: 1 if a and b else 0,
+    '||': lambda a, b: 1 if a or b else 0,
+}
+_UNARY_OPERATORS: Dict[str, Callable[[int], int]] = {
+    '+': lambda a: a,
+    '-': operator.neg,
+    '!': lambda a: 0 if a else 1,
+    # TODO, this clamps to 8 bit.
+    '~': lambda a: (~a) & 0xFF,
+}
+
+
+def _is_label_free(expr: Optional[AstNode]) -> bool:
+    """True if the expression can be calculated without labels, the current address or the final ROM."""
+    if expr is None:
+        return True
+    if expr.kind == 'native':
+        return False
+    if expr.kind == 'value':
+        return expr.token.kind == 'NUMBER' or expr.token.kind == 'STRING'
+    if expr.kind == 'call':
+        func = builtin.get(expr.token.value)
+        if func is None or func.function_type != "function":
+            return False
+    return _is_label_free(expr.left) and _is_label_free(expr.right)
+
+
+def _copy_expr(expr: Optional[AstNode]) -> Optional[AstNode]:
+    # Resolving an expression modifies it, so resolve a copy when the original is still needed for linking.
+    if expr is None:
+        return None
+    return AstNode(expr.kind, expr.token, _copy_expr(expr.left), _copy_expr(expr.right))
+
+
+class _RecordingConstants(dict):
+    """Constants that remember which names were looked up, also the names that were not defined."""
+    def __init__(self, constants: Dict[str, Union[int, str]]):
+        super().__init__(constants)
+        self.reads: Set[str] = set()
+
+    def __getitem__(self, name: str) -> Union[int, str]:
+        self.reads.add(name)
+        return super().__getitem__(name)
+
+    def __contains__(self, name: object) -> bool:
+        self.reads.add(name)
+        return super().__contains__(name)
+
+    def get(self, name: str, default=None):
+        self.reads.add(name)
+        return super().get(name, default)
+
+
+class _StatementCandidate:
+    """Assembler state from just before a statement was processed. Once all the tokens of its expansion
+    are processed, this is used to check if the statement only added constant bytes to the section."""
+    __slots__ = ("key", "remaining", "section", "data_start", "link_count", "assert_count", "cycle_count", "state_changes", "concatenations", "section_depth", "block_depth")
+
+    def __init__(self, key: Tuple, remaining: int, section: "Section", state_changes: int, concatenations: int, section_depth: int, block_depth: int):
+        self.key = key
+        self.remaining = remaining
+        self.section = section
+        self.data_start = len(section.data)
+        self.link_count = len(section.link)
+        self.assert_count = len(section.asserts)
+        self.cycle_count = len(section.cycles)
+        self.state_changes = state_changes
+        self.concatenations = concatenations
+        self.section_depth = section_depth
+        self.block_depth = block_depth
+
+
 class Section:
     def __init__(self, layout: Layout, name_token: Token, base_address: Optional[int] = None, bank: Optional[int] = None) -> None:
         self.layout = layout
@@ -41,6 +159,13 @@ class Section:
         self.data = bytearray()
         self.link: Dict[int, Tuple[int, AstNode]] = {}
         self.asserts: List[Tuple[int, AstNode, str]] = []
+        # The address needs to be align_offset modulo 2**alignment.
+        self.alignment = 0
+        self.align_offset = 0
+        # Sections with the same union name share the same space, see Assembler._union_section.
+        self.union: Optional[str] = None
+        # (offset, cycles, cycles when taken) of the instructions in the section, in order of offset.
+        self.cycles: List[Tuple[int, int, int]] = []
 
     def add16(self, node: AstNode) -> None:
         if node.kind == 'value' and node.token.kind == 'NUMBER':
@@ -71,12 +196,11 @@ class Section:
 
 
 class Assembler:
-    def __init__(self):
+    def __init__(self, *, profile: bool = False, macro_stats: bool = False, memory_report: bool = False, lazy_macros: bool = False, fast_instructions: bool = False, statement_cache: bool = False, line_memo: bool = False, file_provider: Optional[FileProvider] = None, record_definitions: bool = False):
         self.__macro_db = MacroDB()
         self.__func_db = MacroDB()
         self.__constants: Dict[str, Union[int, str]] = {}
-        self.__labels: Dict[str, Tuple[Section, int]] = {}
-        self.__anonymous_label_count = 0
+        self.__labels = SymbolTable()
         self.__sections: List[Section] = []
         self.__current_scope: Optional[str] = None
         self.__include_paths = [os.path.dirname(__file__)]
@@ -87,53 +211,112 @@ class Assembler:
         self.__block_macro_stack: List[Tuple[Macro, Dict[str, List[Token]]]] = []
         self.__user_stack: Dict[str, List[int]] = {}
         self.__linking_allocation_done = False
+        self.__object_cache_path: Optional[str] = None
+        self.__files = file_provider if file_provider is not None else DiskFileProvider()
+        # Keep the source code of macro bodies, and only tokenize it when the macro is used.
+        self.__lazy_macros = lazy_macros
+        self.__processed_files = set()
+        # Emit macros that only contain db/dw lines directly, instead of expanding them.
+        self.__fast_instructions = fast_instructions
+        self.__macro_db.index_constant_signatures = fast_instructions
+        self.__found_files: Dict[Tuple[Tuple[str, ...], str], str] = {}
+        # Remember the tokens of source lines, so lines that are repeated (like most instructions) are only tokenized once.
+        self.__line_memo = LineMemo() if line_memo else None
+        # Bytes (and instruction cycles) of statements that always produce the same constant bytes, keyed on the statement tokens.
+        # Statements that turned out to depend on labels, constants or other state are remembered as uncachable.
+        self.__statement_cache: Optional[Dict[Tuple, Tuple[bytes, Tuple[Tuple[int, int, int], ...]]]] = {} if statement_cache else None
+        self.__uncachable_statements = set()
+        # Name token of each label definition, for editors to find where a label comes from.
+        self.__label_definitions: Optional[Dict[str, Token]] = {} if record_definitions else None
+        # Counts everything a statement could do besides adding bytes: directives, labels, assignments and constant use.
+        self.__state_changes = 0
+        self.profiler = Profiler(profile)
+        self.macro_stats = MacroStats(macro_stats)
+        self.memory_report = MemoryReport(memory_report)
     
     def add_include_path(self, path: str) -> None:
         self.__include_paths.append(path)
 
-    def process_file(self, filename) -> None:
+    def set_object_cache(self, path: Optional[str]) -> None:
+        self.__object_cache_path = path
+
+    def process_file(self, filename, *, code: Optional[str] = None) -> None:
+        """Process a source file. If code is given it is used instead of the contents of the file,
+        so the language server can process a file in parts."""
         self.__section_stack = []
         self.__block_macro_stack = []
         self.__current_scope = None
 
         self.__include_paths.append(os.path.dirname(filename))
-        self._process_file(filename)
+        self._process_file(filename, code)
         self.__include_paths.pop()
 
         if self.__section_stack:
             raise AssemblerException(Token('EOF', '', 1, filename), f"End of file reached with section open")
+        if self.memory_report.enabled:
+            self._memory_snapshot("process")
 
-    def _process_file(self, filename):
+    def _process_file(self, filename, code: Optional[str] = None):
         print(f"Processing file: {filename}")
-        self.process_code(open(filename, "rt").read(), filename=filename)
+        self.__processed_files.add(self.__files.realpath(filename))
+        with self.profiler.measure("file", filename):
+            self.process_code(self.__files.read_text(filename) if code is None else code, filename=filename)
 
     def _find_file_in_include_paths(self, filename: Token) -> str:
+        key = (tuple(self.__include_paths), filename.value)
+        full_path = self.__found_files.get(key)
+        if full_path is not None:
+            return full_path
         for path in self.__include_paths:
             full_path = os.path.join(path, filename.value)
-            if os.path.exists(full_path):
+            if self.__files.exists(full_path):
+                self.__found_files[key] = full_path
                 return full_path
         raise AssemblerException(filename, f"File not found: {filename.value}")
 
-    def _include_file(self, filename: Token):
-        return self._process_file(self._find_file_in_include_paths(filename))
+    def _find_files_in_include_paths(self, pattern: Token) -> List[str]:
+        if not any(c in pattern.value for c in "*?["):
+            return [self._find_file_in_include_paths(pattern)]
+        for path in self.__include_paths:
+            matches = self.__files.glob(os.path.join(path, pattern.value))
+            if matches:
+                return matches
+        raise AssemblerException(pattern, f"File not found: {pattern.value}")
+
+    def _include_file(self, filename: Token, *, once: bool = False):
+        full_path = self._find_file_in_include_paths(filename)
+        if once and self.__files.realpath(full_path) in self.__processed_files:
+            return
+        return self._process_file(full_path)
 
     def process_code(self, code, *, filename="[string]"):
         tok = Tokenizer(self.__constants)
-        tok.add_code(code, filename=filename)
+        with self.profiler.measure("tokenize", filename):
+            tok.add_code(code, filename=filename, line_memo=self.__line_memo, raw_macro_bodies=self.__lazy_macros)
+        profiler = self.profiler if self.profiler.enabled else None
+        candidates: List[_StatementCandidate] = []
         while start := tok.pop():
+            # A candidate is done once the token after its expansion is popped.
+            while candidates and len(tok) < candidates[-1].remaining:
+                self._finish_statement_candidate(candidates.pop(), tok)
             if start.isA('NEWLINE'):
                 continue
             if start.isA('EOF'):
                 break
+            if profiler is not None:
+                category = _profile_category(start, tok.peek())
+                start_time = time.perf_counter()
+            if start.kind == 'DIRECTIVE':
+                self.__state_changes += 1
             if start.isA('DIRECTIVE', '#MACRO'):
                 self._add_macro(tok)
             elif start.isA('DIRECTIVE', '#FMACRO'):
                 self._add_function(tok)
-            elif start.isA('DIRECTIVE', '#INCLUDE'):
+            elif start.isA('DIRECTIVE', '#INCLUDE') or start.isA('DIRECTIVE', '#INCLUDE_ONCE'):
                 params = self._fetch_parameters(tok)
                 if len(params) != 1 or len(params[0]) != 1 or params[0][0].kind != 'STRING':
                     raise AssemblerException(start, "Syntax error")
-                self._include_file(params[0][0])
+                self._include_file(params[0][0], once=start.isA('DIRECTIVE', '#INCLUDE_ONCE'))
             elif start.isA('DIRECTIVE', '#INCBIN'):
                 params = self._fetch_parameters(tok)
                 if len(params[0]) != 1 or params[0][0].kind != 'STRING':
@@ -146,8 +329,7 @@ class Assembler:
                     bin_params[pkey.value] = [self._resolve_expr(None, param) for param in pvalue]
                 if bin_params:
                     raise AssemblerException(start, f"Unknown option: {next(iter(bin_params.keys()))}")
-                with open(self._find_file_in_include_paths(params[0][0]), "rb") as f:
-                    self.__section_stack[-1].data += f.read()
+                self.__section_stack[-1].data += self.__files.read_bytes(self._find_file_in_include_paths(params[0][0]))
             elif start.isA('DIRECTIVE', '#INCGFX'):
                 params = self._fetch_parameters(tok)
                 if len(params[0]) != 1 or params[0][0].kind != 'STRING':
@@ -158,17 +340,46 @@ class Assembler:
                 for param in params[1:]:
                     pkey, pvalue = self._bracket_param(param)
                     gfx_params[pkey.value] = [self._resolve_expr(None, param) for param in pvalue]
-                self.__section_stack[-1].data += gfx.read(params[0][0], self._find_file_in_include_paths(params[0][0]), gfx_params)
-            elif start.isA('DIRECTIVE', '#INCRGBDS'):
+                with self.profiler.measure("import", "gfx"):
+                    self.__section_stack[-1].data += gfx.read(params[0][0], self.__files.read_bytes(self._find_file_in_include_paths(params[0][0])), gfx_params)
+            elif start.isA('DIRECTIVE', '#INCDATA'):
                 params = self._fetch_parameters(tok)
-                if len(params) != 1 or len(params[0]) != 1 or params[0][0].kind != 'STRING':
+                if len(params[0]) != 1 or params[0][0].kind != 'STRING':
                     raise AssemblerException(start, "Syntax error")
-                self._add_rgbds_object(self._find_file_in_include_paths(params[0][0]))
-            elif start.isA('DIRECTIVE', '#INCSDCC'):
+                if not self.__section_stack:
+                    raise AssemblerException(start, "Expression outside of section")
+                data_params = {}
+                for param in params[1:]:
+                    # Column types and the COUNT name are names, so these are not resolved as labels or constants.
+                    pkey, pvalue = self._bracket_param(param, raw=True)
+                    data_params[pkey.value] = pvalue
+                count_token = None
+                if "COUNT" in data_params:
+                    count = data_params.pop("COUNT")
+                    if len(count) != 1 or len(count[0]) != 1 or count[0][0].kind not in ('ID', 'STRING'):
+                        raise AssemblerException(start, "Syntax error in COUNT[name]")
+                    count_token = count[0][0]
+                    if count_token.value in self.__constants:
+                        raise AssemblerException(count_token, "Duplicate constant")
+                with self.profiler.measure("import", "data"):
+                    filename = self._find_file_in_include_paths(params[0][0])
+                    data, row_count = datatable.read(params[0][0], filename, self.__files.read_bytes(filename), data_params)
+                self.__section_stack[-1].data += data
+                if count_token is not None:
+                    self.__constants[count_token.value] = row_count
+            elif start.isA('DIRECTIVE', '#INCRGBDS') or start.isA('DIRECTIVE', '#INCSDCC'):
                 params = self._fetch_parameters(tok)
-                if len(params) != 1 or len(params[0]) != 1 or params[0][0].kind != 'STRING':
+                filenames = []
+                for param in params:
+                    if len(param) != 1 or param[0].kind != 'STRING':
+                        raise AssemblerException(start, "Syntax error")
+                    filenames += self._find_files_in_include_paths(param[0])
+                if not filenames:
                     raise AssemblerException(start, "Syntax error")
-                self._add_sdcc_object(self._find_file_in_include_paths(params[0][0]))
+                try:
+                    self._add_objects("rgbds" if start.isA('DIRECTIVE', '#INCRGBDS') else "sdcc", filenames)
+                except ValueError as e:
+                    raise AssemblerException(start, f"Invalid object file: {e}")
             elif start.isA('DIRECTIVE', '#LAYOUT'):
                 self._define_layout(start, tok)
             elif start.isA('DIRECTIVE', '#SECTION'):
@@ -192,6 +403,22 @@ class Assembler:
                             raise AssemblerException(condition.token, f"Assertion failure: {message}")
                     else:
                         self.__section_stack[-1].asserts.append((len(self.__section_stack[-1].data), condition, message))
+            elif start.isA('DIRECTIVE', '#CYCLES'):
+                # The statement that follows the numbers on the same line is processed as usual.
+                line = []
+                while tok.peek().kind not in ('NEWLINE', 'EOF'):
+                    line.append(tok.pop())
+                end = cycles_end(line, 0)
+                tok.prepend(line[end:])
+                cycles_tok = Tokenizer(self.__constants)
+                cycles_tok.prepend(line[:end])
+                params = self._fetch_parameters(cycles_tok)
+                if len(params) < 1 or len(params) > 2:
+                    raise AssemblerException(start, "Syntax error, expected: #CYCLES cycles[, cycles when taken]")
+                if not self.__section_stack:
+                    raise AssemblerException(start, "Cycles outside of section")
+                cycles = [self._resolve_to_number(param) for param in params]
+                self.__section_stack[-1].cycles.append((len(self.__section_stack[-1].data), cycles[0], cycles[-1]))
             elif start.isA('DIRECTIVE', '#PRINT'):
                 for expr in self._fetch_parameters(tok):
                     expr = self._process_expression(expr)
@@ -206,7 +433,7 @@ class Assembler:
                 if allow:
                     self.__block_macro_stack.append((None, None))  # Empty macro block to indicate we have an open true IF part
                 else:
-                    self._get_raw_macro_block(start, tok)
+                    self._skip_raw_macro_block(start, tok)
                     if tok.peek().isA('ID', 'ELSE'):
                         tok.pop()
                         tok.expect('{')
@@ -272,12 +499,14 @@ class Assembler:
                     self.__section_stack[-1].add16(self._process_expression(param))
             elif start.isA('ID') and tok.peek().isA('='):
                 tok.pop()
+                self.__state_changes += 1
                 params = self._fetch_parameters(tok)
                 if len(params) != 1:
                     raise AssemblerException(start, "Syntax error")
                 self.__constants[start.value] = self._resolve_to_number_or_string(params[0])
             elif start.isA('ID') and tok.peek().isA('LABEL'):
                 tok.pop()
+                self.__state_changes += 1
                 label = start.value
                 if start.value.startswith("."):
                     label = f"{self.__current_scope}{label}"
@@ -287,15 +516,20 @@ class Assembler:
                     raise AssemblerException(start, "Duplicate label")
                 if not self.__section_stack:
                     raise AssemblerException(start, "Trying to place label outside of section")
-                self.__labels[label] = (self.__section_stack[-1], len(self.__section_stack[-1].data))
+                self.__labels.add(label, self.__section_stack[-1], len(self.__section_stack[-1].data))
+                if self.__label_definitions is not None:
+                    self.__label_definitions[label] = start
             elif start.isA('LABEL'):  # anonymous label
+                self.__state_changes += 1
                 if not self.__section_stack:
                     raise AssemblerException(start, "Trying to place an anonymous label outside of section")
-                self.__anonymous_label_count += 1
-                self.__labels[f"__anonymous_{self.__anonymous_label_count}"] = (self.__section_stack[-1], len(self.__section_stack[-1].data))
+                self.__labels.add_anonymous(self.__section_stack[-1], len(self.__section_stack[-1].data))
             elif start.isA('ID'):
-                self._process_statement(start, tok)
+                candidate = self._process_statement(start, tok)
+                if candidate is not None:
+                    candidates.append(candidate)
             elif start.isA('}'):
+                self.__state_changes += 1
                 if self.__block_macro_stack:
                     macro, macro_args = self.__block_macro_stack.pop()
                     if macro is None:
@@ -303,22 +537,23 @@ class Assembler:
                         if tok.peek().isA('ID', 'ELSE'):
                             tok.pop()
                             tok.expect('{')
-                            self._get_raw_macro_block(start, tok)
+                            self._skip_raw_macro_block(start, tok)
                     else:
                         # End of an macro block, check if we need to add "end of macro" or if we chain into another part of this macro.
-                        macro_contents = macro.post_contents
+                        if self.macro_stats.enabled:
+                            start_time = time.perf_counter()
+                        chained = False
                         if tok.peek().isA('ID') and tok.peek().value in macro.chains:
                             macro = macro.chains[tok.peek().value]
-                            macro_contents = macro.contents
+                            chained = True
                             self.__block_macro_stack.append((macro, macro_args))
                             tok.pop()
                             tok.expect('{')
-                        prepend = []
-                        for token in macro_contents:
-                            if token.kind == 'ID' and token.value in macro_args:
-                                prepend += macro_args[token.value]
-                            else:
-                                prepend.append(token)
+                            prepend = macro.expand(macro_args)
+                        else:
+                            prepend = macro.expand_post(macro_args)
+                        if self.macro_stats.enabled and prepend:
+                            self.macro_stats.record(macro, len(prepend), self.macro_stats.depth(tok), time.perf_counter() - start_time, invocation=chained)
                         tok.prepend(prepend)
                 elif self.__section_stack:
                     self.__section_stack.pop()
@@ -326,69 +561,158 @@ class Assembler:
                     raise AssemblerException(start, f"Unexpected }}")
             else:
                 raise AssemblerException(start, f"Syntax error: unexpected {start.kind}")
+            if profiler is not None:
+                if category is not None:
+                    profiler.add(category[0], category[1], time.perf_counter() - start_time)
 
     def link(self, *, print_free_space=False):
         link_exception = None
 
-        sa = SpaceAllocator(self.__layouts)
-        for section in self.__sections:
-            if section.base_address > -1:
-                if not sa.allocate_fixed(section.layout.name, section.base_address, len(section.data), bank=section.bank):
-                    raise AssemblerException(section.token, f"Failed to allocate fixed region: {section.base_address:04x}-{section.base_address+len(section.data):04x}")
-        for section in self.__sections:
-            if section.base_address < 0:
-                bank_addr = sa.allocate(section.layout.name, len(section.data), bank=section.bank)
-                if bank_addr is None:
-                    raise AssemblerException(section.token, f"Failed to allocate region of size: {len(section.data):04x}")
-                bank, addr = bank_addr
-                section.bank = bank
-                section.base_address = addr
+        with self.profiler.measure("link", "allocation"):
+            sa = SpaceAllocator(self.__layouts)
+            # Each union is allocated once, as a section that covers all its members.
+            unions: Dict[str, List[Section]] = {}
+            for section in self.__sections:
+                if section.union is not None:
+                    unions.setdefault(section.union, []).append(section)
+            union_sections = {name: self._union_section(members) for name, members in unions.items()}
+            allocations = []
+            for section in self.__sections:
+                if section.union is None:
+                    allocations.append(section)
+                elif section is unions[section.union][0]:
+                    allocations.append(union_sections[section.union])
+            for section in allocations:
+                if section.base_address > -1:
+                    if not sa.allocate_fixed(section.layout.name, section.base_address, len(section.data), bank=section.bank):
+                        raise AssemblerException(section.token, f"Failed to allocate fixed region: {section.base_address:04x}-{section.base_address+len(section.data):04x}")
+            # Aligned sections fit in the fewest places, so these are placed first.
+            for section in sorted(allocations, key=lambda section: -section.alignment):
+                if section.base_address < 0:
+                    bank_addr = sa.allocate(section.layout.name, len(section.data), bank=section.bank, alignment=section.alignment, align_offset=section.align_offset)
+                    if bank_addr is None:
+                        raise AssemblerException(section.token, f"Failed to allocate region of size: {len(section.data):04x}")
+                    bank, addr = bank_addr
+                    section.bank = bank
+                    section.base_address = addr
+            for name, members in unions.items():
+                for section in members:
+                    section.bank = union_sections[name].bank
+                    section.base_address = union_sections[name].base_address
+        self.__labels.finalize()
         self.__linking_allocation_done = True
-        for section in self.__sections:
-            self.linking_section = section
-            for offset, expr, message in section.asserts:
-                try:
-                    expr = self._resolve_expr(section.base_address + offset, expr)
-                except PostRomBuild:
-                    pass
-                if expr.kind != 'value' or expr.token.kind != 'NUMBER':
-                    raise AssemblerException.from_expression(expr, f"Assertion failure (symbol not found?) {expr}")
-                if expr.token.value == 0:
-                    raise AssemblerException.from_expression(expr, f"Assertion failure: {message}")
-            for offset, (link_size, expr) in section.link.items():
-                try:
-                    expr = self._resolve_expr(section.base_address + offset, expr)
-                except PostRomBuild:
-                    self.__post_build_link.append((section, offset, link_size, expr))
-                else:
-                    if expr.kind != 'value':
-                        print(f"Failed to parse linking '{expr}', symbol not found?")
-                        if not link_exception:
-                            link_exception = AssemblerException.from_expression(expr, f"Failed to parse linking '{expr}', symbol not found?")
+        with self.profiler.measure("link", "relocation"):
+            for section in self.__sections:
+                self.linking_section = section
+                for offset, expr, message in section.asserts:
+                    value = self._link_value(section.base_address + offset, expr)
+                    if value is not None:
+                        if value == 0:
+                            raise AssemblerException.from_expression(expr, f"Assertion failure: {message}")
                         continue
-                    if not expr.token.isA('NUMBER'):
-                        print(f"Failed to link '{expr}', symbol not found?")
-                        if not link_exception:
-                            link_exception = AssemblerException.from_expression(expr, f"Failed to link '{expr}', symbol not found?")
+                    if expr.kind == 'native':
+                        value = expr.evaluate(self, section.base_address + offset)
+                        if value is not None:
+                            if value == 0:
+                                raise AssemblerException.from_expression(expr, f"Assertion failure: {message}")
+                            continue
+                    try:
+                        expr = self._resolve_expr(section.base_address + offset, expr)
+                    except PostRomBuild:
+                        pass
+                    if expr.kind != 'value' or expr.token.kind != 'NUMBER':
+                        raise AssemblerException.from_expression(expr, f"Assertion failure (symbol not found?) {expr}")
+                    if expr.token.value == 0:
+                        raise AssemblerException.from_expression(expr, f"Assertion failure: {message}")
+                for offset, (link_size, expr) in section.link.items():
+                    value = self._link_value(section.base_address + offset, expr)
+                    if value is not None:
+                        self._write_link_value(section.data, offset, link_size, value, expr)
                         continue
-                    if link_size == 1:
-                        if expr.token.value < -128 or expr.token.value > 255:
-                            raise AssemblerException(expr.token, f"Value ({expr.token.value}) out of range for 8 bit value")
-                        section.data[offset] = expr.token.value & 0xFF
-                    elif link_size == 2:
-                        if expr.token.value < 0 or expr.token.value > 0xFFFF:
-                            raise AssemblerException(expr.token, f"Value ({expr.token.value} out of range for 16 bit value")
-                        section.data[offset] = expr.token.value & 0xFF
-                        section.data[offset+1] = expr.token.value >> 8
+                    if expr.kind == 'native':
+                        value = expr.evaluate(self, section.base_address + offset)
+                        if value is not None:
+                            self._write_link_value(section.data, offset, link_size, value, expr)
+                            continue
+                    try:
+                        expr = self._resolve_expr(section.base_address + offset, expr)
+                    except PostRomBuild:
+                        self.__post_build_link.append((section, offset, link_size, expr))
                     else:
-                        raise NotImplementedError()
+                        if expr.kind != 'value':
+                            print(f"Failed to parse linking '{expr}', symbol not found?")
+                            if not link_exception:
+                                link_exception = AssemblerException.from_expression(expr, f"Failed to parse linking '{expr}', symbol not found?")
+                            continue
+                        if not expr.token.isA('NUMBER'):
+                            print(f"Failed to link '{expr}', symbol not found?")
+                            if not link_exception:
+                                link_exception = AssemblerException.from_expression(expr, f"Failed to link '{expr}', symbol not found?")
+                            continue
+                        self._write_link_value(section.data, offset, link_size, expr.token.value, expr)
         if link_exception:
             raise link_exception
         if print_free_space:
             sa.dump_free_space()
+        if self.memory_report.enabled:
+            self._memory_snapshot("link")
         return self.__sections
 
+    def _link_value(self, offset: int, expr: AstNode) -> Optional[int]:
+        """Value of an expression of numbers, labels and @ after all sections are placed, without changing the expression.
+        Returns None for anything else, which is left to _resolve_expr()."""
+        if expr.kind == 'value':
+            kind = expr.token.kind
+            if kind == 'NUMBER':
+                return expr.token.value
+            if kind == 'ID':
+                return self.__labels.address(expr.token.value)
+            if kind == 'ALABEL':
+                return self.__labels.anonymous_address(expr.token.value)
+            if kind == 'CURADDR':
+                return offset
+            return None
+        if expr.left is None:
+            return None
+        if expr.right is None:
+            unary = _UNARY_OPERATORS.get(expr.kind)
+            if unary is None:
+                return None
+            value = self._link_value(offset, expr.left)
+            return unary(value) if value is not None else None
+        binary = _BINARY_OPERATORS.get(expr.kind)
+        if binary is None:
+            return None
+        left = self._link_value(offset, expr.left)
+        if left is None:
+            return None
+        right = self._link_value(offset, expr.right)
+        if right is None:
+            return None
+        return binary(left, right)
+
+    def _write_link_value(self, data: bytearray, offset: int, link_size: int, value: int, expr: AstNode) -> None:
+        if link_size == 1:
+            if value < -128 or value > 255:
+                raise AssemblerException.from_expression(expr, f"Value ({value}) out of range for 8 bit value")
+            data[offset] = value & 0xFF
+        elif link_size == 2:
+            if value < 0 or value > 0xFFFF:
+                raise AssemblerException.from_expression(expr, f"Value ({value} out of range for 16 bit value")
+            data[offset] = value & 0xFF
+            data[offset+1] = value >> 8
+        else:
+            raise NotImplementedError()
+
     def build_rom(self, pad_value=None):
+        with self.profiler.measure("build", "rom"):
+            rom = self._build_rom(pad_value)
+        if self.memory_report.enabled:
+            self._memory_snapshot("build")
+            self.memory_report.stop()
+        return rom
+
+    def _build_rom(self, pad_value):
         max_bank = {}
         for section in self.__sections:
             if section.bank is None:
@@ -436,9 +760,26 @@ class Assembler:
                 raise NotImplementedError()
         return self.__rom
 
+    def _memory_snapshot(self, phase: str) -> None:
+        caches = {
+            "found files": (len(self.__found_files), None),
+            "macro index": (self.__macro_db.constant_index_size(), None),
+        }
+        if self.__line_memo is not None:
+            caches["line memo"] = (len(self.__line_memo), LineMemo.SIZE)
+        if self.__statement_cache is not None:
+            caches["statement cache"] = (len(self.__statement_cache), None)
+            caches["uncachable"] = (len(self.__uncachable_statements), None)
+        self.memory_report.snapshot(phase, self, {"tokens": Token, "ast nodes": AstNode, "macros": Macro, "sections": Section}, {
+            "labels": len(self.__labels),
+            "constants": len(self.__constants),
+            "link entries": sum(len(section.link) for section in self.__sections),
+            "section bytes": sum(len(section.data) for section in self.__sections),
+        }, caches)
+
     def save_symbols(self, filename: str) -> None:
-        with open(filename, "wt") as f:
-            for label, (section, offset) in self.__labels.items():
+        with self.profiler.measure("output", "symbols"), open(filename, "wt") as f:
+            for label, section, offset in self.__labels:
                 address = section.base_address + offset
                 bank = section.bank if section.bank is not None else 0
                 f.write(f"{bank:02x}:{address:04x} {label}\n")
@@ -448,17 +789,15 @@ class Assembler:
         for section in self.__sections:
             bank = section.bank or 0
             print(f"Section: {section.layout.name}[{bank:02x}]:{section.name}:{section.base_address:04x}")
-            offset_to_label = {}
-            for label, (label_section, label_offset) in self.__labels.items():
-                if section == label_section:
-                    offset_to_label[label_offset] = label
+            offset_to_label = self.__labels.labels_in(section)
             byte_idx = 0
             for offset, c in enumerate(section.data):
                 if offset in offset_to_label:
                     if byte_idx > 0:
                         byte_idx = 0
                         print("")
-                    print(f"{offset_to_label[offset]}:")
+                    for label in offset_to_label[offset]:
+                        print(f"{label}:")
                 if byte_idx == 0:
                     print(" ", end="")
                 print(f" {c:02X}", end="")
@@ -469,16 +808,97 @@ class Assembler:
             if byte_idx > 0:
                 byte_idx = 0
                 print("")
-            if len(section.data) in offset_to_label:
-                print(f"{offset_to_label[len(section.data)]}:")
+            for label in offset_to_label.get(len(section.data), ()):
+                print(f"{label}:")
     
     def get_label(self, label: str) -> Tuple[Section, Optional[int]]:
-        if label in self.__labels:
-            return self.__labels[label]
-        return None, None
+        return self.__labels.get(label)
+
+    def get_anonymous_label(self, index: int) -> Tuple[Section, Optional[int]]:
+        return self.__labels.get_anonymous(index)
+
+    def get_label_address(self, label: str) -> Optional[int]:
+        return self.__labels.address(label)
+
+    def get_cycles(self, section: Section, start: int, end: int) -> Tuple[int, int]:
+        """Best and worst case cycles of the instructions from offset start up to end in the section.
+        This is a single pass through the code: loops and called functions are not included."""
+        first = bisect.bisect_left(section.cycles, start, key=lambda entry: entry[0])
+        last = bisect.bisect_left(section.cycles, end, key=lambda entry: entry[0])
+        entries = section.cycles[first:last]
+        return sum(min(cycles, taken) for _, cycles, taken in entries), sum(max(cycles, taken) for _, cycles, taken in entries)
+
+    def cycle_report(self, limit: Optional[int] = 20) -> str:
+        """The routines (code from a global label up to the next one) with the most cycles."""
+        routines = []
+        for section in self.__sections:
+            if not section.cycles:
+                continue
+            # Global labels at the same offset are names of the same routine.
+            starts = []
+            for offset, labels in sorted(self.__labels.labels_in(section).items()):
+                names = [label for label in labels if "." not in label and not label.startswith("__")]
+                if names:
+                    starts.append((offset, ", ".join(names)))
+            ends = [offset for offset, _ in starts[1:]] + [len(section.data)]
+            for (start, label), end in zip(starts, ends):
+                best, worst = self.get_cycles(section, start, end)
+                if worst > 0:
+                    routines.append((label, section.name, best, worst))
+        routines.sort(key=lambda routine: routine[3], reverse=True)
+        lines = ["Cycles per routine (single pass, without loops and calls):", f"  {'routine':40} {'section':30} {'best':>8} {'worst':>8}"]
+        for label, section_name, best, worst in routines[:limit]:
+            lines.append(f"  {label[:40]:40} {section_name[:30]:30} {best:8} {worst:8}")
+        return "\n".join(lines)
+
+    def get_section(self, name: str) -> Optional[Section]:
+        for section in self.__sections:
+            if section.name == name:
+                return section
+        return None
+
+    def get_layout(self, name: str) -> Optional[Layout]:
+        return self.__layouts.get(name.upper())
     
+    def get_label_definitions(self) -> Dict[str, Token]:
+        """Name token of each label defined in the code, only recorded with record_definitions enabled."""
+        return self.__label_definitions or {}
+
+    def get_macro_overloads(self, name: str) -> List[Macro]:
+        return self.__macro_db.overloads(fold(name))
+
+    def get_function_overloads(self, name: str) -> List[Macro]:
+        return self.__func_db.overloads(fold(name))
+
+    def get_processed_files(self) -> List[str]:
+        """Real paths of all source files processed so far."""
+        return sorted(self.__processed_files)
+
     def get_constant(self, name: str) -> Optional[Union[int, str]]:
         return self.__constants.get(name)
+
+    def set_constant(self, name: str, value: Union[int, str]) -> None:
+        """Define a constant, as if the code contained `name = value`"""
+        self.__constants[name] = value
+
+    def record_constant_reads(self) -> Set[str]:
+        """Start recording the names of the constants that are looked up, until stop_recording_constant_reads().
+        Returns the set the names are added to."""
+        self.__constants = _RecordingConstants(self.__constants)
+        return self.__constants.reads
+
+    def stop_recording_constant_reads(self) -> None:
+        self.__constants = dict(self.__constants)
+
+    def clone(self) -> "Assembler":
+        """Independent copy of the current state, to continue with different code or constants from a shared starting point.
+        Should be used between process_file() calls, not during linking. The profiling reports of the copy start out empty."""
+        memo = {
+            id(self.profiler): Profiler(self.profiler.enabled),
+            id(self.macro_stats): MacroStats(self.macro_stats.enabled),
+            id(self.memory_report): MemoryReport(self.memory_report.enabled),
+        }
+        return copy.deepcopy(self, memo)
     
     def get_sections(self, layout_name: str) -> List[Section]:
         return [section for section in self.__sections if section.layout.name == layout_name]
@@ -491,7 +911,7 @@ class Assembler:
         if len(params) < 1:
             raise AssemblerException(start, "Expected name of section layout")
         name, (start_addr, end_addr) = self._bracket_param(params[0], 2)
-        if name.value.upper() in self.__layouts:
+        if name.key in self.__layouts:
             raise AssemblerException(start, "Duplicate layout name")
         layout = Layout(name.value, start_addr.token.value, end_addr.token.value)
         for param in params[1:]:
@@ -510,7 +930,29 @@ class Assembler:
                 layout.banked = True
             else:
                 raise AssemblerException(pkey, "Unknown parameter to #LAYOUT")
-        self.__layouts[name.value.upper()] = layout
+        self.__layouts[name.key] = layout
+
+    def _union_section(self, members: List[Section]) -> Section:
+        """Section with the size of the largest member of a union, and the fixed address, bank and alignment of all members."""
+        union = Section(members[0].layout, members[0].token)
+        union.data = bytearray(max(len(section.data) for section in members))
+        for section in members:
+            if section.base_address > -1:
+                if union.base_address > -1 and union.base_address != section.base_address:
+                    raise AssemblerException(section.token, f"Section is placed at a different address from the other sections in UNION \"{section.union}\"")
+                union.base_address = section.base_address
+            if section.bank is not None:
+                if union.bank is not None and union.bank != section.bank:
+                    raise AssemblerException(section.token, f"Section is placed in a different bank from the other sections in UNION \"{section.union}\"")
+                union.bank = section.bank
+            if section.alignment > union.alignment:
+                union.alignment = section.alignment
+                union.align_offset = section.align_offset
+        for section in members:
+            mask = (1 << section.alignment) - 1
+            if (union.align_offset & mask) != section.align_offset or (union.base_address > -1 and (union.base_address & mask) != section.align_offset):
+                raise AssemblerException(section.token, f"Alignment of section does not match the other sections in UNION \"{section.union}\"")
+        return union
 
     def _start_section(self, start: Token, tok: Tokenizer):
         params = self._fetch_parameters(tok, params_end='{')
@@ -528,15 +970,15 @@ class Assembler:
         address = -1
         if section_type_param:
             address = section_type_param[0].token.value
-        if section_type.value.upper() not in self.__layouts:
+        if section_type.key not in self.__layouts:
             raise AssemblerException(section_type, "Section type not found")
-        layout = self.__layouts[section_type.value.upper()]
+        layout = self.__layouts[section_type.key]
         if address > -1 and not (layout.start_addr <= address < layout.end_addr):
             raise AssemblerException(section_type, "Address out of range for section")
         section = Section(layout, name.token, address)
         for param in params[2:]:
             pkey, pvalue = self._bracket_param(param)
-            if pkey.value.upper() == 'BANK':
+            if pkey.key == 'BANK':
                 if len(pvalue) != 1:
                     raise AssemblerException(pkey, "BANK requires an argument")
                 if not layout.banked:
@@ -546,23 +988,64 @@ class Assembler:
                     raise AssemblerException(pkey, f"Bank number need to be at least {layout.bank_min}")
                 if layout.bank_max is not None and section.bank >= layout.bank_max:
                     raise AssemblerException(pkey, f"Bank number needs to be lower then {layout.bank_max}")
+            elif pkey.key == 'ALIGN':
+                if len(pvalue) < 1 or len(pvalue) > 2 or not all(value.is_number() for value in pvalue):
+                    raise AssemblerException(pkey, "ALIGN requires the number of bits and optionally an offset")
+                section.alignment = pvalue[0].token.value
+                section.align_offset = pvalue[1].token.value if len(pvalue) > 1 else 0
+                if not 0 <= section.alignment <= 16:
+                    raise AssemblerException(pkey, "Alignment needs to be between 0 and 16 bits")
+                if not 0 <= section.align_offset < (1 << section.alignment):
+                    raise AssemblerException(pkey, f"Alignment offset needs to be lower then {1 << section.alignment}")
+            elif pkey.key == 'UNION':
+                if len(pvalue) != 1 or pvalue[0].kind != 'value' or pvalue[0].token.kind != 'STRING':
+                    raise AssemblerException(pkey, "UNION requires a name")
+                if layout.rom_location is not None:
+                    raise AssemblerException(pkey, "UNION can only be used for sections that are not stored in the ROM")
+                section.union = pvalue[0].token.value
+                for other in self.__sections:
+                    if other.union == section.union and other.layout is not layout:
+                        raise AssemblerException(pkey, f"Sections in UNION \"{section.union}\" need to be of the same type")
             else:
                 raise AssemblerException(pkey, "Unknown parameter to #SECTION")
+        if address > -1 and address % (1 << section.alignment) != section.align_offset:
+            raise AssemblerException(section_type, "Address does not match the alignment of the section")
         self.__section_stack.append(section)
         self.__sections.append(section)
 
-    def _process_statement(self, start: Token, tok: Tokenizer):
+    def _process_statement(self, start: Token, tok: Tokenizer) -> Optional[_StatementCandidate]:
         params, end_token = self._fetch_parameters(tok, params_end=('NEWLINE', '{'))
-        macro = self.__macro_db.get(start.value.upper(), params)
+        candidate = None
+        if self.__statement_cache is not None and end_token.kind == 'NEWLINE' and self.__section_stack:
+            key = (start.key, tuple(tuple((t.kind, t.key) for t in param) for param in params))
+            cached = self.__statement_cache.get(key)
+            if cached is not None:
+                section = self.__section_stack[-1]
+                data, data_cycles = cached
+                if data_cycles:
+                    section.cycles += [(len(section.data) + offset, cycles, taken) for offset, cycles, taken in data_cycles]
+                section.data += data
+                return None
+            if key not in self.__uncachable_statements:
+                candidate = _StatementCandidate(key, len(tok), self.__section_stack[-1], self.__state_changes, tok.concatenations, len(self.__section_stack), len(self.__block_macro_stack))
+        if self.macro_stats.enabled:
+            start_time = time.perf_counter()
+        with self.profiler.measure("macro", "lookup"):
+            macro = self.__macro_db.get(start.key, params)
         if not macro:
             raise AssemblerException(start, f"Syntax error: {start.value} {params_to_string(params)}")
         macro, macro_args = macro
-        prepend = []
-        for token in macro.contents:
-            if token.kind == 'ID' and token.value in macro_args:
-                prepend += macro_args[token.value]
-            else:
-                prepend.append(token)
+        cycles = macro.cycles
+        if cycles is not None and self.__section_stack:
+            section = self.__section_stack[-1]
+            section.cycles.append((len(section.data), cycles[0], cycles[1]))
+        if self.__fast_instructions and end_token.kind == 'NEWLINE' and self.__section_stack:
+            plan = macro.get_emit_plan()
+            if plan and self._emit_plan(plan, macro_args):
+                if self.macro_stats.enabled:
+                    self.macro_stats.record(macro, 0, self.macro_stats.depth(tok), time.perf_counter() - start_time, self.__macro_db.candidates_tried(start.key, macro))
+                return candidate
+        prepend = macro.expand(macro_args)
         if macro.linked:
             prepend.append(macro.linked[0])
             for linked_param in macro.linked[1]:
@@ -577,21 +1060,76 @@ class Assembler:
         elif end_token.isA('{'):
             self.__block_macro_stack.append((macro, macro_args))
         elif macro.post_contents:
-            for token in macro.post_contents:
-                if token.kind == 'ID' and token.value in macro_args:
-                    prepend += macro_args[token.value]
-                else:
-                    prepend.append(token)
+            prepend += macro.expand_post(macro_args)
+        if self.macro_stats.enabled:
+            self.macro_stats.record(macro, len(prepend), self.macro_stats.depth(tok), time.perf_counter() - start_time, self.__macro_db.candidates_tried(start.key, macro))
         tok.prepend(prepend)
+        return candidate
+
+    def _finish_statement_candidate(self, candidate: _StatementCandidate, tok: Tokenizer) -> None:
+        section = candidate.section
+        # The expansion needs to end exactly at the token that was just popped, and can only have added bytes to the same section.
+        # Values that still need linking are only allowed if they can be calculated without any labels.
+        cachable = (len(tok) == candidate.remaining - 1
+            and candidate.state_changes == self.__state_changes
+            and candidate.concatenations == tok.concatenations
+            and len(self.__section_stack) == candidate.section_depth
+            and self.__section_stack[-1] is section
+            and len(self.__block_macro_stack) == candidate.block_depth
+            and len(section.asserts) == candidate.assert_count)
+        if cachable:
+            data = section.data[candidate.data_start:]
+            link_count = len(section.link) - candidate.link_count
+            for offset, (link_size, expr) in itertools.islice(reversed(section.link.items()), link_count):
+                if not _is_label_free(expr):
+                    cachable = False
+                    break
+                value = self._resolve_expr(None, _copy_expr(expr))
+                if not value.is_number():
+                    cachable = False
+                    break
+                value = value.token.value
+                if (link_size == 1 and not -128 <= value <= 255) or (link_size == 2 and not 0 <= value <= 0xFFFF):
+                    cachable = False
+                    break
+                data[offset - candidate.data_start:offset - candidate.data_start + link_size] = (value & ((1 << (8 * link_size)) - 1)).to_bytes(link_size, "little")
+        if cachable:
+            cycles = tuple((offset - candidate.data_start, cycles, taken) for offset, cycles, taken in section.cycles[candidate.cycle_count:])
+            self.__statement_cache[candidate.key] = (bytes(data), cycles)
+        else:
+            self.__uncachable_statements.add(candidate.key)
+
+    def _emit_plan(self, plan: Tuple, args: Dict[str, List[Token]]) -> bool:
+        # Function macros in the arguments are expanded by the db/dw statement, so these need the normal path.
+        for arg in args.values():
+            for token in arg:
+                if token.kind == 'FUNC' and builtin.get(token.key) is None:
+                    return False
+        section = self.__section_stack[-1]
+        for entry in plan:
+            if isinstance(entry, bytes):
+                section.data += entry
+            else:
+                size, template = entry
+                node = self._process_expression(Macro.apply_template(template, args))
+                if size == 1:
+                    section.add8(node)
+                else:
+                    section.add16(node)
+        return True
 
     def _add_macro(self, tok: Tokenizer) -> None:
         name = tok.expect('ID')
         params = self._fetch_parameters(tok, params_end='{')
-        content = self._get_raw_macro_block(name, tok)
-        macro = self.__macro_db.add(name.value.upper(), params, content)
+        content = tok.pop_raw_block()
+        if content is None:
+            content = self._get_raw_macro_block(name, tok)
+        macro = self.__macro_db.add(name.key, params, content)
         if macro is None:
             raise AssemblerException(name, "Duplicate macro")
-        if tok.peek().isA('ID', 'end'):
+        macro.token = name
+        self._clear_statement_cache()
+        if tok.peek().isA('ID', 'END'):
             tok.pop()
             tok.expect('{')
             content = self._get_raw_macro_block(name, tok)
@@ -601,7 +1139,7 @@ class Assembler:
             tok.expect('{')
             content = self._get_raw_macro_block(chain_name, tok)
             chain = macro.add_chain(chain_name.value, content)
-            if tok.peek().isA('ID', 'end'):
+            if tok.peek().isA('ID', 'END'):
                 tok.pop()
                 tok.expect('{')
                 content = self._get_raw_macro_block(name, tok)
@@ -614,6 +1152,9 @@ class Assembler:
             macro.linked = (linked_macro, linked_params)
 
     def _get_raw_macro_block(self, name: Token, tok: Tokenizer) -> List[Token]:
+        content = tok.pop_block()
+        if content is not None:
+            return block_contents(content)
         content = []
         bracket = 0
         while token := tok.pop_raw():
@@ -627,9 +1168,11 @@ class Assembler:
             content.append(token)
         if token is None:
             raise AssemblerException(name, "Unterminated macro definition")
-        if not content[-1].isA('NEWLINE'):
-            content.append(Token('NEWLINE', '', 0, ''))
-        return content
+        return block_contents(content)
+
+    def _skip_raw_macro_block(self, name: Token, tok: Tokenizer) -> None:
+        if not tok.skip_block():
+            self._get_raw_macro_block(name, tok)
 
     def _add_function(self, tok: Tokenizer) -> None:
         name = tok.expect('ID')
@@ -643,8 +1186,17 @@ class Assembler:
             content.append(token)
         if token is None:
             raise AssemblerException(name, "Unterminated function definition")
-        if self.__func_db.add(name.value.upper(), params, content) is None:
+        func = self.__func_db.add(name.key, params, content)
+        if func is None:
             raise AssemblerException(name, "Duplicate fmacro")
+        func.token = name
+        self._clear_statement_cache()
+
+    def _clear_statement_cache(self) -> None:
+        # A new macro can be a better match for statements that are already cached.
+        if self.__statement_cache:
+            self.__statement_cache.clear()
+        self.__uncachable_statements.clear()
 
     def _fetch_parameters(self, tok: Tokenizer, *, params_end: Union[str, Tuple[str, str]]='NEWLINE') -> Union[List[List[Token]], Tuple[List[List[Token]], Token]]:
         params = []
@@ -665,18 +1217,19 @@ class Assembler:
                     raise AssemblerException(t, "Unexpected end of file")
                 break
             if t.kind == 'FUNC':
-                func = builtin.get(t.value.upper())
+                func = builtin.get(t.key)
                 if not func:
                     fparams = self._fetch_parameters(tok, params_end=')')
-                    func = self.__func_db.get(t.value.upper(), fparams)
+                    if self.macro_stats.enabled:
+                        start_time = time.perf_counter()
+                        param_length = len(param)
+                    func = self.__func_db.get(t.key, fparams)
                     if func is None:
                         raise AssemblerException(t, f"Function not found: [{t.value}] with params: {', '.join(tokens_to_string(p) for p in fparams)}")
                     func, func_args = func
-                    for token in func.contents:
-                        if token.kind == 'ID' and token.value in func_args:
-                            param += func_args[token.value]
-                        else:
-                            param.append(token)
+                    param += func.expand(func_args)
+                    if self.macro_stats.enabled:
+                        self.macro_stats.record(func, len(param) - param_length, self.macro_stats.depth(tok, push=False), time.perf_counter() - start_time, self.__func_db.candidates_tried(t.key, func))
                     continue
                 brackets += 1
             elif t.kind == '(' or t.kind == '[' or t.kind == '{':
@@ -696,7 +1249,8 @@ class Assembler:
             return params, end_token
         return params
 
-    def _bracket_param(self, tokens: List[Token], arg_count: Optional[int] = None):
+    def _bracket_param(self, tokens: List[Token], arg_count: Optional[int] = None, *, raw: bool = False):
+        """Split `KEY[a, b]` into the KEY token and the parameters, as expressions or, with raw, as token lists."""
         if tokens[0].kind != 'ID':
             raise AssemblerException(tokens[0], "Syntax error")
         if len(tokens) < 2:
@@ -713,6 +1267,8 @@ class Assembler:
         if arg_count is not None:
             if len(params) != arg_count:
                 raise AssemblerException(tokens[0], "Wrong number of parameters")
+        if raw:
+            return tokens[0], tuple(params)
         params = tuple(self._process_expression(param) for param in params)
         return tokens[0], params
 
@@ -730,10 +1286,12 @@ class Assembler:
                     if t.isA(')') and brackets == 0:
                         if arg:
                             args.append(arg)
-                        func = builtin.get(start.value.upper())
+                        func = builtin.get(start.key)
                         if func is None:
                             raise RuntimeError("_fetch_parameters allowed a non-builting through?")
                         if func.function_type == "macro":
+                            # These can look at constants, like DEFINED()
+                            self.__state_changes += 1
                             contents = func(self, args)
                             tokens = tokens[:start_idx] + contents + tokens[end_idx + 1:]
                             next_start_idx = start_idx + len(contents)
@@ -754,23 +1312,33 @@ class Assembler:
                     raise AssemblerException(start, f"Function not closed: {start.value}")
                 start_idx = next_start_idx
             elif start.kind == 'ID' and start.value in self.__constants:
+                self.__state_changes += 1
                 value = self.__constants[start.value]
                 tokens[start_idx] = Token('STRING' if isinstance(value, str) else 'NUMBER', value, start.line_nr, start.filename)
                 start_idx += 1
             else:
                 start_idx += 1
-        return parse_expression(tokens, self.__anonymous_label_count)
+        with self.profiler.measure("expression", "parse"):
+            return parse_expression(tokens, self.__labels.anonymous_count)
 
     def _resolve_expr(self, offset: Optional[int], expr: AstNode) -> Optional[AstNode]:
         if expr is None:
             return None
         if expr.kind == 'value' and expr.token.isA('ID'):
-            if expr.token.value not in self.__labels:
+            address = self.__labels.address(expr.token.value)
+            if address is None:
                 return expr
-            section, section_offset = self.__labels[expr.token.value]
-            if section.base_address < 0:
+            expr.token = Token('NUMBER', address, expr.token.line_nr, expr.token.filename)
+        elif expr.kind == 'value' and expr.token.isA('ALABEL'):
+            address = self.__labels.anonymous_address(expr.token.value)
+            if address is None:
                 return expr
-            expr.token = Token('NUMBER', section.base_address + section_offset, expr.token.line_nr, expr.token.filename)
+            expr.token = Token('NUMBER', address, expr.token.line_nr, expr.token.filename)
+        elif expr.kind == 'native':
+            value = expr.evaluate(self, offset)
+            if value is None:
+                return expr
+            return AstNode('value', Token('NUMBER', value, expr.token.line_nr, expr.token.filename), None, None)
         elif expr.kind == 'value' and expr.token.isA('CURADDR'):
             if offset is None:
                 return expr
@@ -795,55 +1363,17 @@ class Assembler:
             expr.left = self._resolve_expr(offset, expr.left)
             expr.right = self._resolve_expr(offset, expr.right)
             if expr.left and expr.left.is_number() and (expr.right is None or expr.right.is_number()):
-                if expr.kind == '+':
-                    if expr.right:
-                        expr.token = Token('NUMBER', expr.left.token.value + expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                    else:
-                        expr.token = Token('NUMBER', expr.left.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '-':
-                    if expr.right:
-                        expr.token = Token('NUMBER', expr.left.token.value - expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                    else:
-                        expr.token = Token('NUMBER', -expr.left.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '*':
-                    expr.token = Token('NUMBER', expr.left.token.value * expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '/':
-                    expr.token = Token('NUMBER', expr.left.token.value // expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '%':
-                    expr.token = Token('NUMBER', expr.left.token.value % expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '&':
-                    expr.token = Token('NUMBER', expr.left.token.value & expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '|':
-                    expr.token = Token('NUMBER', expr.left.token.value | expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '^':
-                    expr.token = Token('NUMBER', expr.left.token.value ^ expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '>>':
-                    expr.token = Token('NUMBER', expr.left.token.value >> expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '<<':
-                    expr.token = Token('NUMBER', expr.left.token.value << expr.right.token.value, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '>':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value > expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '<':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value < expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '>=':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value >= expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '<=':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value <= expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '==':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value == expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '!=':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value != expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '&&':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value and expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '||':
-                    expr.token = Token('NUMBER', 1 if expr.left.token.value or expr.right.token.value else 0, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '!' and not expr.right:
-                    expr.token = Token('NUMBER', 0 if expr.left.token.value else 1, expr.left.token.line_nr, expr.left.token.filename)
-                elif expr.kind == '~' and not expr.right:
-                    # TODO, this clamps to 8 bit.
-                    expr.token = Token('NUMBER', (~expr.left.token.value) & 0xFF, expr.left.token.line_nr, expr.left.token.filename)
+                if expr.right is None:
+                    unary = _UNARY_OPERATORS.get(expr.kind)
+                    if unary is None:
+                        return expr
+                    value = unary(expr.left.token.value)
                 else:
-                    return expr
+                    binary = _BINARY_OPERATORS.get(expr.kind)
+                    if binary is None:
+                        return expr
+                    value = binary(expr.left.token.value, expr.right.token.value)
+                expr.token = Token('NUMBER', value, expr.left.token.line_nr, expr.left.token.filename)
                 expr.kind = 'value'
                 expr.left = None
                 expr.right = None
@@ -873,24 +1403,53 @@ class Assembler:
             raise AssemblerException(result.token, "Expected a constant expression")
         return result.token.value
 
-    def _add_rgbds_object(self, filename: str) -> None:
+    def _add_objects(self, kind: str, filenames: List[str]) -> None:
+        with self.profiler.measure("import", kind):
+            if not isinstance(self.__files, DiskFileProvider):
+                # Files that are not on disk are parsed here, and are not stored in the object cache.
+                object_files = [self._read_object_file(kind, filename) for filename in filenames]
+            elif len(filenames) == 1:
+                object_files = [load_object_file(kind, filenames[0], self.__object_cache_path)]
+            else:
+                # Parse in parallel, but merge in the given order so labels and errors are deterministic.
+                # Workers are not forked from this process, as it can be running other builds in threads (build_variants).
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(filenames), os.cpu_count() or 1), mp_context=multiprocessing.get_context(start_method)) as executor:
+                    object_files = list(executor.map(load_object_file, [kind] * len(filenames), filenames, [self.__object_cache_path] * len(filenames)))
+            for object_file in object_files:
+                if kind == "rgbds":
+                    self._merge_rgbds_object(object_file)
+                else:
+                    self._merge_sdcc_object(object_file)
+
+    def _read_object_file(self, kind: str, filename: str):
+        if kind == "rgbds":
+            import rgbds
+            return rgbds.ObjectFile(filename, self.__files.read_bytes(filename))
+        import sdcc
+        list_filename = f"{os.path.splitext(filename)[0]}.lst"
+        list_data = self.__files.read_bytes(list_filename) if self.__files.exists(list_filename) else None
+        return sdcc.ObjectFile(filename, self.__files.read_bytes(filename), list_data)
+
+    def _merge_rgbds_object(self, object_file) -> None:
         import rgbds
-        object_file = rgbds.ObjectFile(filename)
         sections = []
         for section in object_file.sections:
             layout = self.__layouts.get(section.get_layout_name())
             for s in self.__sections:
                 if s.name == section.name:
                     raise AssemblerException(section.get_name_token(), "Duplicate section name")
-            s = Section(layout, section.get_name_token(), section.address, section.bank if layout.banked else None)
+            s = Section(layout, section.get_name_token(), section.address, section.bank if layout.banked and section.bank != -1 else None)
+            s.alignment = section.alignment
+            s.align_offset = section.align_offset
             if section.data:
                 s.data = bytearray(section.data)
             else:
                 s.data = bytearray(section.size)
             for patch in section.patches:
-                s.link[patch.offset] = (patch.get_link_type(), patch.get_ast())
+                s.link[patch.offset] = (patch.get_link_type(), rgbds.RpnExpression(patch))
                 if patch.patch_type == 3:  # jr target
-                    s.asserts.append((patch.offset, patch.get_assert_ast(), "JR out of range"))
+                    s.asserts.append((patch.offset, rgbds.RpnExpression(patch, jr_check=True), "JR out of range"))
             self.__sections.append(s)
             sections.append(s)
         for symbol in object_file.symbols:
@@ -899,13 +1458,11 @@ class Assembler:
             if symbol.section_id != -1:
                 if symbol.label in self.__labels:
                     raise AssemblerException(symbol.get_label_token(), "Duplicate label")
-                self.__labels[symbol.label] = (sections[symbol.section_id], symbol.value)
+                self.__labels.add(symbol.label, sections[symbol.section_id], symbol.value)
             # else:
             #     self.__constants[symbol.label] = symbol.value
 
-    def _add_sdcc_object(self, filename: str) -> None:
-        import sdcc
-        object_file = sdcc.ObjectFile(filename)
+    def _merge_sdcc_object(self, object_file) -> None:
         for area in object_file.areas:
             if area.size == 0:
                 continue
@@ -915,54 +1472,223 @@ class Assembler:
                     raise AssemblerException(area.get_name_token(), "Duplicate section name")
             s = Section(layout, area.get_name_token(), area.address, area.get_bank() if layout.banked else None)
             s.data = area.data
-            self.__labels[f"__area_start_{area.name}"] = (s, 0)
+            self.__labels.add(f"__area_start_{area.name}", s, 0)
             for symbol in area.symbols:
                 assert symbol.is_label
-                self.__labels[symbol.name] = (s, symbol.offset)
+                if symbol.name in self.__labels:
+                    raise AssemblerException(symbol.get_label_token(), "Duplicate label")
+                self.__labels.add(symbol.name, s, symbol.offset)
             for patch in area.patches:
-                s.link[patch.offset] = (patch.get_link_type(), patch.get_ast())
+                s.link[patch.offset] = (patch.get_link_type(), patch.get_expression())
             self.__sections.append(s)
 
             for offset, label in area.get_debug_labels():
-                self.__labels[label] = (s, offset)
+                self.__labels.add(label, s, offset)
+
+def load_object_file(kind: str, filename: str, cache_path: Optional[str] = None):
+    """Parse a RGBDS or SDCC object file. Module level so it can run in a worker process."""
+    if cache_path is not None:
+        import objectcache
+        return objectcache.ObjectCache(cache_path).load(kind, filename, load_object_file)
+    if kind == "rgbds":
+        import rgbds
+        return rgbds.ObjectFile(filename)
+    import sdcc
+    return sdcc.ObjectFile(filename)
+
+
+def _new_assembler(include_paths: List[str], object_cache: Optional[str], defines: Dict[str, Union[int, str]], prelude: List[str], options: Dict[str, Any]) -> Assembler:
+    a = Assembler(**options)
+    for path in include_paths:
+        a.add_include_path(path)
+    a.set_object_cache(object_cache)
+    for name, value in defines.items():
+        a.set_constant(name, value)
+    for filename in prelude:
+        a.process_file(filename)
+    return a
+
+
+def _finish_build(a: Assembler, filename: str, pad_value: Optional[int]) -> Assembler:
+    a.process_file(filename)
+    a.link()
+    a.build_rom(pad_value=pad_value)
+    return a
+
+
+def build_roms(filenames: List[str], *, include_paths: List[str] = (), object_cache: Optional[str] = None, defines: Optional[Dict[str, Union[int, str]]] = None, prelude: List[str] = (),
+               pad_value: Optional[int] = None, max_workers: Optional[int] = None, **options) -> List[Assembler]:
+    """Build independent ROMs in a thread pool, one Assembler per input file, all created with the given options.
+    Because of the GIL the builds do not run faster than one after the other, but the prelude is only processed once.
+    Returns the assemblers in the order of the input files, with the ROM built (see get_rom()).
+    The prelude files are processed once, every build continues from a clone of that state.
+    If builds fail, the AssemblerException of the first failing input is raised once all builds are done."""
+    base = _new_assembler(include_paths, object_cache, defines or {}, prelude, options)
+
+    def build(filename: str) -> Assembler:
+        return _finish_build(base.clone(), filename, pad_value)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(build, filename) for filename in filenames]
+            return [future.result() for future in futures]
+    finally:
+        # Memory tracing was started by the first assembler, the clones share it.
+        base.memory_report.stop()
+
+
+def build_variants(filename: str, variants: Dict[str, Dict[str, Union[int, str]]], *, include_paths: List[str] = (), object_cache: Optional[str] = None, defines: Optional[Dict[str, Union[int, str]]] = None,
+                   prelude: List[str] = (), pad_value: Optional[int] = None, max_workers: Optional[int] = None, **options) -> Dict[str, Assembler]:
+    """Build one ROM per variant from the same input, where each variant defines its own constants.
+    The prelude files are processed only once, with only the shared defines, and every variant continues from a clone of that state.
+    So the prelude cannot depend on the constants of the variants, an AssemblerException is raised if it uses one of them.
+    Variants are built in a thread pool. The assembler is pure Python, so because of the GIL this mostly saves
+    processing the prelude again, and not the time of the builds themselves."""
+    base = _new_assembler(include_paths, object_cache, defines or {}, [], options)
+
+    def build(constants: Dict[str, Union[int, str]]) -> Assembler:
+        a = base.clone()
+        for name, value in constants.items():
+            a.set_constant(name, value)
+        return _finish_build(a, filename, pad_value)
+
+    try:
+        reads = base.record_constant_reads()
+        for prelude_filename in prelude:
+            base.process_file(prelude_filename)
+        base.stop_recording_constant_reads()
+        used = sorted({name for constants in variants.values() for name in constants if name in reads})
+        if used:
+            raise AssemblerException(None, f"The prelude uses {', '.join(used)}, which is defined per variant. Move the code that uses it out of the prelude")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {name: executor.submit(build, constants) for name, constants in variants.items()}
+            return {name: future.result() for name, future in futures.items()}
+    finally:
+        base.memory_report.stop()
+
+
+def _parse_define(define: str) -> Tuple[str, Union[int, str]]:
+    name, _, value = define.partition("=")
+    if not value:
+        return name, 1
+    try:
+        return name, int(value, 0)
+    except ValueError:
+        return name, value
+
+
+def _print_exception(e: AssemblerException) -> None:
+    print(f"Error: {e.message}")
+    if e.token:
+        print(f" at: {e.token.filename}:{e.token.line_nr}")
+        if os.path.isfile(e.token.filename):
+            lines = open(e.token.filename).readlines()
+            print("-----")
+            for n in range(max(0, e.token.line_nr - 3), min(len(lines), e.token.line_nr + 2)):
+                print(f"{'>' if n == e.token.line_nr - 1 else ' '}  {lines[n].rstrip()}")
+            print("-----")
+
 
 def main():
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("input")
+    parser.add_argument("input", nargs="+", help="Source file, or multiple source files to build independent ROMs from in parallel")
     parser.add_argument("--output")
     parser.add_argument("--symbols")
     parser.add_argument("--include-path", "-I", action='append')
     parser.add_argument("--pad", "-p", default=None, type=lambda n: int(n, 0))
     parser.add_argument("--dump", action="store_true")
+    parser.add_argument("--object-cache", help="Directory to cache parsed RGBDS/SDCC object files in")
+    parser.add_argument("--profile", action="store_true", help="Print the time spend in each build phase")
+    parser.add_argument("--profile-json", help="Write the time spend in each build phase to a JSON file")
+    parser.add_argument("--macro-stats", action="store_true", help="Print per macro expansion statistics")
+    parser.add_argument("--macro-stats-json", help="Write per macro expansion statistics to a JSON file")
+    parser.add_argument("--fast-instructions", action="store_true", help="Emit instruction macros directly instead of expanding them")
+    parser.add_argument("--statement-cache", action="store_true", help="Reuse the bytes of statements that always produce the same constant bytes")
+    parser.add_argument("--line-memo", action="store_true", help="Tokenize repeated source lines only once")
+    parser.add_argument("--lazy-macros", action="store_true", help="Only tokenize macro bodies when a macro is used")
+    parser.add_argument("--memory-report", action="store_true", help="Print memory use of the assembler data structures after each build phase")
+    parser.add_argument("--cycle-report", action="store_true", help="Print the routines that take the most cycles")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of ROMs to build at the same time when multiple inputs or variants are given")
+    parser.add_argument("--define", "-D", action='append', help="Define a constant before processing the input, as NAME=value or NAME (which sets it to 1)")
+    parser.add_argument("--prelude", action='append', help="File to process before the input. With --variants it is only processed once for all variants")
+    parser.add_argument("--variants", help="JSON file with the constants of each variant to build, as {\"name\": {\"CONSTANT\": value}}")
 
     args = parser.parse_args()
 
+    defines = dict(_parse_define(define) for define in args.define or [])
+    options = dict(lazy_macros=args.lazy_macros, fast_instructions=args.fast_instructions, statement_cache=args.statement_cache, line_memo=args.line_memo)
+    if len(args.input) > 1 or args.variants:
+        _main_multiple(args, defines, options)
+        return
     try:
-        a = Assembler()
-        if args.include_path:
-            for path in args.include_path:
-                a.add_include_path(path)
-        a.process_file(args.input)
-        a.link(print_free_space=True)
+        a = _new_assembler(args.include_path or [], args.object_cache, defines, args.prelude or [],
+                           dict(options, profile=args.profile or args.profile_json is not None, macro_stats=args.macro_stats or args.macro_stats_json is not None, memory_report=args.memory_report))
+        try:
+            a.process_file(args.input[0])
+            a.link(print_free_space=True)
+            rom = a.build_rom(pad_value=args.pad) if args.output else None
+        finally:
+            a.memory_report.stop()
     except AssemblerException as e:
-        print(f"Error: {e.message}")
-        if e.token:
-            print(f" at: {e.token.filename}:{e.token.line_nr}")
-            if os.path.isfile(e.token.filename):
-                lines = open(e.token.filename).readlines()
-                print("-----")
-                for n in range(max(0, e.token.line_nr - 3), min(len(lines), e.token.line_nr + 2)):
-                    print(f"{'>' if n == e.token.line_nr - 1 else ' '}  {lines[n].rstrip()}")
-                print("-----")
+        _print_exception(e)
         exit(1)
     else:
         if args.output:
-            open(args.output, "wb").write(a.build_rom(pad_value=args.pad))
+            with a.profiler.measure("output", "rom"):
+                open(args.output, "wb").write(rom)
         if args.symbols:
             a.save_symbols(args.symbols)
         if args.dump:
             a.dump()
+        if args.profile:
+            print(a.profiler.report())
+        if args.profile_json:
+            import json
+            with open(args.profile_json, "wt") as f:
+                json.dump(a.profiler.to_json(), f, indent=2)
+        if args.macro_stats:
+            print(a.macro_stats.report())
+        if args.macro_stats_json:
+            import json
+            with open(args.macro_stats_json, "wt") as f:
+                json.dump(a.macro_stats.to_json(), f, indent=2)
+        if args.memory_report:
+            print(a.memory_report.report())
+        if args.cycle_report:
+            print(a.cycle_report())
+
+
+def _main_multiple(args, defines: Dict[str, Union[int, str]], options: Dict[str, Any]) -> None:
+    # With multiple inputs or variants, --output and --symbols are directories, files are named after the input or variant.
+    for option in ("dump", "profile", "profile_json", "macro_stats", "macro_stats_json", "memory_report", "cycle_report"):
+        if getattr(args, option):
+            print(f"Error: --{option.replace('_', '-')} can only be used with a single build")
+            exit(1)
+    if args.variants and len(args.input) > 1:
+        print("Error: --variants can only be used with a single input")
+        exit(1)
+    try:
+        if args.variants:
+            import json
+            with open(args.variants, "rt") as f:
+                variants = json.load(f)
+            assemblers = build_variants(args.input[0], variants, include_paths=args.include_path or [], object_cache=args.object_cache, defines=defines, prelude=args.prelude or [],
+                                        pad_value=args.pad, max_workers=args.jobs, **options)
+        else:
+            assemblers = build_roms(args.input, include_paths=args.include_path or [], object_cache=args.object_cache, defines=defines, prelude=args.prelude or [],
+                                    pad_value=args.pad, max_workers=args.jobs, **options)
+            assemblers = {os.path.splitext(os.path.basename(filename))[0]: a for filename, a in zip(args.input, assemblers)}
+    except AssemblerException as e:
+        _print_exception(e)
+        exit(1)
+    for name, a in assemblers.items():
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            open(os.path.join(args.output, f"{name}.gb"), "wb").write(a.get_rom())
+        if args.symbols:
+            os.makedirs(args.symbols, exist_ok=True)
+            a.save_symbols(os.path.join(args.symbols, f"{name}.sym"))
 
 
 if __name__ == "__main__":
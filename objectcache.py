@@ -0,0 +1,53 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Any, Callable, List
+
+
+# Increase this when the parsed object classes change, so old cache entries are ignored.
+CACHE_VERSION = 2
+
+
+class ObjectCache:
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_key(self, kind: str, filenames: List[str]) -> str:
+        h = hashlib.sha256(f"{kind}:{CACHE_VERSION}".encode())
+        for filename in filenames:
+            if os.path.exists(filename):
+                with open(filename, "rb") as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+            else:
+                h.update(b'-')
+        return h.hexdigest()
+
+    def load(self, kind: str, filename: str, loader: Callable[[str, str], Any]) -> Any:
+        filenames = [filename]
+        if kind == "sdcc":
+            filenames.append(f"{os.path.splitext(filename)[0]}.lst")
+        cache_filename = os.path.join(self.path, f"{self.get_key(kind, filenames)}.pickle")
+        try:
+            with open(cache_filename, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # A corrupt or outdated entry is removed and the object file is parsed again.
+            try:
+                os.unlink(cache_filename)
+            except OSError:
+                pass
+        result = loader(kind, filename)
+        os.makedirs(self.path, exist_ok=True)
+        # Write to a temporary file first, so parallel builds never see a partial cache entry.
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, cache_filename)
+        except OSError:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+        return result
@@ -0,0 +1,216 @@
+import contextlib
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import types
+import weakref
+from typing import Dict, Tuple, List, Any, Optional
+
+
+_NULL_MEASUREMENT = contextlib.nullcontext()
+
+
+class _Measurement:
+    __slots__ = ("profiler", "category", "name", "start")
+
+    def __init__(self, profiler: "Profiler", category: str, name: str):
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.add(self.category, self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """Collects the time spend per category (build phase) and name (file, directive, ...).
+    Times are inclusive, so an #INCLUDE directive contains the time of everything in the included file."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.__totals: Dict[Tuple[str, str], List[float]] = {}
+
+    def measure(self, category: str, name: str = ""):
+        if not self.enabled:
+            return _NULL_MEASUREMENT
+        return _Measurement(self, category, name)
+
+    def add(self, category: str, name: str, elapsed: float) -> None:
+        entry = self.__totals.get((category, name))
+        if entry is None:
+            self.__totals[(category, name)] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def to_json(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result = {}
+        for (category, name), (calls, total) in self.__totals.items():
+            result.setdefault(category, {})[name] = {"calls": calls, "total": total}
+        return result
+
+    def report(self) -> str:
+        lines = ["Profile:", f"  {'category':12} {'name':40} {'calls':>8} {'total ms':>10} {'mean us':>10}"]
+        for category in sorted({category for category, _ in self.__totals}):
+            entries = [(name, calls, total) for (c, name), (calls, total) in self.__totals.items() if c == category]
+            entries.sort(key=lambda entry: entry[2], reverse=True)
+            for name, calls, total in entries:
+                if len(name) > 40:
+                    name = "..." + name[-37:]
+                lines.append(f"  {category:12} {name:40} {calls:8} {total * 1000:10.2f} {total / calls * 1000000:10.1f}")
+        return "\n".join(lines)
+
+
+def _macro_name(macro) -> str:
+    params = ", ".join("".join(f'"{t.value}"' if t.kind == 'STRING' else str(t.value) for t in param) for param in macro.params)
+    return f"{macro.name} {params}".strip()
+
+
+class _MacroEntry:
+    __slots__ = ("name", "invocations", "tokens", "max_depth", "candidates", "time")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.invocations = 0
+        self.tokens = 0
+        self.max_depth = 0
+        self.candidates = 0
+        self.time = 0.0
+
+
+class MacroStats:
+    """Per macro expansion statistics: how often a macro is used, how many tokens it produces,
+    how deep it is nested in other macros and how many overloads are tried before it matches.
+    Time is the time spend on looking up and expanding the macro itself, not processing the result."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.__entries: Dict[int, _MacroEntry] = {}
+        self.__stacks: "weakref.WeakKeyDictionary[Any, List[int]]" = weakref.WeakKeyDictionary()
+
+    def depth(self, tok, *, push: bool = True) -> int:
+        """Nesting depth of an expansion that is about to be added in front of the tokenizer.
+        An expansion is active as long as the tokenizer still contains at least as many tokens as when it was added.
+        FMACRO expansions are not added to the tokenizer, so these do not push a new level."""
+        stack = self.__stacks.get(tok)
+        if stack is None:
+            stack = self.__stacks[tok] = []
+        remaining = len(tok)
+        while stack and remaining < stack[-1]:
+            stack.pop()
+        if not push:
+            return len(stack) + 1
+        stack.append(remaining)
+        return len(stack)
+
+    def record(self, macro, tokens: int, depth: int, elapsed: float, candidates: int = 0, *, invocation: bool = True) -> None:
+        entry = self.__entries.get(id(macro))
+        if entry is None:
+            entry = self.__entries[id(macro)] = _MacroEntry(_macro_name(macro))
+        if invocation:
+            entry.invocations += 1
+        entry.tokens += tokens
+        entry.max_depth = max(entry.max_depth, depth)
+        entry.candidates += candidates
+        entry.time += elapsed
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [{
+            "macro": entry.name,
+            "invocations": entry.invocations,
+            "tokens": entry.tokens,
+            "max_depth": entry.max_depth,
+            "candidates": entry.candidates,
+            "time": entry.time,
+        } for entry in sorted(self.__entries.values(), key=lambda entry: entry.time, reverse=True)]
+
+    def report(self, limit: Optional[int] = None) -> str:
+        lines = ["Macro statistics:", f"  {'macro':40} {'calls':>8} {'tokens':>9} {'tok/call':>9} {'depth':>6} {'tried':>8} {'total ms':>10}"]
+        for entry in self.to_json()[:limit]:
+            name = entry["macro"]
+            if len(name) > 40:
+                name = name[:37] + "..."
+            per_call = entry["tokens"] / entry["invocations"] if entry["invocations"] else 0
+            lines.append(f"  {name:40} {entry['invocations']:8} {entry['tokens']:9} {per_call:9.1f} {entry['max_depth']:6} {entry['candidates']:8} {entry['time'] * 1000:10.2f}")
+        return "\n".join(lines)
+
+
+# Shared with the rest of the process, so not followed when looking for the objects of one assembler.
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+
+def _reachable(root: Any) -> List[Any]:
+    seen = {id(root)}
+    result = [root]
+    todo = [root]
+    while todo:
+        for obj in gc.get_referents(todo.pop()):
+            if id(obj) not in seen and not isinstance(obj, _SHARED_TYPES):
+                seen.add(id(obj))
+                result.append(obj)
+                todo.append(obj)
+    return result
+
+
+class MemoryReport:
+    """Tracks memory use at the phase boundaries of a build (after processing, linking and building).
+    Per phase it counts the objects of the main assembler data structures that are reachable from the assembler,
+    and their shallow size, the size of its caches, and the traced memory of the process per source file that allocated it.
+    Tracing is started when the report is enabled, and stopped by stop() if it was started here."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.__phases: List[Dict[str, Any]] = []
+        self.__type_names: Dict[type, Optional[str]] = {}
+        self.__started_tracing = False
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+
+    def snapshot(self, phase: str, root: Any, types: Dict[str, type], counts: Dict[str, int], caches: Dict[str, Tuple[int, Optional[int]]]) -> None:
+        """caches: the number of entries and the maximum number of entries (None when unbounded) per cache."""
+        gc.collect()
+        objects = {name: {"count": 0, "size": 0} for name in types}
+        for obj in _reachable(root):
+            obj_type = type(obj)
+            name = self.__type_names.get(obj_type, "")
+            if name == "":
+                name = self.__type_names[obj_type] = next((name for name, t in types.items() if issubclass(obj_type, t)), None)
+            if name is not None:
+                objects[name]["count"] += 1
+                objects[name]["size"] += sys.getsizeof(obj)
+        current, peak = tracemalloc.get_traced_memory()
+        files = {}
+        if tracemalloc.is_tracing():
+            tracemalloc_snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+            for stat in tracemalloc_snapshot.statistics("filename")[:8]:
+                files[os.path.basename(stat.traceback[0].filename)] = stat.size
+        self.__phases.append({"phase": phase, "current": current, "peak": peak, "objects": objects, "counts": dict(counts),
+                              "caches": {name: {"entries": entries, "limit": limit} for name, (entries, limit) in caches.items()}, "files": files})
+
+    def stop(self) -> None:
+        """Stop tracing memory allocations after the last snapshot, so later builds in the same process are not slowed down."""
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return self.__phases
+
+    def report(self) -> str:
+        lines = ["Memory report:"]
+        for phase in self.__phases:
+            lines.append(f"  {phase['phase']}: {phase['current'] / 1024 / 1024:.1f} MB traced, {phase['peak'] / 1024 / 1024:.1f} MB peak")
+            for name, entry in phase["objects"].items():
+                lines.append(f"    {name:20} {entry['count']:10} objects {entry['size'] / 1024:10.1f} KB (shallow)")
+            for name, count in phase["counts"].items():
+                lines.append(f"    {name:20} {count:10}")
+            for name, cache in phase["caches"].items():
+                limit = f"limit {cache['limit']}" if cache["limit"] is not None else "no limit"
+                lines.append(f"    {name:20} {cache['entries']:10} entries ({limit})")
+            for filename, size in phase["files"].items():
+                lines.append(f"    allocated in {filename:40} {size / 1024:10.1f} KB")
+        return "\n".join(lines)
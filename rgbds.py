@@ -1,8 +1,23 @@
+import mmap
 import struct
-from typing import List
+from typing import List, Optional, Dict, Tuple, Callable, Union
 
 from tokenizer import Token
-from expression import AstNode
+from expression import NativeExpression
+from exception import AssemblerException
+
+
+def layout_name_for_type(section_type: int) -> str:
+    match section_type:
+        case 0: return "WRAM0"
+        case 1: return "VRAM"
+        case 2: return "ROMX"
+        case 3: return "ROM0"
+        case 4: return "HRAM"
+        case 5: return "WRAMX"
+        case 6: return "SRAM"
+        case 7: return "OAM"
+    raise NotImplementedError(f"Section type: {section_type:02x}")
 
 
 class Node:
@@ -34,6 +49,7 @@ class Symbol:
 class Section:
     def __init__(self, obj_file):
         self.obj_file = obj_file
+        self.index = -1
         self.name = ""
         self.line_no = -1
         self.size = 0
@@ -43,25 +59,62 @@ class Section:
         self.alignment = 0
         self.align_offset = 0
         self.node = None
-        self.data = None
-        self.patches = []
+        self.data: Optional[bytes] = None
+        self.patches: List["Patch"] = []
 
     def get_layout_name(self) -> str:
-        match self.type:
-            case 0: return "WRAM0"
-            case 1: return "VRAM"
-            case 2: return "ROMX"
-            case 3: return "ROM0"
-            case 4: return "HRAM"
-            case 5: return "WRAMX"
-            case 6: return "SRAM"
-            case 7: return "OAM"
-        raise NotImplementedError(f"Section type: {self.type:02x}")
+        return layout_name_for_type(self.type)
 
     def get_name_token(self) -> Token:
         return Token('STRING', self.name, self.line_no, self.node.name)
 
 
+def _div(a: int, b: int) -> int:
+    if b == 0:
+        raise ZeroDivisionError()
+    return a // b
+
+
+def _mod(a: int, b: int) -> int:
+    if b == 0:
+        raise ZeroDivisionError()
+    return a % b
+
+
+RPN_BINARY: Dict[int, Tuple[str, Callable[[int, int], int]]] = {
+    0x00: ("+", lambda a, b: a + b),
+    0x01: ("-", lambda a, b: a - b),
+    0x02: ("*", lambda a, b: a * b),
+    0x03: ("/", _div),
+    0x04: ("%", _mod),
+    0x06: ("**", lambda a, b: a ** b if b >= 0 else 0),
+    0x10: ("|", lambda a, b: a | b),
+    0x11: ("&", lambda a, b: a & b),
+    0x12: ("^", lambda a, b: a ^ b),
+    0x21: ("&&", lambda a, b: 1 if a and b else 0),
+    0x22: ("||", lambda a, b: 1 if a or b else 0),
+    0x30: ("==", lambda a, b: 1 if a == b else 0),
+    0x31: ("!=", lambda a, b: 1 if a != b else 0),
+    0x32: (">", lambda a, b: 1 if a > b else 0),
+    0x33: ("<", lambda a, b: 1 if a < b else 0),
+    0x34: (">=", lambda a, b: 1 if a >= b else 0),
+    0x35: ("<=", lambda a, b: 1 if a <= b else 0),
+    0x40: ("<<", lambda a, b: a << b),
+    0x41: (">>", lambda a, b: a >> b),
+    0x42: (">>>", lambda a, b: (a & 0xFFFFFFFF) >> b),
+}
+RPN_UNARY: Dict[int, Tuple[str, Callable[[int], int]]] = {
+    0x05: ("-", lambda a: -a),
+    0x13: ("~", lambda a: ~a),
+    0x23: ("!", lambda a: 0 if a else 1),
+    0x70: ("HIGH", lambda a: (a >> 8) & 0xFF),
+    0x71: ("LOW", lambda a: a & 0xFF),
+    0x72: ("BITWIDTH", lambda a: (a & 0xFFFFFFFF).bit_length()),
+    0x73: ("TZCOUNT", lambda a: ((a & -a) & 0xFFFFFFFF).bit_length() - 1 if a & 0xFFFFFFFF else 32),
+}
+PC_SYMBOL_ID = 0xFFFFFFFF
+
+
 class Patch:
     def __init__(self, obj_file):
         self.obj_file = obj_file
@@ -72,126 +125,238 @@ class Patch:
         self.pc_offset = -1
         self.patch_type = -1
         self.rpn = b''
+        self.__program = None
+        self.__fast_path = None
 
     def get_link_type(self) -> int:
         match self.patch_type:
             case 0: return 1
             case 1: return 2
             case 3: return 1  # JR patch
-        raise NotImplementedError("Patch type: {self.patch_type:02x}")
+        raise NotImplementedError(f"Patch type: {self.patch_type:02x}")
+
+    def get_token(self) -> Token:
+        return Token("OP", "RPN", self.line_no, self.node.name)
 
-    def get_ast(self) -> AstNode:
-        stack: List[AstNode] = []
+    def get_program(self) -> List[Tuple[int, Union[int, str, None]]]:
+        """Decode the RPN buffer once into a list of (opcode, operand) pairs."""
+        if self.__program is not None:
+            return self.__program
+        program = []
+        rpn = self.rpn
         idx = 0
-        while idx < len(self.rpn):
-            match self.rpn[idx]:
-                case 0x00:  # +
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("+", Token("OP", "+", self.line_no, self.node.name), left, right))
-                case 0x01:  # -
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("-", Token("OP", "-", self.line_no, self.node.name), left, right))
-                case 0x02:  # *
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("*", Token("OP", "*", self.line_no, self.node.name), left, right))
-                case 0x03:  # /
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("/", Token("OP", "/", self.line_no, self.node.name), left, right))
-                case 0x10:  # |
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("|", Token("OP", "|", self.line_no, self.node.name), left, right))
-                case 0x11:  # &
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("&", Token("OP", "&", self.line_no, self.node.name), left, right))
-                case 0x12:  # ^
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("^", Token("OP", "^", self.line_no, self.node.name), left, right))
-                case 0x12:  # ~
-                    left = stack.pop()
-                    stack.append(AstNode("~", Token("OP", "~", self.line_no, self.node.name), left, None))
-                case 0x30:  # ==
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("==", Token("OP", "==", self.line_no, self.node.name), left, right))
-                case 0x31:  # ==
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("!=", Token("OP", "!=", self.line_no, self.node.name), left, right))
-                case 0x32:  # <
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode("<", Token("OP", "<", self.line_no, self.node.name), left, right))
-                case 0x33:  # >
-                    right = stack.pop()
-                    left = stack.pop()
-                    stack.append(AstNode(">", Token("OP", ">", self.line_no, self.node.name), left, right))
-                case 0x50:  # Bank
-                    symbol = self.obj_file.symbols[struct.unpack("<I", self.rpn[idx + 1:idx + 5])[0]]
-                    symbol_node = AstNode("value", Token("ID", symbol.label, self.line_no, self.node.name), None, None)
-                    call_node = AstNode("call", Token("ID", "BANK", self.line_no, self.node.name), None, AstNode('param', symbol_node.token, symbol_node, None))
-                    stack.append(call_node)
-                    idx += 4
-                case 0x70:  # HIGH
-                    left = stack.pop()
-                    stack.append(AstNode(">>", Token("OP", ">>", self.line_no, self.node.name), left, AstNode("value", Token("NUMBER", 8, self.line_no, self.node.name), None, None)))
-                case 0x71:  # LOW
-                    left = stack.pop()
-                    stack.append(AstNode("&", Token("OP", "&", self.line_no, self.node.name), left, AstNode("value", Token("NUMBER", 0xFF, self.line_no, self.node.name), None, None)))
-                case 0x80:  # Value
-                    value = struct.unpack("<I", self.rpn[idx+1:idx+5])[0]
-                    stack.append(AstNode("value", Token("NUMBER", value, self.line_no, self.node.name), None, None))
-                    idx += 4
-                case 0x81:  # Symbol
-                    symbol = self.obj_file.symbols[struct.unpack("<I", self.rpn[idx+1:idx+5])[0]]
-                    if symbol.section_id == -1 and symbol.type != 1:  # just a constant
-                        stack.append(AstNode("value", Token("NUMBER", symbol.value, self.line_no, self.node.name), None, None))
-                    else:
-                        stack.append(AstNode("value", Token("ID", symbol.label, self.line_no, self.node.name), None, None))
-                    idx += 4
-                case _:
-                    raise NotImplementedError(f"RPN: {self.rpn[idx]:02x} {stack}")
+        while idx < len(rpn):
+            opcode = rpn[idx]
             idx += 1
+            operand = None
+            if opcode == 0x80:
+                operand = struct.unpack_from("<i", rpn, idx)[0]
+                idx += 4
+            elif opcode == 0x81 or opcode == 0x50:
+                operand = struct.unpack_from("<I", rpn, idx)[0]
+                idx += 4
+            elif opcode in (0x51, 0x53, 0x54):
+                end = rpn.index(b'\x00', idx)
+                operand = rpn[idx:end].decode()
+                idx = end + 1
+            elif opcode == 0x55 or opcode == 0x56:
+                operand = rpn[idx]
+                idx += 1
+            elif opcode not in RPN_BINARY and opcode not in RPN_UNARY and opcode not in (0x52, 0x60, 0x61):
+                raise NotImplementedError(f"RPN: {opcode:02x}")
+            program.append((opcode, operand))
+        self.__program = program
+        return program
+
+    def evaluate(self, assembler, offset: Optional[int]) -> Optional[int]:
+        """Run the RPN program against the assembler's labels. Offset is the address of the patched byte.
+        Returns None if a symbol cannot be resolved yet."""
+        if self.__fast_path is None:
+            program = self.get_program()
+            self.__fast_path = False
+            if len(program) == 1 and program[0][0] == 0x81:
+                self.__fast_path = (program[0][1], 0)
+            elif len(program) == 3 and program[0][0] == 0x81 and program[1][0] == 0x80 and program[2][0] in (0x00, 0x01):
+                self.__fast_path = (program[0][1], program[1][1] if program[2][0] == 0x00 else -program[1][1])
+        if self.__fast_path:
+            symbol_id, addend = self.__fast_path
+            value = self.__symbol_value(assembler, symbol_id, offset)
+            if value is None:
+                return None
+            value += addend
+        else:
+            value = self.__run(assembler, offset)
+            if value is None:
+                return None
+        if self.patch_type == 3:  # jr patch, relative to the end of the instruction
+            if offset is None:
+                return None
+            value -= offset + 1
+        return value
+
+    def __run(self, assembler, offset: Optional[int]) -> Optional[int]:
+        stack: List[int] = []
+        for opcode, operand in self.get_program():
+            if opcode in RPN_BINARY:
+                right = stack.pop()
+                try:
+                    stack[-1] = RPN_BINARY[opcode][1](stack[-1], right)
+                except ZeroDivisionError:
+                    raise AssemblerException(self.get_token(), "Division by zero")
+            elif opcode in RPN_UNARY:
+                stack[-1] = RPN_UNARY[opcode][1](stack[-1])
+            elif opcode == 0x80:
+                stack.append(operand)
+            elif opcode == 0x81:
+                value = self.__symbol_value(assembler, operand, offset)
+                if value is None:
+                    return None
+                stack.append(value)
+            elif opcode == 0x50:  # BANK(symbol)
+                section, _ = assembler.get_label(self.obj_file.symbols[operand].label)
+                if section is None or section.base_address < 0:
+                    return None
+                stack.append(section.bank if section.bank is not None else 0)
+            elif opcode == 0x51 or opcode == 0x52:  # BANK(section), BANK(@)
+                section = assembler.get_section(operand if opcode == 0x51 else self.obj_file.sections[self.pc_section].name)
+                if section is None or section.base_address < 0:
+                    return None
+                stack.append(section.bank if section.bank is not None else 0)
+            elif opcode == 0x53 or opcode == 0x54:  # SIZEOF(section), STARTOF(section)
+                section = assembler.get_section(operand)
+                if section is None:
+                    return None
+                if opcode == 0x53:
+                    stack.append(len(section.data))
+                elif section.base_address < 0:
+                    return None
+                else:
+                    stack.append(section.base_address)
+            elif opcode == 0x55 or opcode == 0x56:  # SIZEOF(type), STARTOF(type)
+                layout = assembler.get_layout(layout_name_for_type(operand))
+                if layout is None:
+                    return None
+                stack.append(layout.end_addr - layout.start_addr if opcode == 0x55 else layout.start_addr)
+            elif opcode == 0x60:  # HRAM check
+                if not 0xFF00 <= stack[-1] <= 0xFFFF:
+                    raise AssemblerException(self.get_token(), f"Address ${stack[-1]:04x} is not in HRAM range")
+                stack[-1] &= 0xFF
+            elif opcode == 0x61:  # RST check
+                if stack[-1] & ~0x38:
+                    raise AssemblerException(self.get_token(), f"Value ${stack[-1]:02x} is not a RST vector")
+                stack[-1] |= 0xC7
         assert len(stack) == 1
-        if self.patch_type == 3:  # jr patch
-            stack[0] = AstNode("-", Token("OP", "-", self.line_no, self.node.name), stack[0], AstNode("value", Token("CURADDR", "@", self.line_no, self.node.name), None, None))
-            stack[0] = AstNode("-", Token("OP", "-", self.line_no, self.node.name), stack[0], AstNode("value", Token("NUMBER", 1, self.line_no, self.node.name), None, None))
         return stack[0]
 
-    def get_assert_ast(self):
-        node = self.get_ast()
-        left = AstNode("<", Token("OP", "<", self.line_no, self.node.name), node, AstNode("value", Token("NUMBER", 128, self.line_no, self.node.name), None, None))
-        right = AstNode(">", Token("OP", ">", self.line_no, self.node.name), node, AstNode("value", Token("NUMBER", -129, self.line_no, self.node.name), None, None))
-        return AstNode("&&", Token("OP", "&&", self.line_no, self.node.name), left, right)
+    def __symbol_value(self, assembler, symbol_id: int, offset: Optional[int]) -> Optional[int]:
+        if symbol_id == PC_SYMBOL_ID:
+            if offset is None:
+                return None
+            return offset - self.offset + self.pc_offset
+        symbol = self.obj_file.symbols[symbol_id]
+        if symbol.section_id == -1 and symbol.type != 1:  # just a constant
+            return symbol.value
+        address = assembler.get_label_address(symbol.label)
+        if address is None:
+            constant = assembler.get_constant(symbol.label)
+            if isinstance(constant, int):
+                return constant
+        return address
+
+    def __repr__(self) -> str:
+        stack: List[str] = []
+        for opcode, operand in self.get_program():
+            if opcode in RPN_BINARY:
+                right = stack.pop()
+                stack[-1] = f"({stack[-1]} {RPN_BINARY[opcode][0]} {right})"
+            elif opcode in RPN_UNARY:
+                stack[-1] = f"{RPN_UNARY[opcode][0]}({stack[-1]})"
+            elif opcode == 0x80:
+                stack.append(str(operand))
+            elif opcode == 0x81:
+                stack.append("@" if operand == PC_SYMBOL_ID else self.obj_file.symbols[operand].label)
+            elif opcode == 0x50:
+                stack.append(f"BANK({self.obj_file.symbols[operand].label})")
+            elif opcode == 0x51:
+                stack.append(f'BANK("{operand}")')
+            elif opcode == 0x52:
+                stack.append("BANK(@)")
+            elif opcode == 0x53 or opcode == 0x54:
+                stack.append(f'{"SIZEOF" if opcode == 0x53 else "STARTOF"}("{operand}")')
+            elif opcode == 0x55 or opcode == 0x56:
+                stack.append(f'{"SIZEOF" if opcode == 0x55 else "STARTOF"}({layout_name_for_type(operand)})')
+            elif opcode == 0x60 or opcode == 0x61:
+                stack[-1] = f'{"HRAM" if opcode == 0x60 else "RST"}({stack[-1]})'
+        return " ".join(stack)
+
+
+class RpnExpression(NativeExpression):
+    def __init__(self, patch: Patch, *, jr_check: bool = False):
+        super().__init__()
+        self.patch = patch
+        self.jr_check = jr_check
+
+    @property
+    def token(self) -> Token:
+        return self.patch.get_token()
+
+    def evaluate(self, assembler, offset: Optional[int]) -> Optional[int]:
+        value = self.patch.evaluate(assembler, offset)
+        if value is None or not self.jr_check:
+            return value
+        return 1 if -129 < value < 128 else 0
+
+    def __repr__(self) -> str:
+        if self.jr_check:
+            return f"JR_OFFSET({self.patch!r})"
+        return repr(self.patch)
+
+
+NODE_HEADER = struct.Struct("<iIB")
+REPT_NODE = struct.Struct("<II")
+SYMBOL_RECORD = struct.Struct("<iiii")
+SECTION_RECORD = struct.Struct("<iiiBiiBi")
+PATCH_RECORD = struct.Struct("<iiiiiBi")
+COUNT = struct.Struct("<I")
 
 
 class ObjectFile:
-    def __init__(self, filename: str):
-        f = open(filename, "rb")
-        def readstring() -> str:
-            res = b''
-            while (c := f.read(1)) != b'\x00':
-                res += c
-            return res.decode()
-        assert f.read(4) == b'RGB9'
-        revision, symbol_count, section_count, node_count = struct.unpack("<IIII", f.read(16))
-        assert revision == 13
+    def __init__(self, filename: str, data: Optional[bytes] = None):
+        """Read the object file from disk, or from data if given."""
+        if data is not None:
+            self.__buffer = data
+            self.__read(filename)
+            return
+        with open(filename, "rb") as f:
+            try:
+                self.__buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # mmap does not support empty files
+                self.__buffer = b''
+            try:
+                self.__read(filename)
+            finally:
+                if isinstance(self.__buffer, mmap.mmap):
+                    self.__buffer.close()
+                # Everything is copied out of the buffer, so the object can be pickled.
+                self.__buffer = None
+
+    def __read(self, filename: str) -> None:
+        if self.__buffer[0:4] != b'RGB9':
+            raise ValueError(f"{filename} is not a RGBDS object file")
+        revision, symbol_count, section_count, node_count = struct.unpack_from("<IIII", self.__buffer, 4)
+        if revision != 13:
+            raise ValueError(f"{filename} has RGBDS object revision {revision}, only revision 13 is supported")
+        self.__pos = 20
         self.nodes = [None] * node_count
         self.symbols = []
         self.sections = []
         for idx in range(node_count):
             node = Node(self)
-            node.parent_id, node.parent_line_nr, node.type = struct.unpack("<iIB", f.read(9))
+            node.parent_id, node.parent_line_nr, node.type = self.__unpack(NODE_HEADER)
             if (node.type & 0x7F) == 0:
-                node.depth, node.iter_depth = struct.unpack("<II", f.read(8))
+                node.depth, node.iter_depth = self.__unpack(REPT_NODE)
             else:
-                node.name = readstring()
+                node.name = self.__readstring()
             self.nodes[node_count - 1 - idx] = node
         for node in self.nodes:
             if node.parent_id != -1:
@@ -199,32 +364,48 @@ class ObjectFile:
 
         for idx in range(symbol_count):
             symbol = Symbol(self)
-            symbol.label = readstring()
-            symbol.type = f.read(1)[0]
+            symbol.label = self.__readstring()
+            symbol.type = self.__buffer[self.__pos]
+            self.__pos += 1
             if symbol.type != 1:
-                node_id, symbol.line_no, symbol.section_id, symbol.value = struct.unpack("<iiii", f.read(16))
+                node_id, symbol.line_no, symbol.section_id, symbol.value = self.__unpack(SYMBOL_RECORD)
                 symbol.node = self.nodes[node_id]
             self.symbols.append(symbol)
 
         for idx in range(section_count):
             section = Section(self)
-            section.name = readstring()
-            node_id, section.line_no, section.size, section.type, section.address, section.bank, section.alignment, section.align_offset = struct.unpack("<iiiBiiBi", f.read(26))
-            assert section.alignment == 0, "Section alignment not supported"
+            section.index = idx
+            section.name = self.__readstring()
+            node_id, section.line_no, section.size, section.type, section.address, section.bank, section.alignment, section.align_offset = self.__unpack(SECTION_RECORD)
             section.node = self.nodes[node_id]
             if section.type in {2, 3}:
-                section.data = f.read(section.size)
-                patch_count = struct.unpack("<I", f.read(4))[0]
+                section.data = self.__buffer[self.__pos:self.__pos + section.size]
+                self.__pos += section.size
+                patch_count = self.__unpack(COUNT)[0]
                 for patch_idx in range(patch_count):
-                    patch = Patch(self)
-                    node_id, patch.line_no, patch.offset, patch.pc_section, patch.pc_offset, patch.patch_type, rpn_size = struct.unpack("<iiiiiBi", f.read(25))
-                    assert patch.pc_section == idx, "LOAD blocks not supported"
-                    patch.node = self.nodes[node_id]
-                    patch.rpn = f.read(rpn_size)
-                    section.patches.append(patch)
+                    section.patches.append(self.__read_patch(idx))
             self.sections.append(section)
+        # The assertions at the end of the file are not used.
+
+    def __unpack(self, record: struct.Struct) -> tuple:
+        result = record.unpack_from(self.__buffer, self.__pos)
+        self.__pos += record.size
+        return result
+
+    def __readstring(self) -> str:
+        end = self.__buffer.find(b'\x00', self.__pos)
+        if end < 0:
+            raise ValueError("Unterminated string in RGBDS object")
+        result = self.__buffer[self.__pos:end].decode()
+        self.__pos = end + 1
+        return result
 
-        assert_count = struct.unpack("<I", f.read(4))[0]
-        for idx in range(assert_count):
-            node_id, line_no, offset, pc_section, pc_offset, assert_type, rpn_size = struct.unpack("<IIIIIBI", f.read(25))
-            rpn = f.read(rpn_size)
+    def __read_patch(self, section_idx: int) -> "Patch":
+        patch = Patch(self)
+        node_id, patch.line_no, patch.offset, patch.pc_section, patch.pc_offset, patch.patch_type, rpn_size = self.__unpack(PATCH_RECORD)
+        if patch.pc_section != section_idx:
+            raise NotImplementedError("LOAD blocks not supported")
+        patch.node = self.nodes[node_id]
+        patch.rpn = self.__buffer[self.__pos:self.__pos + rpn_size]
+        self.__pos += rpn_size
+        return patch
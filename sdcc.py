@@ -1,10 +1,11 @@
 import os
-import binascii
+import io
+import bisect
 import re
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict
 
 from tokenizer import Token
-from expression import AstNode
+from expression import NativeExpression
 
 
 class Patch:
@@ -18,26 +19,64 @@ class Patch:
 
     def get_link_type(self):
         return self.size
-    
-    def get_ast(self) -> AstNode:
-        token_filename, line_no = self.area.get_filename_line_for(self.offset)
+
+    def get_expression(self) -> "PatchExpression":
+        return PatchExpression(self)
+
+    def get_target(self) -> Tuple[str, bool]:
+        """Returns the label this patch refers to, and if it refers to the bank of that label."""
         if isinstance(self.target, Area):
-            node = AstNode("value", Token("ID", f"__area_start_{self.target.name}", line_no, token_filename), None, None)
-        elif self.target.name.startswith("b_"):
-            node = AstNode("value", Token("ID", self.target.name[1:], line_no, token_filename), None, None)
-            node = AstNode("call", Token("ID", "BANK", 1, token_filename), None, AstNode('param', node.token, node, None))
-        elif self.target.name.startswith("___bank_"):
-            node = AstNode("value", Token("ID", self.target.name[8:], line_no, token_filename), None, None)
-            node = AstNode("call", Token("ID", "BANK", 1, token_filename), None, AstNode('param', node.token, node, None))
+            return f"__area_start_{self.target.name}", False
+        if self.target.name.startswith("b_"):
+            return self.target.name[1:], True
+        if self.target.name.startswith("___bank_"):
+            return self.target.name[8:], True
+        return self.target.name, False
+
+
+class PatchExpression(NativeExpression):
+    def __init__(self, patch: Patch):
+        super().__init__()
+        self.patch = patch
+        self.__token = None
+
+    @property
+    def token(self) -> Token:
+        # Looking up the source file and line is only done when needed for an error message.
+        if self.__token is None:
+            token_filename, line_no = self.patch.area.get_filename_line_for(self.patch.offset)
+            self.__token = Token("ID", self.patch.get_target()[0], line_no, token_filename)
+        return self.__token
+
+    def evaluate(self, assembler, offset: Optional[int]) -> Optional[int]:
+        label, is_bank = self.patch.get_target()
+        if is_bank:
+            section, _ = assembler.get_label(label)
+            if section is None or section.base_address < 0:
+                return None
+            value = section.bank if section.bank is not None else 0
         else:
-            node = AstNode("value", Token("ID", self.target.name, line_no, token_filename), None, None)
-        if self.target_offset:
-            node = AstNode("+", Token("OP", "+", line_no, token_filename), node, AstNode("value", Token("NUMBER", self.target_offset, line_no, token_filename), None, None))
-        if self.shift:
-            node = AstNode(">>", Token("OP", ">>", line_no, token_filename), node, AstNode("value", Token("NUMBER", self.shift, line_no, token_filename), None, None))
-        if self.size == 1:
-            node = AstNode("&", Token("OP", "&", line_no, token_filename), node, AstNode("value", Token("NUMBER", 0xFF, line_no, token_filename), None, None))
-        return node
+            value = assembler.get_label_address(label)
+            if value is None:
+                return None
+        value += self.patch.target_offset
+        if self.patch.shift:
+            value >>= self.patch.shift
+        if self.patch.size == 1:
+            value &= 0xFF
+        return value
+
+    def __repr__(self) -> str:
+        label, is_bank = self.patch.get_target()
+        result = f"BANK({label})" if is_bank else label
+        if self.patch.target_offset:
+            result = f"({result} + {self.patch.target_offset})"
+        if self.patch.shift:
+            result = f"({result} >> {self.patch.shift})"
+        if self.patch.size == 1:
+            result = f"({result} & 255)"
+        return result
+
 
 class Area:
     def __init__(self, object_file, type_name: str, name: str, size: int, flags: int, address: int):
@@ -50,12 +89,22 @@ class Area:
         self.symbols = []
         self.data = bytearray(size)
         self.patches = []
-    
+        self.__symbol_offsets: List[int] = []
+        self.__symbol_index: List[Symbol] = []
+
+    def build_index(self) -> None:
+        self.__symbol_offsets = []
+        self.__symbol_index = []
+        for sym in sorted(self.symbols, key=lambda sym: sym.offset):
+            # For symbols at the same offset the first one defined is used.
+            if self.__symbol_offsets and self.__symbol_offsets[-1] == sym.offset:
+                continue
+            self.__symbol_offsets.append(sym.offset)
+            self.__symbol_index.append(sym)
+
     def get_filename_line_for(self, offset: int):
-        previous_sym = None
-        for sym in self.symbols:
-            if sym.offset <= offset and (previous_sym is None or previous_sym.offset < sym.offset):
-                previous_sym = sym
+        idx = bisect.bisect_right(self.__symbol_offsets, offset) - 1
+        previous_sym = self.__symbol_index[idx] if idx >= 0 else None
         if not previous_sym:
             return f"{self.object_file.module_name}.c#?", 0
         filename, line_no = self.object_file.get_filename_line_for(previous_sym.name, offset)
@@ -64,9 +113,10 @@ class Area:
         return filename, line_no
 
     def add_data(self, new_offset, new_data, patches):
-        patches.sort()
+        patches.sort(key=lambda patch: patch[0])
         index = 0
-        patch_index, patch_mode, patch_target = patches.pop(0) if patches else (len(new_data), 0, None)
+        next_patch = 0
+        patch_index, patch_mode, patch_target = patches[0] if patches else (len(new_data), 0, None)
         while index < len(new_data):
             if index < patch_index:
                 self.data[new_offset] = new_data[index]
@@ -90,9 +140,9 @@ class Area:
                         new_offset += 1
                         index += 4
                     case _:
-                        print(patch_index, patch_mode, patch_target, index, binascii.hexlify(new_data[index:]), patches)
-                        raise NotImplementedError(f"SDCC patch mode: {patch_mode:02x} not implemented (start praying)")
-                patch_index, patch_mode, patch_target = patches.pop(0) if patches else (len(new_data), 0, None)
+                        raise NotImplementedError(f"SDCC patch mode: {patch_mode:02x} not implemented (start praying), at offset {patch_index} of area {self.name}, target {patch_target}, data {new_data[index:index + 8].hex()}")
+                next_patch += 1
+                patch_index, patch_mode, patch_target = patches[next_patch] if next_patch < len(patches) else (len(new_data), 0, None)
     
     def get_layout_name(self) -> str:
         if self.type_name == "_CODE":
@@ -129,24 +179,31 @@ class Symbol:
         self.is_label = is_label
         self.area = area
     
+    def get_label_token(self) -> Token:
+        filename, line_no = self.area.get_filename_line_for(self.offset)
+        return Token('ID', self.name, line_no, filename)
+
     def __repr__(self):
         return f"<Symbol: {self.name}>"
 
 
 class ObjectFile:
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, rel_data: Optional[bytes] = None, list_data: Optional[bytes] = None):
+        """Read the .rel file and the .lst file next to it from disk, or from rel_data and list_data if rel_data is given."""
         self.module_name = None
         self.__symbols = []
         self.areas = []
         self.__file_lookup = {}
 
         list_filename = f"{os.path.splitext(filename)[0]}.lst"
-        if os.path.exists(list_filename):
+        if rel_data is None and os.path.exists(list_filename):
+            with open(list_filename, "rb") as f:
+                list_data = f.read()
+        if list_data is not None:
             latest_symbol_info = None
             current_file = None
             current_line = None
-            f = open(list_filename, "rt")
-            for line in f:
+            for line in io.StringIO(list_data.decode(), newline=None):
                 offset = line[4:12].strip()
                 if offset != "" and current_file is not None and latest_symbol_info is not None:
                     offset = int(offset, 16)
@@ -161,8 +218,15 @@ class ObjectFile:
                     current_file, current_line = m.groups()
         else:
             print(f"Warning: failed to read {list_filename} for detailed file/line info")
+        self.__file_index: Dict[str, Tuple[List[int], List[Tuple[int, str, int]]]] = {}
+        for symbol, entries in self.__file_lookup.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.__file_index[symbol] = ([entry[0] for entry in entries], entries)
 
-        f = open(filename, "rt")
+        if rel_data is None:
+            with open(filename, "rb") as f:
+                rel_data = f.read()
+        f = io.StringIO(rel_data.decode(), newline=None)
         header = f.readline().strip()
         assert header.startswith("XL"), "Header line is wrong. Wrong sdcc version used?"
         asize = int(header[2:])
@@ -198,26 +262,26 @@ class ObjectFile:
                     self.areas.append(Area(self, line[1], self.module_name + line[1], int(line[3], 16), int(line[5], 16), int(line[7], 16)))
                 case "T":  # Data
                     assert len(line) >= 5
-                    data = bytes(int(s, 16) for s in line[1:])
+                    data = bytes.fromhex(" ".join(line[1:]))
                     new_offset = data[0] | data[1] << 8 | data[2] << 16 | data[3] << 24
                     new_data = data[4:]
                 case "R":  # Relocation
                     assert len(line) >= 5
-                    data = bytes(int(s, 16) for s in line[1:])
+                    data = bytes.fromhex(" ".join(line[1:]))
                     assert data[0] == 0 and data[1] == 0
                     area_index = data[2] | data[3] << 8
-                    data = data[4:]
                     patches = []
-                    while data:
-                        mode = data[0]
+                    idx = 4
+                    while idx < len(data):
+                        mode = data[idx]
                         if (mode & 0xF0) == 0xF0:
-                            mode = ((mode << 8) & 0xF00) | data[1]
-                            data = data[1:]
-                        offset = data[1]
-                        ref = data[2] | (data[3] << 8)
+                            mode = ((mode << 8) & 0xF00) | data[idx + 1]
+                            idx += 1
+                        offset = data[idx + 1]
+                        ref = data[idx + 2] | (data[idx + 3] << 8)
                         target = self.__symbols[ref] if (mode & 0x02) else self.areas[ref]
                         patches.append((offset - 4, mode, target))
-                        data = data[4:]
+                        idx += 4
                     assert new_data is not None
                     if new_data:
                         self.areas[area_index].add_data(new_offset, new_data, patches)
@@ -228,15 +292,17 @@ class ObjectFile:
                 case _:
                     print(f"Unknown line in sdcc object: {' '.join(line)}")
 
+        for area in self.areas:
+            area.build_index()
+
     def get_filename_line_for(self, symbol: str, offset: int):
-        if symbol not in self.__file_lookup:
+        if symbol not in self.__file_index:
+            return None, None
+        offsets, entries = self.__file_index[symbol]
+        idx = bisect.bisect_right(offsets, offset) - 1
+        if idx < 0:
             return None, None
-        prev_file, prev_line = None, None
-        for o, file, line in self.__file_lookup[symbol]:
-            if o > offset:
-                return prev_file, prev_line
-            prev_file, prev_line = file, line
-        return prev_file, prev_line
+        return entries[idx][1], entries[idx][2]
 
     def get_filename_line_offsets_for(self, symbol: str) -> List[Tuple[int, str, int]]:
         if symbol not in self.__file_lookup:
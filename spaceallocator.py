@@ -3,6 +3,11 @@ from exception import AssemblerException
 from layout import Layout
 
 
+def _aligned(address: int, alignment: int, align_offset: int) -> int:
+    """First address from the given address that is align_offset modulo 2**alignment."""
+    return address + ((align_offset - address) & ((1 << alignment) - 1))
+
+
 class SpaceAllocationInfo:
     def __init__(self, layout: Layout):
         self.__layout = layout
@@ -40,23 +45,33 @@ class SpaceAllocationInfo:
                 return True
         return False
 
-    def allocate(self, length: int, bank: Optional[int] = None) -> Optional[Tuple[Optional[int], int]]:
+    def allocate(self, length: int, bank: Optional[int] = None, *, alignment: int = 0, align_offset: int = 0) -> Optional[Tuple[Optional[int], int]]:
+        """Find space for length bytes, starting at an address that is align_offset modulo 2**alignment.
+        Uses the first free range that fits, or for aligned sections, the range that needs the least padding."""
         if bank is not None:
             while bank >= self.__next_free_bank:
                 self.__new_bank()
+        best = None
         for idx, (b, s, e) in enumerate(self.__available):
             if bank is not None and b != bank:
                 continue
-            if e - s >= length:
-                if e - s > length:
-                    self.__available[idx] = (b, s + length, e)
-                else:
-                    self.__available.pop(idx)
-                return b, s
+            start = _aligned(s, alignment, align_offset)
+            if start + length <= e and (best is None or start - s < best[1]):
+                best = (idx, start - s, start)
+                if start == s:
+                    break
+        if best is not None:
+            idx, _, start = best
+            b, s, e = self.__available[idx]
+            # The padding before an aligned section stays available for other sections.
+            self.__available[idx:idx + 1] = [(b, rs, re) for rs, re in ((s, start), (start + length, e)) if re > rs]
+            return b, start
         if bank is not None or not self.__layout.banked:
             return None
+        if _aligned(self.__layout.start_addr, alignment, align_offset) + length > self.__layout.end_addr:
+            return None  # Does not fit in an empty bank either
         self.__new_bank()
-        return self.allocate(length, bank)
+        return self.allocate(length, bank, alignment=alignment, align_offset=align_offset)
 
     def __new_bank(self):
         if self.__layout.bank_max is not None and self.__next_free_bank == self.__layout.bank_max:
@@ -81,5 +96,5 @@ class SpaceAllocator:
     def allocate_fixed(self, section_type: str, start: int, length: int, *, bank: Optional[int]=None) -> int:
         return self.__data[section_type].allocate_fixed(start, length, bank=bank)
 
-    def allocate(self, section_type: str, length: int, bank=None) -> Optional[Tuple[Optional[int], int]]:
-        return self.__data[section_type].allocate(length, bank=bank)
+    def allocate(self, section_type: str, length: int, bank=None, *, alignment: int = 0, align_offset: int = 0) -> Optional[Tuple[Optional[int], int]]:
+        return self.__data[section_type].allocate(length, bank=bank, alignment=alignment, align_offset=align_offset)
@@ -0,0 +1,105 @@
+import array
+from typing import Dict, List, Optional, Tuple, Iterator, Any
+
+
+class SymbolTable:
+    def __init__(self):
+        self.__slots: Dict[str, int] = {}
+        self.__names: List[str] = []
+        self.__sections: List[Any] = []
+        self.__offsets: List[int] = []
+        self.__anonymous_sections: List[Any] = []
+        self.__anonymous_offsets: List[int] = []
+        self.__per_section: Dict[Any, List[int]] = {}
+        self.__addresses: Optional[array.array] = None
+        self.__anonymous_addresses: Optional[array.array] = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__slots
+
+    def __len__(self) -> int:
+        return len(self.__names) + len(self.__anonymous_offsets)
+
+    @property
+    def anonymous_count(self) -> int:
+        return len(self.__anonymous_offsets)
+
+    def add(self, name: str, section, offset: int) -> int:
+        slot = self.__slots.get(name)
+        if slot is None:
+            slot = len(self.__names)
+            self.__slots[name] = slot
+            self.__names.append(name)
+            self.__sections.append(section)
+            self.__offsets.append(offset)
+        else:
+            self.__per_section[self.__sections[slot]].remove(slot)
+            self.__sections[slot] = section
+            self.__offsets[slot] = offset
+        self.__per_section.setdefault(section, []).append(slot)
+        self.__addresses = None
+        return slot
+
+    def add_anonymous(self, section, offset: int) -> int:
+        self.__anonymous_sections.append(section)
+        self.__anonymous_offsets.append(offset)
+        self.__per_section.setdefault(section, []).append(-len(self.__anonymous_offsets))
+        self.__anonymous_addresses = None
+        return len(self.__anonymous_offsets)
+
+    def get(self, name: str) -> Tuple[Any, Optional[int]]:
+        slot = self.__slots.get(name)
+        if slot is None:
+            return None, None
+        return self.__sections[slot], self.__offsets[slot]
+
+    def get_anonymous(self, index: int) -> Tuple[Any, Optional[int]]:
+        if index < 1 or index > len(self.__anonymous_offsets):
+            return None, None
+        return self.__anonymous_sections[index - 1], self.__anonymous_offsets[index - 1]
+
+    def finalize(self) -> None:
+        # Called once all sections have an address, after this addresses are a single lookup.
+        self.__addresses = array.array('q', [section.base_address + offset for section, offset in zip(self.__sections, self.__offsets)])
+        self.__anonymous_addresses = array.array('q', [section.base_address + offset for section, offset in zip(self.__anonymous_sections, self.__anonymous_offsets)])
+
+    def address(self, name: str) -> Optional[int]:
+        slot = self.__slots.get(name)
+        if slot is None:
+            return None
+        if self.__addresses is not None:
+            return self.__addresses[slot]
+        section = self.__sections[slot]
+        if section.base_address < 0:
+            return None
+        return section.base_address + self.__offsets[slot]
+
+    def anonymous_address(self, index: int) -> Optional[int]:
+        if index < 1 or index > len(self.__anonymous_offsets):
+            return None
+        if self.__anonymous_addresses is not None:
+            return self.__anonymous_addresses[index - 1]
+        section = self.__anonymous_sections[index - 1]
+        if section.base_address < 0:
+            return None
+        return section.base_address + self.__anonymous_offsets[index - 1]
+
+    def __iter__(self) -> Iterator[Tuple[str, Any, int]]:
+        for name, section, offset in zip(self.__names, self.__sections, self.__offsets):
+            yield name, section, offset
+        for index, (section, offset) in enumerate(zip(self.__anonymous_sections, self.__anonymous_offsets)):
+            yield anonymous_name(index + 1), section, offset
+
+    def labels_in(self, section) -> Dict[int, List[str]]:
+        """Names of the labels in a section per offset, in the order they were defined."""
+        result: Dict[int, List[str]] = {}
+        for slot in self.__per_section.get(section, ()):
+            if slot < 0:
+                result.setdefault(self.__anonymous_offsets[-slot - 1], []).append(anonymous_name(-slot))
+            else:
+                result.setdefault(self.__offsets[slot], []).append(self.__names[slot])
+        return result
+
+
+def anonymous_name(index: int) -> str:
+    return f"__anonymous_{index}"
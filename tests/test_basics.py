@@ -50,3 +50,12 @@ class TestAssemblerBasics(unittest.TestCase):
         self.assertEqual(self._simple("db $12, \\\n $34"), b'\x12\x34')
     def test_not(self):
         self.assertEqual(self._simple("#IF !0 { db 1\n }"), b'\x01')
+    def test_label_lookup(self):
+        a = Assembler()
+        a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "TEST", ROM0 { db 1\nlabel: db 2\n:\n }')
+        a.link()
+        section, offset = a.get_label("label")
+        self.assertEqual(section.base_address + offset, 1)
+        section, offset = a.get_anonymous_label(1)
+        self.assertEqual(section.base_address + offset, 2)
+        self.assertEqual(a.get_label("missing"), (None, None))
@@ -51,3 +51,18 @@ class TestAssemblerBuiltin(unittest.TestCase):
     def test_defined(self):
         self.assertEqual(self._simple('#IF DEFINED(x) { db 1\n } ELSE { db 2\n }'), b'\x02')
         self.assertEqual(self._simple('x = 1\n#IF DEFINED(x) { db 1\n } ELSE { db 2\n }'), b'\x01')
+
+    def test_bank_anonymous(self):
+        a = Assembler()
+        a.process_code('''
+        #LAYOUT ROM[$0, $10], AT[0], BANKED[0, 10]
+        #SECTION "TEST1", ROM, BANK[0] {
+            db BANK(:+)
+        }
+        #SECTION "TEST2", ROM, BANK[2] {
+            :
+            db $23
+        }
+        ''')
+        s = a.link()
+        self.assertEqual(s[0].data, b'\x02')
@@ -0,0 +1,79 @@
+import unittest
+from main import Assembler, AssemblerException
+
+
+CODE = """
+#SECTION "TEST", ROM0[0] {
+start:
+    ld a, 10
+.loop:
+    dec a
+    jr nz, .loop
+    call routine
+    ret
+routine:
+    push af
+    ld a, [hl+]
+    bit 3, [hl]
+    #CYCLES 100 * 2
+    db $00, $00
+    pop af
+    reti
+.end:
+}
+"""
+
+
+class TestCycles(unittest.TestCase):
+    def _build(self, code: str, **options) -> Assembler:
+        a = Assembler(**options)
+        a.process_code(f'#INCLUDE "gbz80/all.asm"\n{code}')
+        a.link()
+        return a
+
+    def test_cycles(self):
+        a = self._build(CODE)
+        section = a.get_section("TEST")
+        self.assertEqual(section.cycles[:3], [(0, 8, 8), (2, 4, 4), (3, 8, 12)])
+        self.assertEqual(a.get_cycles(section, 0, len(section.data)), (8 + 4 + 8 + 24 + 16 + 16 + 8 + 12 + 200 + 12 + 16, 8 + 4 + 12 + 24 + 16 + 16 + 8 + 12 + 200 + 12 + 16))
+
+    def test_same_with_options(self):
+        # Repeated statements, so the statement cache is used.
+        code = CODE.replace("routine:", "routine:\n    push af\n    pop af\n    push af\n    pop af")
+        expected = self._build(code).get_section("TEST").cycles
+        for options in ({"fast_instructions": True}, {"statement_cache": True}, {"lazy_macros": True}):
+            self.assertEqual(self._build(code, **options).get_section("TEST").cycles, expected)
+
+    def test_assert(self):
+        self._build(CODE.replace(".end:", '.end:\n#ASSERT CYCLES(routine, .end) <= 16 + 8 + 12 + 200 + 12 + 16, "too slow"'))
+        with self.assertRaises(AssemblerException):
+            self._build(CODE.replace(".end:", '.end:\n#ASSERT CYCLES(routine, .end) < 16 + 8 + 12 + 200 + 12 + 16, "too slow"'))
+        with self.assertRaises(AssemblerException):
+            self._build(CODE.replace(".end:", '.end:\n#ASSERT CYCLES(routine, other) < 1000') + '#SECTION "OTHER", ROM0 {\nother:\n}')
+
+    def test_macro(self):
+        a = self._build('#MACRO wait { #CYCLES 1000\n}\n#SECTION "TEST", ROM0[0] {\nwait\nnop\n}')
+        self.assertEqual(a.get_section("TEST").cycles, [(0, 1000, 1000), (0, 4, 4)])
+
+    def test_report(self):
+        report = self._build(CODE).cycle_report().splitlines()
+        self.assertEqual(report[2].split(), ["routine", "TEST", "264", "264"])
+        self.assertEqual(report[3].split(), ["start", "TEST", "60", "64"])
+
+    def test_report_shared_offset(self):
+        report = self._build(CODE.replace("routine:", "routine:\nalias:")).cycle_report().splitlines()
+        self.assertEqual(report[2].split(), ["routine,", "alias", "TEST", "264", "264"])
+        self.assertEqual(report[3].split(), ["start", "TEST", "60", "64"])
+
+    def test_split(self):
+        a = self._build('EXTRA = 2\n#MACRO one_line { #CYCLES 6, 9 db 1 }\n#MACRO expr { #CYCLES 4 + EXTRA\ndb 2\n}\n#SECTION "TEST", ROM0[0] {\none_line\nexpr\n}')
+        self.assertEqual(a.get_section("TEST").cycles, [(0, 6, 9), (1, 6, 6)])
+        self.assertEqual(a.get_section("TEST").data, b'\x01\x02')
+        macro = a.get_macro_overloads("one_line")[0]
+        self.assertEqual([t.value for t in macro.contents if t.kind != 'NEWLINE'], ["db", 1])
+        self.assertEqual((macro.cycles, [t.value for t in macro.contents if t.kind != 'NEWLINE']), ((6, 9), ["db", 1]))
+
+    def test_directive_with_statement(self):
+        a = self._build('EXTRA = 2\n#SECTION "TEST", ROM0[0] {\n#CYCLES 4 + EXTRA db 1\n#CYCLES (EXTRA), 20 ld a, b\n#CYCLES 3 }')
+        self.assertEqual(a.get_section("TEST").data, b'\x01\x78')
+        self.assertEqual(a.get_section("TEST").cycles, [(0, 6, 6), (1, 2, 20), (1, 4, 4), (2, 3, 3)])
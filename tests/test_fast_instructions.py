@@ -0,0 +1,82 @@
+import os
+import re
+import unittest
+from main import Assembler, AssemblerException
+
+
+CODE = """
+CONSTANT = $12
+#SECTION "TEST", ROM0[0] {
+start:
+    nop
+    ld a, b
+    ld a, CONSTANT
+    ld hl, start
+    ld [label], a
+    ld a, LOW(label)
+    ldh [$FF80], a
+    add a, [hl]
+    bit 3, [hl]
+    set 7, a
+    call label
+    jr start
+    jp nz, label
+    rst $38
+    ld hl, sp + 4
+label:
+    inc hl
+    ret
+}
+"""
+
+# Arguments for the parameters of the instruction macros, valid for every instruction that uses them.
+ARGUMENTS = {"_value": "$18", "_idx": "3", "_offset": "2", "_target": "$FF80"}
+
+
+def instruction_statements():
+    """A statement for each #MACRO in gbz80/instr.asm."""
+    with open(os.path.join(os.path.dirname(__file__), "..", "gbz80", "instr.asm"), "rt") as f:
+        headers = re.findall(r'^#MACRO\s+(.*?)\s*\{', f.read(), re.MULTILINE)
+    statements = []
+    for header in headers:
+        # Relative jumps need a target nearby.
+        arguments = dict(ARGUMENTS, _target="near") if header.startswith(("jr", "_jr")) else ARGUMENTS
+        statements.append(re.sub(r'\b_[a-z_]+\b', lambda m: arguments.get(m.group(), m.group()), header))
+    return statements
+
+
+class TestFastInstructions(unittest.TestCase):
+    def _build(self, code: str, fast: bool) -> bytes:
+        a = Assembler(fast_instructions=fast)
+        a.process_code(f'#INCLUDE "gbz80/all.asm"\n{code}')
+        for section in a.link():
+            if section.name == "TEST":
+                return section.data
+        return b'ERR'
+
+    def test_same_as_macros(self):
+        self.assertEqual(self._build(CODE, True), self._build(CODE, False))
+
+    def test_user_macro(self):
+        code = "#MACRO ld a, CONSTANT { db $FF }\n" + CODE
+        data = self._build(code, True)
+        self.assertEqual(data, self._build(code, False))
+        self.assertEqual(data[2], 0xFF)
+
+    def test_out_of_range(self):
+        with self.assertRaises(AssemblerException):
+            self._build('#SECTION "TEST", ROM0[0] {\nld a, 300\n}', True)
+
+    def test_all_instructions(self):
+        statements = instruction_statements()
+        code = "".join(f'#SECTION "I{n}", ROM0 {{\nnear_{n}:\n{statement.replace("near", f"near_{n}")}\n}}\n' for n, statement in enumerate(statements))
+        results = []
+        for fast in (True, False):
+            a = Assembler(fast_instructions=fast)
+            a.process_code(f'#INCLUDE "gbz80/all.asm"\n{code}')
+            results.append({section.name: (bytes(section.data), section.cycles) for section in a.link()})
+        fast, normal = results
+        for n, statement in enumerate(statements):
+            with self.subTest(statement=statement):
+                self.assertTrue(normal[f"I{n}"][0])
+                self.assertEqual(fast[f"I{n}"], normal[f"I{n}"])
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import unittest
+from main import Assembler, AssemblerException
+from fileprovider import FileProvider, MemoryFileProvider, DiskFileProvider
+from tests.test_rgbds import build_object, rpn_symbol
+
+
+class TestFileProvider(unittest.TestCase):
+    def _build(self, files, fallback=None) -> Assembler:
+        a = Assembler(file_provider=MemoryFileProvider(files, fallback))
+        with contextlib.redirect_stdout(io.StringIO()):
+            a.process_file("game/main.asm")
+        a.link()
+        return a
+
+    def test_include_and_incbin(self):
+        a = self._build({
+            "game/main.asm": '#LAYOUT ROM0[$0000, $4000], AT[0]\r\n#INCLUDE "defs.asm"\r\n#SECTION "TEST", ROM0[0] {\r\ndb VALUE\r\n#INCBIN "data/a.bin"\r\n#INCBIN "data/b.bin"\r\n}\r\n',
+            "game/defs.asm": "VALUE = $12\n",
+            "game/data/b.bin": b'\x03\x04',
+            "game/data/a.bin": b'\x01\x02',
+        })
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x12\x01\x02\x03\x04')
+
+    def test_glob(self):
+        files = MemoryFileProvider({"game/b.o": b'', "game/a.o": b'', "game/a.asm": ""})
+        self.assertEqual(files.glob("game/./*.o"), ["game/a.o", "game/b.o"])
+        self.assertEqual(files.realpath("game/../game/a.asm"), "game/a.asm")
+
+    def test_missing_file(self):
+        with self.assertRaises(AssemblerException):
+            self._build({"game/main.asm": '#INCLUDE "gbz80/all.asm"'})
+
+    def test_fallback(self):
+        a = self._build({"game/main.asm": '#INCLUDE "gbz80/all.asm"\n#SECTION "TEST", ROM0 {\nld a, b\n}'}, DiskFileProvider())
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x78')
+
+    def test_rgbds(self):
+        obj = build_object([("start", 0, 0), ("target", 0, 1)], [
+            ("code", 3, b'\xC3\x00\x00', [(1, 1, rpn_symbol(1))]),
+        ])
+        a = self._build({
+            "game/main.asm": '#LAYOUT ROM0[$0000, $4000], AT[0]\n#INCRGBDS "code.o"',
+            "game/code.o": obj,
+        })
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\xC3\x01\x00')
+
+    def test_abstract(self):
+        class ReadOnly(FileProvider):
+            def exists(self, path: str) -> bool:
+                return False
+
+        with self.assertRaises(TypeError):
+            ReadOnly()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from main import Assembler, AssemblerException
+
+
+class TestIncData(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmpdir.name, "table.csv"), "wt") as f:
+            f.write("x,y,tile\n1,$0203,4\n5,%110,$FF\n")
+        with open(os.path.join(self.tmpdir.name, "table.json"), "wt") as f:
+            f.write("[[1, 515], [5, 6]]")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _simple(self, code: str) -> Assembler:
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code(f'#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "TEST", ROM0[0] {{ {code}\n }}')
+        s = a.link()
+        self.assertEqual(len(s), 1)
+        return a
+
+    def test_row_major(self):
+        a = self._simple('#INCDATA "table.csv", FORMAT[u8, u16le, u8], HEADER')
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x01\x03\x02\x04\x05\x06\x00\xFF')
+
+    def test_column_major(self):
+        a = self._simple('#INCDATA "table.csv", FORMAT[u8, u16be, skip], HEADER, COLUMNMAJOR')
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x01\x05\x02\x03\x00\x06')
+
+    def test_json(self):
+        a = self._simple('#INCDATA "table.json", FORMAT[u8, u16le]')
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x01\x03\x02\x05\x06\x00')
+
+    def test_count(self):
+        a = self._simple('#INCDATA "table.csv", FORMAT[u8, u16le, u8], HEADER, COUNT[rows]\ndb rows')
+        self.assertEqual(a.get_constant("rows"), 2)
+        self.assertEqual(a.get_sections("ROM0")[0].data[-1], 2)
+
+    def test_out_of_range(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._simple('#INCDATA "table.csv", FORMAT[u8, u8, u8], HEADER')
+        self.assertIn("out of range", context.exception.message)
+
+    def test_column_count(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._simple('#INCDATA "table.csv", FORMAT[u8, u8], HEADER')
+        self.assertIn("columns", context.exception.message)
+
+    def test_names_are_not_resolved(self):
+        a = self._simple('u8 = 2\nu16le:\n#INCDATA "table.json", FORMAT[u8, u16le], COUNT[rows]')
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x01\x03\x02\x05\x06\x00')
+        self.assertEqual(a.get_constant("rows"), 2)
+
+    def test_duplicate_count(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._simple('rows = 5\n#INCDATA "table.json", FORMAT[u8, u16le], COUNT[rows]')
+        self.assertEqual(context.exception.message, "Duplicate constant")
+        self.assertEqual(context.exception.token.value, "rows")
+
+    def test_row_number(self):
+        with open(os.path.join(self.tmpdir.name, "bad.csv"), "wt") as f:
+            f.write("a,b\n1,2\n\n3,x\n")
+        with self.assertRaises(AssemblerException) as context:
+            self._simple('#INCDATA "bad.csv", FORMAT[u8, u8], HEADER')
+        self.assertIn("row 4", context.exception.message)
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from main import Assembler, AssemblerException
+
+
+class TestInclude(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self.tmpdir.name, "sub"))
+        with open(os.path.join(self.tmpdir.name, "lib.asm"), "wt") as f:
+            f.write("#MACRO TEST { db 1 }\n")
+        with open(os.path.join(self.tmpdir.name, "sub", "module.asm"), "wt") as f:
+            f.write('#INCLUDE_ONCE "lib.asm"\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _build(self, code: str) -> bytes:
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code(f'#LAYOUT ROM0[$0000, $4000], AT[0]\n{code}\n#SECTION "TEST", ROM0[0] {{\ntest\n}}')
+        return a.link()[0].data
+
+    def test_include_twice(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._build('#INCLUDE "lib.asm"\n#INCLUDE "lib.asm"')
+        self.assertEqual(context.exception.message, "Duplicate macro")
+
+    def test_include_once(self):
+        self.assertEqual(self._build('#INCLUDE_ONCE "lib.asm"\n#INCLUDE_ONCE "sub/../lib.asm"\n#INCLUDE "sub/module.asm"'), b'\x01')
+
+    def test_include_once_after_include(self):
+        self.assertEqual(self._build('#INCLUDE "lib.asm"\n#INCLUDE_ONCE "lib.asm"'), b'\x01')
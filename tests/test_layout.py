@@ -95,3 +95,118 @@ class TestAssemblerLayout(unittest.TestCase):
     }
 """), b'\x01\x03\x02')
 
+    def test_align(self):
+        self.assertEqual(self._build(
+"""
+    #LAYOUT ROM[0,16], AT[0]
+    #SECTION "A", ROM {
+        db 1, 2, 3
+    }
+    #SECTION "TABLE", ROM, ALIGN[3] {
+        db 4, 5
+    }
+    #SECTION "OFFSET", ROM, ALIGN[2, 1] {
+        db 6
+    }
+    #SECTION "B", ROM {
+        db 7, 8
+    }
+"""), b'\x04\x05\x01\x02\x03\x06\x07\x08\x00\x00\x00\x00\x00\x00\x00\x00')
+
+    def test_align_least_padding(self):
+        a = Assembler()
+        a.process_code(
+"""
+    #LAYOUT ROM[0,$300], AT[0]
+    #SECTION "FIXED1", ROM[$0] {
+        ds $80
+    }
+    #SECTION "FIXED2", ROM[$100] {
+        ds $F0
+    }
+    #SECTION "TABLE", ROM, ALIGN[4] {
+        ds $10
+    }
+""")
+        a.link()
+        self.assertEqual(a.get_section("TABLE").base_address, 0x80)
+
+    def test_align_fixed(self):
+        with self.assertRaises(AssemblerException):
+            self._build(
+"""
+    #LAYOUT ROM[0,16], AT[0]
+    #SECTION "TABLE", ROM[3], ALIGN[2] {
+        db 1
+    }
+""")
+        with self.assertRaises(AssemblerException):
+            self._build(
+"""
+    #LAYOUT ROM[0,16], AT[0]
+    #SECTION "TABLE", ROM, ALIGN[2, 4] {
+        db 1
+    }
+""")
+
+    def test_union(self):
+        a = Assembler()
+        a.process_code(
+"""
+    #LAYOUT ROM[0,4], AT[0]
+    #LAYOUT RAM[$10,$20]
+    #SECTION "COMMON", RAM {
+    wCommon:
+        ds 2
+    }
+    #SECTION "TITLE", RAM, UNION["modes"] {
+    wTitleTimer:
+        ds 1
+    }
+    #SECTION "GAME", RAM, UNION["modes"] {
+    wPlayerX:
+        ds 1
+    wPlayerY:
+        ds 4
+    }
+    #SECTION "AFTER", RAM {
+    wAfter:
+        ds 1
+    }
+    #SECTION "CODE", ROM {
+        db wTitleTimer, wPlayerX, wPlayerY, wAfter
+    }
+""")
+        a.link()
+        self.assertEqual(a.build_rom(), b'\x12\x12\x13\x17')
+        self.assertEqual(a.get_section("TITLE").base_address, a.get_section("GAME").base_address)
+
+    def test_union_fixed(self):
+        a = Assembler()
+        a.process_code(
+"""
+    #LAYOUT RAM[$10,$20]
+    #SECTION "A", RAM, UNION["modes"] {
+        ds 2
+    }
+    #SECTION "B", RAM[$14], UNION["modes"] {
+        ds 8
+    }
+    #SECTION "C", RAM {
+        ds 4
+    }
+""")
+        a.link()
+        self.assertEqual([a.get_section(name).base_address for name in "ABC"], [0x14, 0x14, 0x10])
+        with self.assertRaises(AssemblerException):
+            a.process_code('#SECTION "D", RAM[$12], UNION["modes"] {\n}')
+            a.link()
+        with self.assertRaises(AssemblerException):
+            self._build(
+"""
+    #LAYOUT ROM[0,16], AT[0]
+    #SECTION "ROM", ROM, UNION["modes"] {
+        db 1
+    }
+""")
+
@@ -0,0 +1,133 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from lsp import LanguageServer, read_message, write_message, path_to_uri
+
+
+MAIN = """#INCLUDE "gbz80/all.asm"
+#INCLUDE "util.asm"
+GB_HEADER "LSP", GB_MCB_ROM_ONLY, entry
+#SECTION "Entry", ROM0 {
+entry:
+    ld a, DOUBLE(2)
+.loop:
+    clear_a
+    jr .loop
+}
+"""
+
+UTIL = """#FMACRO DOUBLE _a { _a * 2 }
+#MACRO clear_a { xor a, a }
+#MACRO clear_a _count { xor a, a }
+"""
+
+
+class TestLanguageServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.main = os.path.realpath(os.path.join(self.tmpdir.name, "main.asm"))
+        self.util = os.path.realpath(os.path.join(self.tmpdir.name, "util.asm"))
+        with open(self.util, "wt") as f:
+            f.write(UTIL)
+        self.messages = []
+        self.server = LanguageServer(self.messages.append)
+        self._request("initialize", {"capabilities": {}})
+        self._notify("textDocument/didOpen", {"textDocument": {"uri": path_to_uri(self.main), "languageId": "gbhla", "version": 1, "text": MAIN}})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _notify(self, method, params):
+        self.server.handle({"jsonrpc": "2.0", "method": method, "params": params})
+
+    def _request(self, method, params):
+        self.server.handle({"jsonrpc": "2.0", "id": len(self.messages), "method": method, "params": params})
+        return self.messages[-1]["result"]
+
+    def _diagnostics(self):
+        self.server.flush()
+        result = {}
+        for message in self.messages:
+            if message.get("method") == "textDocument/publishDiagnostics":
+                result[message["params"]["uri"]] = message["params"]["diagnostics"]
+        return result
+
+    def _position(self, path, line, character):
+        return {"textDocument": {"uri": path_to_uri(path)}, "position": {"line": line, "character": character}}
+
+    def test_diagnostics(self):
+        self.assertEqual(self._diagnostics(), {})
+        self._notify("textDocument/didChange", {"textDocument": {"uri": path_to_uri(self.main), "version": 2}, "contentChanges": [{"text": MAIN.replace("clear_a", "clear_b")}]})
+        diagnostics = self._diagnostics()[path_to_uri(self.main)]
+        self.assertEqual(len(diagnostics), 1)
+        self.assertEqual(diagnostics[0]["range"]["start"]["line"], 7)
+        self._notify("textDocument/didChange", {"textDocument": {"uri": path_to_uri(self.main), "version": 3}, "contentChanges": [{"text": MAIN}]})
+        self.assertEqual(self._diagnostics()[path_to_uri(self.main)], [])
+
+    def test_diagnostics_in_include(self):
+        self._notify("textDocument/didOpen", {"textDocument": {"uri": path_to_uri(self.util), "languageId": "gbhla", "version": 1, "text": UTIL + "#MACRO clear_a { nop }\n"}})
+        diagnostics = self._diagnostics()
+        self.assertEqual(diagnostics[path_to_uri(self.util)][0]["range"]["start"]["line"], 3)
+        self.assertEqual(diagnostics[path_to_uri(self.util)][0]["message"], "Duplicate macro")
+
+    def test_definition(self):
+        result = self._request("textDocument/definition", self._position(self.main, 8, 9))
+        self.assertEqual(result, [{"uri": path_to_uri(self.main), "range": {"start": {"line": 6, "character": 0}, "end": {"line": 6, "character": 5}}}])
+        result = self._request("textDocument/definition", self._position(self.main, 7, 6))
+        self.assertEqual([(r["uri"], r["range"]["start"]["line"]) for r in result], [(path_to_uri(self.util), 1), (path_to_uri(self.util), 2)])
+        result = self._request("textDocument/definition", self._position(self.main, 5, 12))
+        self.assertEqual([(r["uri"], r["range"]["start"]["line"]) for r in result], [(path_to_uri(self.util), 0)])
+        result = self._request("textDocument/definition", self._position(self.main, 2, 35))
+        self.assertEqual([r["range"]["start"]["line"] for r in result], [4])
+
+    def test_hover(self):
+        result = self._request("textDocument/hover", self._position(self.main, 7, 6))
+        self.assertEqual(result["contents"]["value"], "```gbhla\nclear_a\nclear_a _count\n```")
+        result = self._request("textDocument/hover", self._position(self.main, 5, 12))
+        self.assertEqual(result["contents"]["value"], "```gbhla\nDOUBLE(_a)\n```")
+        result = self._request("textDocument/hover", self._position(self.main, 4, 2))
+        self.assertEqual(result["contents"]["value"], "`entry`: Entry, $0000")
+        self.assertIsNone(self._request("textDocument/hover", self._position(self.main, 9, 0)))
+
+    def test_include_prelude_again(self):
+        code = '#INCLUDE "gbz80/instr.asm"\n' + MAIN
+        self._notify("textDocument/didChange", {"textDocument": {"uri": path_to_uri(self.main), "version": 2}, "contentChanges": [{"text": code}]})
+        self.assertEqual(self._diagnostics().get(path_to_uri(self.main), []), [])
+
+    def _processed_files(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            diagnostics = self._diagnostics()
+        return diagnostics, [line.split(": ", 1)[1] for line in output.getvalue().splitlines() if line.startswith("Processing file: ")]
+
+    def test_unchanged_includes_are_not_processed(self):
+        self._processed_files()
+        self._notify("textDocument/didChange", {"textDocument": {"uri": path_to_uri(self.main), "version": 2}, "contentChanges": [{"text": MAIN + "; comment\n"}]})
+        _, files = self._processed_files()
+        self.assertEqual(files, [self.main])
+        self._notify("textDocument/didOpen", {"textDocument": {"uri": path_to_uri(self.util), "languageId": "gbhla", "version": 1, "text": UTIL.replace("_a * 2", "_a * 3")}})
+        diagnostics, files = self._processed_files()
+        self.assertEqual(files, [self.main, self.util, self.main])
+        self.assertEqual(diagnostics.get(path_to_uri(self.main), []), [])
+        self._notify("textDocument/didChange", {"textDocument": {"uri": path_to_uri(self.util), "version": 2}, "contentChanges": [{"text": UTIL.replace("#FMACRO DOUBLE", "#FMACRO TRIPLE")}]})
+        diagnostics, files = self._processed_files()
+        self.assertEqual(files, [self.main, self.util, self.main])
+        self.assertEqual(diagnostics[path_to_uri(self.main)][0]["range"]["start"]["line"], 5)
+
+    def test_include_moved(self):
+        self._processed_files()
+        self._notify("textDocument/didChange", {"textDocument": {"uri": path_to_uri(self.main), "version": 2}, "contentChanges": [{"text": "\n" + MAIN.replace('"util.asm"', '"missing.asm"')}]})
+        diagnostics = self._diagnostics()[path_to_uri(self.main)]
+        self.assertEqual(diagnostics[0]["range"]["start"]["line"], 2)
+        self.assertEqual(diagnostics[0]["message"], "File not found: missing.asm")
+
+    def test_messages(self):
+        stream = io.BytesIO()
+        write_message(stream, {"jsonrpc": "2.0", "id": 1, "result": "ä"})
+        write_message(stream, {"jsonrpc": "2.0", "method": "exit"})
+        stream.seek(0)
+        self.assertEqual(read_message(stream), {"jsonrpc": "2.0", "id": 1, "result": "ä"})
+        self.assertEqual(read_message(stream), {"jsonrpc": "2.0", "method": "exit"})
+        self.assertIsNone(read_message(stream))
@@ -1,10 +1,13 @@
 import unittest
 from main import Assembler, AssemblerException
+from tokenizer import RawBlock
 
 
 class TestAssemblerFMacro(unittest.TestCase):
+    lazy_macros = False
+
     def _simple(self, macro: str, code: str) -> bytes:
-        a = Assembler()
+        a = Assembler(lazy_macros=self.lazy_macros)
         a.process_code(f'{macro}\n#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "TEST", ROM0[0] {{    \n{code}\n }}')
         s = a.link()
         self.assertEqual(len(s), 1)
@@ -55,3 +58,38 @@ class TestAssemblerFMacro(unittest.TestCase):
     def test_duplicate_definition_args_complex(self):
         with self.assertRaises(AssemblerException) as context:
             self._simple('#MACRO TEST [_a] { db 1 }\n#MACRO TEST [_b] { db 2}', "")
+
+
+class TestLazyMacro(TestAssemblerFMacro):
+    lazy_macros = True
+
+    def test_duplicate(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._simple("#MACRO TEST _a { db _a }\n#MACRO TEST _b { db _b }", "")
+        self.assertEqual(context.exception.message, "Duplicate macro")
+
+    def test_error_location(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._simple("#MACRO TEST {\n  db 1\n  unknown\n}", "test")
+        self.assertEqual(context.exception.token.line_nr, 3)
+
+    def test_unused_body_is_not_tokenized(self):
+        self.assertEqual(self._simple("#MACRO UNUSED {\n  db ?\n}\n#MACRO TEST { db $01 }", "test"), b'\x01')
+
+    def test_tokenize_error_location(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._simple("#MACRO TEST {\n  db 1\n  db ?\n}", "test")
+        self.assertEqual(context.exception.token.line_nr, 3)
+        with self.assertRaises(AssemblerException) as context:
+            self._simple("#MACRO TEST {\n  db 1\n}\n?", "test")
+        self.assertEqual(context.exception.token.line_nr, 4)
+
+    def test_body_is_tokenized_once(self):
+        tokens = RawBlock.tokens
+        blocks = []
+        RawBlock.tokens = lambda block: blocks.append(block.code) or tokens(block)
+        try:
+            self.assertEqual(self._simple("#MACRO TEST { db $01 }\n#MACRO UNUSED { db $02 }", "test\ntest\ntest"), b'\x01\x01\x01')
+        finally:
+            RawBlock.tokens = tokens
+        self.assertEqual(blocks, [" db $01 "])
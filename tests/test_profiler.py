@@ -0,0 +1,106 @@
+import contextlib
+import io
+import os
+import tempfile
+import tracemalloc
+import unittest
+from main import Assembler, AssemblerException, build_roms
+
+
+CODE = """
+#LAYOUT ROM0[$0000, $4000], AT[0]
+#MACRO nop { db $00 }
+#SECTION "TEST", ROM0[0] {
+    nop
+    db 1 + 2
+}
+"""
+
+
+class TestProfiler(unittest.TestCase):
+    def test_disabled(self):
+        a = Assembler()
+        a.process_code(CODE)
+        a.link()
+        self.assertEqual(a.profiler.to_json(), {})
+
+    def test_phases(self):
+        a = Assembler(profile=True)
+        a.process_code(CODE)
+        a.link()
+        a.build_rom()
+        result = a.profiler.to_json()
+        self.assertEqual(result["tokenize"]["[string]"]["calls"], 1)
+        self.assertEqual(result["directive"]["#SECTION"]["calls"], 1)
+        self.assertEqual(result["directive"]["DB"]["calls"], 2)
+        self.assertEqual(result["macro"]["expand"]["calls"], 1)
+        self.assertEqual(result["macro"]["lookup"]["calls"], 1)
+        self.assertIn("parse", result["expression"])
+        self.assertEqual(set(result["link"].keys()), {"allocation", "relocation"})
+        self.assertEqual(result["build"]["rom"]["calls"], 1)
+        self.assertIn("#SECTION", a.profiler.report())
+
+
+class TestMacroStats(unittest.TestCase):
+    def _stats(self, code: str):
+        a = Assembler(macro_stats=True)
+        a.process_code(f'#LAYOUT ROM0[$0000, $4000], AT[0]\n{code}')
+        a.link()
+        return {entry["macro"]: entry for entry in a.macro_stats.to_json()}
+
+    def test_depth(self):
+        stats = self._stats("#MACRO INNER { db 1 }\n#MACRO OUTER { inner\ninner }\n#SECTION \"TEST\", ROM0[0] {\nouter\nouter\n}")
+        self.assertEqual(stats["OUTER"]["invocations"], 2)
+        self.assertEqual(stats["OUTER"]["max_depth"], 1)
+        self.assertEqual(stats["INNER"]["invocations"], 4)
+        self.assertEqual(stats["INNER"]["max_depth"], 2)
+        self.assertEqual(stats["INNER"]["tokens"], 4 * 3)
+
+    def test_candidates(self):
+        stats = self._stats("#MACRO TEST 1 { db 1 }\n#MACRO TEST 2 { db 2 }\n#SECTION \"TEST\", ROM0[0] {\ntest 2\n}")
+        self.assertEqual(stats["TEST 2"]["candidates"], 2)
+        self.assertNotIn("TEST 1", stats)
+
+    def test_block_chain(self):
+        stats = self._stats("#MACRO TEST { db 1 } end { db 2 } else { db 4 }\n#SECTION \"TEST\", ROM0[0] {\ntest { db 6\n} else { db 7\n }\n}")
+        self.assertEqual(stats["TEST"]["invocations"], 1)
+        self.assertEqual(stats["else"]["invocations"], 1)
+
+    def test_fmacro(self):
+        stats = self._stats("#FMACRO FUNC _a { _a + 5 }\n#SECTION \"TEST\", ROM0[0] {\ndb FUNC(1), FUNC(2)\n}")
+        self.assertEqual(stats["FUNC _a"]["invocations"], 2)
+        self.assertEqual(stats["FUNC _a"]["tokens"], 6)
+
+
+class TestMemoryReport(unittest.TestCase):
+    def test_phases(self):
+        # Another assembler that is alive at the same time is not counted.
+        other = Assembler()
+        other.process_code(CODE.replace("nop", "other_nop"))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "main.asm")
+            with open(filename, "wt") as f:
+                f.write(CODE)
+            a = Assembler(memory_report=True, statement_cache=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                a.process_file(filename)
+        a.link()
+        a.build_rom()
+        self.assertFalse(tracemalloc.is_tracing())
+        phases = a.memory_report.to_json()
+        self.assertEqual([phase["phase"] for phase in phases], ["process", "link", "build"])
+        self.assertEqual(phases[0]["objects"]["macros"]["count"], 1)
+        self.assertGreater(phases[0]["objects"]["tokens"]["count"], 0)
+        self.assertEqual(phases[-1]["counts"]["section bytes"], 2)
+        self.assertEqual(phases[-1]["caches"]["statement cache"], {"entries": 1, "limit": None})
+        self.assertIn("tokens", a.memory_report.report())
+        self.assertIn("statement cache", a.memory_report.report())
+
+    def test_stopped_after_error(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "main.asm")
+            with open(filename, "wt") as f:
+                f.write(CODE + "unknown_macro\n")
+            with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(AssemblerException):
+                build_roms([filename, filename], memory_report=True)
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,142 @@
+import os
+import struct
+import tempfile
+import unittest
+from main import Assembler, AssemblerException
+
+
+def _string(s: str) -> bytes:
+    return s.encode() + b'\x00'
+
+
+def build_object(symbols, sections) -> bytes:
+    """Build a minimal RGB9 revision 13 object file.
+    symbols: list of (name, section_id, value), section_id -1 for an import.
+    sections: list of (name, type, data, patches) or (name, type, data, patches, (align_bits, align_offset)),
+    patches being (offset, patch_type, rpn)."""
+    result = b'RGB9' + struct.pack("<IIII", 13, len(symbols), len(sections), 1)
+    result += struct.pack("<iIB", -1, 0, 2) + _string("test.asm")
+    for name, section_id, value in symbols:
+        result += _string(name)
+        if section_id == -1:
+            result += bytes([1])
+        else:
+            result += bytes([2]) + struct.pack("<iiii", 0, 1, section_id, value)
+    for idx, (name, section_type, data, patches, *align) in enumerate(sections):
+        align_bits, align_offset = align[0] if align else (0, 0)
+        result += _string(name) + struct.pack("<iiiBiiBi", 0, 1, len(data), section_type, -1, -1, align_bits, align_offset)
+        if section_type in {2, 3}:
+            result += data + struct.pack("<I", len(patches))
+            for offset, patch_type, rpn in patches:
+                result += struct.pack("<iiiiiBi", 0, 1, offset, idx, offset - 1, patch_type, len(rpn)) + rpn
+    result += struct.pack("<I", 0)
+    return result
+
+
+def rpn_symbol(symbol_id: int) -> bytes:
+    return bytes([0x81]) + struct.pack("<I", symbol_id)
+
+
+def rpn_value(value: int) -> bytes:
+    return bytes([0x80]) + struct.pack("<i", value)
+
+
+class TestRGBDS(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _build(self, object_data: bytes, code: str) -> Assembler:
+        with open(os.path.join(self.tmpdir.name, "test.o"), "wb") as f:
+            f.write(object_data)
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code(f'#LAYOUT ROM0[$0000, $4000], AT[0]\n#LAYOUT WRAM0[$C000, $D000]\n#INCRGBDS "test.o"\n{code}')
+        a.link()
+        return a
+
+    def test_import(self):
+        obj = build_object([("start", 0, 0), ("target", 0, 3), ("var", 1, 0)], [
+            ("code", 3, b'\x3E\x00\xC3\x00\x00\xC9', [(1, 0, rpn_value(5)), (3, 1, rpn_symbol(1))]),
+            ("vars", 0, b'\x00\x00', []),
+        ])
+        a = self._build(obj, "")
+        code = a.get_sections("ROM0")[0]
+        self.assertEqual(code.data, b'\x3E\x05\xC3\x03\x00\xC9')
+        section, offset = a.get_label("var")
+        self.assertEqual(section.layout.name, "WRAM0")
+        self.assertEqual(section.base_address + offset, 0xC000)
+
+    def test_reference_from_asm(self):
+        obj = build_object([("target", 0, 1)], [("code", 3, b'\x00\x00', [])])
+        a = self._build(obj, '#SECTION "asm", ROM0 { dw target\n }')
+        self.assertEqual(a.get_sections("ROM0")[1].data, b'\x01\x00')
+
+    def test_duplicate_label(self):
+        obj = build_object([("target", 0, 1)], [("code", 3, b'\x00\x00', [])])
+        with self.assertRaises(AssemblerException) as context:
+            self._build(obj, '#SECTION "asm", ROM0 { target:\n }')
+        self.assertIn("Duplicate label", context.exception.message)
+
+    def test_rpn_operators(self):
+        obj = build_object([("target", 0, 4)], [("code", 3, b'\x00\x00\x00\x00\x00', [
+            (0, 0, rpn_symbol(0) + bytes([0x70])),
+            (1, 0, rpn_symbol(0) + rpn_value(2) + bytes([0x00, 0x71])),
+            (2, 0, rpn_value(3) + rpn_value(2) + bytes([0x32])),
+            (3, 0, rpn_value(0xFF80) + bytes([0x60])),
+        ])])
+        a = self._build(obj, "")
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x00\x06\x01\x80\x00')
+
+    def test_jr(self):
+        obj = build_object([("target", 0, 0)], [("code", 3, b'\x18\x00', [(1, 3, rpn_symbol(0))])])
+        a = self._build(obj, "")
+        self.assertEqual(a.get_sections("ROM0")[0].data, b'\x18\xFE')
+
+    def test_jr_out_of_range(self):
+        obj = build_object([("target", 1, 150)], [("code", 3, b'\x18\x00', [(1, 3, rpn_symbol(0))]), ("far", 3, bytes(200), [])])
+        with self.assertRaises(AssemblerException) as context:
+            self._build(obj, '#SECTION "pad", ROM0[2] {\nds 10\n}')
+        self.assertIn("JR out of range", context.exception.message)
+
+    def test_bank(self):
+        obj = build_object([("target", 0, 0)], [("code", 2, b'\x00', [(0, 0, bytes([0x50]) + struct.pack("<I", 0))])])
+        with open(os.path.join(self.tmpdir.name, "test.o"), "wb") as f:
+            f.write(obj)
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code('#LAYOUT ROMX[$4000, $8000], AT[$4000], BANKED[1, 4]\n#SECTION "A", ROMX, BANK[1] {\nds $4000\n}\n#INCRGBDS "test.o"')
+        a.link()
+        self.assertEqual(a.get_section("code").data, b'\x02')
+
+    def test_missing_symbol(self):
+        obj = build_object([("missing", -1, 0)], [("code", 3, b'\x00\x00', [(0, 1, rpn_symbol(0))])])
+        with self.assertRaises(AssemblerException) as context:
+            self._build(obj, "")
+        self.assertIn("missing", context.exception.message)
+        self.assertEqual(context.exception.token.filename, "test.asm")
+
+    def test_multiple(self):
+        with open(os.path.join(self.tmpdir.name, "a.o"), "wb") as f:
+            f.write(build_object([("a", 0, 0)], [("code_a", 3, b'\x01', [(0, 0, rpn_symbol(0))])]))
+        with open(os.path.join(self.tmpdir.name, "b.o"), "wb") as f:
+            f.write(build_object([("b", 0, 0)], [("code_b", 3, b'\x02', [])]))
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#INCRGBDS "*.o"')
+        a.link()
+        self.assertEqual([s.name for s in a.get_sections("ROM0")], ["code_a", "code_b"])
+        self.assertEqual(a.get_label_address("b"), 1)
+
+    def test_alignment(self):
+        obj = build_object([("table", 0, 0)], [("table", 3, b'\x01\x02', [], (4, 2))])
+        a = self._build(obj, '#SECTION "code", ROM0 {\ndb 0\n}')
+        self.assertEqual(a.get_label_address("table"), 2)
+        self.assertEqual(a.get_section("code").base_address, 0)
+
+    def test_invalid(self):
+        for data in (b'', b'RGB6' + bytes(16), build_object([], [])[:4] + struct.pack("<IIII", 12, 0, 0, 0)):
+            with self.assertRaises(AssemblerException):
+                self._build(data, "")
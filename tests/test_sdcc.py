@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+from main import Assembler, AssemblerException
+from sdcc import Area
+
+
+REL = """XL4
+H 1 areas 3 global symbols
+M test
+O -mgbz80 -msm83
+S _ext Ref0000
+A _CODE size 6 flags 0 addr 0
+S _main Def0000
+S _other Def0003
+T 00 00 00 00 C3 03 00 CD 00 00
+R 00 00 00 00 00 05 00 00 02 08 00 00
+"""
+
+LST = "\n".join([
+    " " * 40 + "_main::",
+    " " * 40 + ";test.c:10",
+    "    00000000" + " " * 28 + "jp",
+    " " * 40 + "_other::",
+    " " * 40 + ";test.c:20",
+    "    00000003" + " " * 28 + "call",
+    "",
+])
+
+
+class TestSDCC(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmpdir.name, "test.rel"), "wt") as f:
+            f.write(REL)
+        with open(os.path.join(self.tmpdir.name, "test.lst"), "wt") as f:
+            f.write(LST)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _build(self, code: str) -> Assembler:
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code(f'#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "asm", ROM0[0] {{\nds 2\n{code}\n}}\n#INCSDCC "test.rel"')
+        a.link()
+        return a
+
+    def test_import(self):
+        a = self._build("_ext:")
+        self.assertEqual(a.get_section("test_CODE").data, b'\xC3\x05\x00\xCD\x02\x00')
+        section, offset = a.get_label("_other")
+        self.assertEqual(section.base_address + offset, 5)
+
+    def test_debug_labels(self):
+        a = self._build("_ext:")
+        section, offset = a.get_label("#test.c:20")
+        self.assertEqual(section.base_address + offset, 5)
+
+    def test_missing_symbol_location(self):
+        with self.assertRaises(AssemblerException) as context:
+            self._build("")
+        self.assertEqual(context.exception.token.filename, "test.c")
+        self.assertEqual(context.exception.token.line_nr, 20)
+
+    def _write_second(self, symbol: str) -> None:
+        with open(os.path.join(self.tmpdir.name, "test2.rel"), "wt") as f:
+            f.write(f"XL4\nH 1 areas 1 global symbols\nM test2\nO -mgbz80 -msm83\nA _CODE size 1 flags 0 addr 0\nS {symbol} Def0000\nT 00 00 00 00 C9\nR 00 00 00 00\n")
+
+    def test_glob(self):
+        self._write_second("_second")
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "asm", ROM0[0] {\n_ext:\n}\n#INCSDCC "test*.rel"')
+        a.link()
+        self.assertEqual(a.get_section("test2_CODE").data, b'\xC9')
+        self.assertEqual([s.name for s in a.get_sections("ROM0")], ["asm", "test_CODE", "test2_CODE"])
+
+    def test_list_duplicate_label(self):
+        self._write_second("_other")
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        with self.assertRaises(AssemblerException) as context:
+            a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#INCSDCC "test.rel", "test2.rel"')
+        self.assertIn("Duplicate label", context.exception.message)
+        self.assertEqual(context.exception.token.value, "_other")
+
+    def test_object_cache(self):
+        cache_path = os.path.join(self.tmpdir.name, "cache")
+        for n in range(2):
+            a = Assembler()
+            a.add_include_path(self.tmpdir.name)
+            a.set_object_cache(cache_path)
+            a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "asm", ROM0[0] {\nds 2\n_ext:\n}\n#INCSDCC "test.rel"')
+            a.link()
+            self.assertEqual(a.get_section("test_CODE").data, b'\xC3\x05\x00\xCD\x02\x00')
+            self.assertEqual(len(os.listdir(cache_path)), 1)
+        with open(os.path.join(self.tmpdir.name, "test.lst"), "at") as f:
+            f.write("\n")
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.set_object_cache(cache_path)
+        a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#INCSDCC "test.rel"')
+        self.assertEqual(len(os.listdir(cache_path)), 2)
+        # A truncated entry is parsed again.
+        for name in os.listdir(cache_path):
+            with open(os.path.join(cache_path, name), "r+b") as f:
+                f.truncate(os.path.getsize(f.name) // 2)
+        a = Assembler()
+        a.add_include_path(self.tmpdir.name)
+        a.set_object_cache(cache_path)
+        a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#SECTION "asm", ROM0[0] {\nds 2\n_ext:\n}\n#INCSDCC "test.rel"')
+        a.link()
+        self.assertEqual(a.get_section("test_CODE").data, b'\xC3\x05\x00\xCD\x02\x00')
+
+    def test_unknown_patch_mode(self):
+        area = Area(None, "_CODE", "_CODE", 4, 0, 0)
+        with self.assertRaises(NotImplementedError) as context:
+            area.add_data(0, b'\x00\x01\x02\x03', [(1, 0x55, "_sym")])
+        self.assertIn("mode: 55", str(context.exception))
+        self.assertIn("offset 1 of area _CODE, target _sym, data 010203", str(context.exception))
@@ -0,0 +1,58 @@
+import unittest
+from main import Assembler
+
+
+CODE = """
+CONSTANT = $12
+#SECTION "TEST", ROM0[0] {
+start:
+    nop
+    ld a, b
+    ld a, CONSTANT
+    ld hl, start
+    bit 3, [hl]
+    set 7, a
+    jr start
+    nop
+    ld a, b
+    bit 3, [hl]
+    set 7, a
+    jr start
+    CONSTANT = $34
+    ld a, CONSTANT
+    ld hl, start
+}
+"""
+
+
+class TestStatementCache(unittest.TestCase):
+    def _build(self, code: str, cache: bool) -> bytes:
+        a = Assembler(statement_cache=cache)
+        a.process_code(f'#INCLUDE "gbz80/all.asm"\n{code}')
+        for section in a.link():
+            if section.name == "TEST":
+                return section.data
+        return b'ERR'
+
+    def test_same_as_macros(self):
+        self.assertEqual(self._build(CODE, True), self._build(CODE, False))
+
+    def test_new_macro(self):
+        code = '#MACRO test _a { db _a }\n#SECTION "TEST", ROM0[0] {\ntest 1\n#MACRO test 1 { db $FF }\ntest 1\n}'
+        self.assertEqual(self._build(code, True), b'\x01\xFF')
+
+    def test_defined(self):
+        code = '#MACRO test { #IF DEFINED(VALUE) {\ndb 1\n} ELSE {\ndb 2\n}\n}\n#SECTION "TEST", ROM0[0] {\ntest\nVALUE = 1\ntest\n}'
+        self.assertEqual(self._build(code, True), b'\x02\x01')
+
+    def test_concat(self):
+        code = '#MACRO test _a { inc h ## _a }\n#SECTION "TEST", ROM0[0] {\nX = "l"\ntest X\nX = ""\ntest X\n}'
+        self.assertEqual(self._build(code, True), b'\x23\x24')
+
+    def test_labels(self):
+        code = '#MACRO test { .local:\ndw .local\n}\n#SECTION "TEST", ROM0[0] {\nglobal1:\ntest\nglobal2:\ntest\n}'
+        self.assertEqual(self._build(code, True), b'\x00\x00\x02\x00')
+
+    def test_concat_new_constant(self):
+        code = '#MACRO test _a { inc h ## _a }\n#SECTION "TEST", ROM0[0] {\ntest l\nl = ""\ntest l\n}'
+        self.assertEqual(self._build(code, True), b'\x23\x24')
@@ -0,0 +1,44 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from main import build_roms
+
+
+def _source(nr: int) -> str:
+    # Anonymous labels used to go through a global in the expression parser, so every build uses a different amount.
+    lines = ['#INCLUDE "gbz80/all.asm"', f'GB_HEADER "THREAD{nr}", GB_MCB_ROM_ONLY, entry', f'VALUE = {nr}']
+    lines.append('#SECTION "Entry", ROM0 {\nentry:')
+    for n in range(40 + nr * 7):
+        lines.append(f"    ld a, VALUE + {n}\n:\n    jr nz, :-\n    jr z, :+\n    ld hl, label{n % 5}\n:")
+    for n in range(5):
+        lines.append(f"label{n}:\n    ld [hl], {n}")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for nr in range(8):
+            filename = os.path.join(self.tmpdir.name, f"rom{nr}.asm")
+            with open(filename, "wt") as f:
+                f.write(_source(nr))
+            self.filenames.append(filename)
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_same_as_serial(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            serial = [a.get_rom() for a in build_roms(self.filenames, max_workers=1)]
+            for _ in range(2):
+                parallel = [a.get_rom() for a in build_roms(self.filenames * 2, max_workers=8, line_memo=True, statement_cache=True)]
+                self.assertEqual(parallel, serial * 2)
+        self.assertEqual(len(set(bytes(rom) for rom in serial)), len(serial))
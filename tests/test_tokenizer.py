@@ -0,0 +1,106 @@
+import copy
+import pickle
+import unittest
+import tokenizer
+from tokenizer import Token, Tokenizer, LineMemo, fold
+
+
+class TestToken(unittest.TestCase):
+    def test_case_insensitive_key(self):
+        tok = Tokenizer()
+        tok.add_code("Label label #Macro \"Text\"", filename="test.asm")
+        a, b, directive, string = tok.pop(), tok.pop(), tok.pop(), tok.pop()
+        self.assertTrue(a.match(b))
+        self.assertIs(a.key, b.key)
+        self.assertEqual(a.value, "Label")
+        self.assertTrue(directive.isA('DIRECTIVE', '#MACRO'))
+        self.assertEqual(string.key, "Text")
+        self.assertEqual(a.filename, "test.asm")
+        self.assertIs(a.filename, string.filename)
+
+    def test_pickle(self):
+        token = Token('ID', 'Name', 12, "file.asm")
+        result = pickle.loads(pickle.dumps(token))
+        self.assertEqual(result, token)
+        self.assertEqual(result.filename, "file.asm")
+        self.assertEqual(result.key, "NAME")
+
+    def test_keys_limit(self):
+        limit = tokenizer._KEYS_LIMIT
+        tokenizer._KEYS_LIMIT = 4
+        try:
+            keys = [fold(f"name_{n}") for n in range(10)]
+            self.assertLessEqual(len(tokenizer._keys), 4)
+            self.assertIs(fold("name_1"), keys[1])
+        finally:
+            tokenizer._KEYS_LIMIT = limit
+
+    def test_copy(self):
+        token = Token('NUMBER', 1, 1, "file.asm")
+        self.assertIs(copy.deepcopy([token])[0], token)
+
+
+class TestTokenizer(unittest.TestCase):
+    def test_pop_block(self):
+        tok = Tokenizer()
+        tok.add_code("a { b { c } d } e")
+        self.assertEqual(tok.pop().value, "a")
+        tok.expect('{')
+        self.assertEqual([t.value for t in tok.pop_block()], ["b", "{", "c", "}", "d"])
+        self.assertEqual(tok.pop().value, "e")
+
+    def test_skip_block(self):
+        tok = Tokenizer()
+        tok.add_code("{ b { c } } e")
+        tok.expect('{')
+        self.assertTrue(tok.skip_block())
+        self.assertEqual(tok.pop().value, "e")
+
+    def test_block_from_prepend(self):
+        tok = Tokenizer()
+        tok.add_code("} e")
+        tok.prepend([Token('{', '{', 1, ''), Token('ID', 'b', 1, '')])
+        tok.expect('{')
+        self.assertIsNone(tok.pop_block())
+        self.assertFalse(tok.skip_block())
+        self.assertEqual(tok.pop().value, "b")
+
+    def test_concat_over_prepend(self):
+        tok = Tokenizer({"n": 5})
+        tok.add_code("## n tail")
+        tok.prepend([Token('ID', 'label_', 1, '')])
+        self.assertEqual(tok.pop().value, "label_5")
+        self.assertEqual(tok.pop().value, "tail")
+        self.assertEqual(len(tok), 0)
+
+    def test_memoize_lines(self):
+        code = 'a: ld a, "x"\n  ld a, [hl+] ; "comment\n  ld a, [hl+] ; "comment\ndb "multi\nline", \\\n  2\n{ a }\ndb "multi\nline"\n{ a }\ndb "end'
+        line_memo = LineMemo()
+        for _ in range(2):
+            normal = Tokenizer()
+            normal.add_code(code + '"', filename="a.asm")
+            memo = Tokenizer()
+            memo.add_code(code + '"', filename="a.asm", line_memo=line_memo)
+            while (token := normal.pop()).kind != 'EOF':
+                self.assertEqual(memo.pop(), token)
+                if token.kind == '{':
+                    self.assertEqual([t.value for t in memo.pop_block()], [t.value for t in normal.pop_block()])
+            self.assertEqual(memo.pop(), token)
+        self.assertGreater(line_memo.hits, 0)
+
+    def test_line_memo_low_hit_rate(self):
+        line_memo = LineMemo()
+        line_memo.WARMUP = 10
+        code = "".join(f"label_{n}: {{ db {n} }}\n" for n in range(20))
+        normal = Tokenizer()
+        normal.add_code(code, filename="a.asm")
+        memo = Tokenizer()
+        memo.add_code(code, filename="a.asm", line_memo=line_memo)
+        # Lines after the warmup are tokenized without the memo, with the same result.
+        self.assertEqual(line_memo.lookups, 10)
+        self.assertFalse(line_memo.useful)
+        while (token := normal.pop()).kind != 'EOF':
+            self.assertEqual(memo.pop(), token)
+            if token.kind == '{':
+                self.assertEqual(len(memo.pop_block()), len(normal.pop_block()))
+        self.assertEqual(memo.pop(), token)
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from main import Assembler, AssemblerException, build_variants, _parse_define
+
+
+CODE = """
+#INCLUDE_ONCE "gbz80/layout.asm"
+#INCLUDE_ONCE "gbz80/instr.asm"
+#INCLUDE_ONCE "gbz80/regs.asm"
+#INCLUDE_ONCE "gbz80/header.asm"
+GB_HEADER "VARIANT", GB_MCB_ROM_ONLY, entry
+#SECTION "Entry", ROM0 {
+entry:
+    #IF DEFINED(CGB) {
+        ld a, CGB
+    } ELSE {
+        xor a, a
+    }
+    ld [wValue], a
+    #IF DEFINED(BANKED_WRAM) {
+        ld a, BANK(wValue)
+    }
+}
+#SECTION "Value", WRAM0 {
+wValue:
+    ds 1
+}
+"""
+
+VARIANTS = {
+    "dmg": {},
+    "cgb": {"CGB": 1},
+    "cgb_banked": {"CGB": 2, "BANKED_WRAM": 1},
+}
+
+
+class TestVariants(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "main.asm")
+        with open(self.filename, "wt") as f:
+            f.write(CODE)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _build(self, constants) -> bytes:
+        a = Assembler()
+        for name, value in constants.items():
+            a.set_constant(name, value)
+        a.process_file(self.filename)
+        a.link()
+        return a.build_rom()
+
+    def test_same_as_separate_builds(self):
+        prelude = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gbz80", "instr.asm")]
+        with contextlib.redirect_stdout(io.StringIO()):
+            separate = {name: self._build(constants) for name, constants in VARIANTS.items()}
+            variants = build_variants(self.filename, VARIANTS, prelude=prelude, max_workers=2)
+        self.assertEqual({name: a.get_rom() for name, a in variants.items()}, separate)
+        self.assertEqual(len(set(bytes(rom) for rom in separate.values())), len(VARIANTS))
+
+    def test_prelude_uses_variant_constant(self):
+        prelude = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gbz80", "layout.asm")]
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(AssemblerException) as context:
+                build_variants(self.filename, VARIANTS, prelude=prelude, max_workers=2)
+        self.assertIn("BANKED_WRAM", context.exception.message)
+
+    def test_clone(self):
+        a = Assembler()
+        a.process_code('#LAYOUT ROM0[$0000, $4000], AT[0]\n#MACRO test { db 1 }\n#SECTION "TEST", ROM0[0] {\ntest\n}')
+        b = a.clone()
+        b.process_code('#MACRO test 2 { db 2 }\n#SECTION "MORE", ROM0 {\ntest 2\n}')
+        self.assertEqual(len(b.link()), 2)
+        self.assertEqual(len(a.get_sections("ROM0")), 1)
+        with self.assertRaises(AssemblerException):
+            a.process_code('#SECTION "MORE", ROM0 {\ntest 2\n}')
+
+    def test_parse_define(self):
+        self.assertEqual(_parse_define("DEBUG"), ("DEBUG", 1))
+        self.assertEqual(_parse_define("LEVEL=0x10"), ("LEVEL", 16))
+        self.assertEqual(_parse_define("NAME=test"), ("NAME", "test"))